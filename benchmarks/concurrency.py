@@ -0,0 +1,259 @@
+"""Benchmark concurrent reads and writes on the shopping item endpoints.
+
+Usage, from the repository root:
+
+    python -m benchmarks.concurrency --tier small --threads 8 --duration 10
+
+Worker threads call the WSGI application directly, the way threaded server
+workers do, so connections are opened and closed per request just like in a
+deployment. Each thread lists, adds and purchases items of the busiest list
+of the tier's database. The run is repeated with the development and the
+production database profile (DJANGO_DB_PROFILE), each in its own process on
+a fresh copy of the data, and the throughput, latencies, errors and opened
+database connections of both are printed side by side.
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test import Client
+from django.urls import reverse
+from benchmarks.run import BENCHMARKS_DIR, TIERS, percentile, prepare_database
+from shopping_list.models import ShoppingList
+
+PROFILES = ["development", "production"]
+
+# Any 32 alphanumeric characters make a valid CSRF secret.
+CSRF_TOKEN = "benchmarkbenchmarkbenchmarkbench"
+
+
+class Worker(threading.Thread):
+    def __init__(self, app, shopping_list, cookies, deadline, write_ratio, seed):
+        super().__init__()
+        self.app = app
+        self.shopping_list = shopping_list
+        self.cookies = cookies
+        self.deadline = deadline
+        self.write_ratio = write_ratio
+        self.rng = random.Random(seed)
+        self.name_prefix = f"Concurrent {seed}"
+        self.item_ids = []
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def call(self, method, path, data=None):
+        body = b"" if data is None else json.dumps(data).encode()
+        environ = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+            "HTTP_ACCEPT": "application/json",
+            "HTTP_COOKIE": self.cookies,
+            "HTTP_X_CSRFTOKEN": CSRF_TOKEN,
+            "wsgi.input": BytesIO(body),
+        }
+        setup_testing_defaults(environ)
+        result = {}
+
+        def start_response(status, headers, exc_info=None):
+            result["status"] = int(status.split()[0])
+
+        response = self.app(environ, start_response)
+        try:
+            content = b"".join(response)
+        finally:
+            # Fires request_finished, which closes expired connections.
+            response.close()
+        return result["status"], content
+
+    def step(self):
+        items_url = reverse("list-add-shopping-item", args=[self.shopping_list])
+        if self.rng.random() >= self.write_ratio:
+            return "GET items", self.call("GET", items_url)[0]
+        if not self.item_ids or self.rng.random() < 0.5:
+            status, content = self.call(
+                "POST",
+                items_url,
+                {
+                    "name": f"{self.name_prefix}-{len(self.item_ids)}",
+                    "purchased": False,
+                },
+            )
+            if status == 201:
+                self.item_ids.append(json.loads(content)["id"])
+            return "POST item", status
+
+        item_url = reverse(
+            "shopping-item-detail", args=[self.shopping_list, self.item_ids.pop()]
+        )
+        return "PATCH item", self.call("PATCH", item_url, {"purchased": True})[0]
+
+    def run(self):
+        try:
+            while time.monotonic() < self.deadline:
+                start = time.perf_counter()
+                operation, status = self.step()
+                self.timings[operation].append((time.perf_counter() - start) * 1000)
+                if status >= 400:
+                    self.errors[operation] += 1
+        finally:
+            connections.close_all()
+
+
+def run_profile(args):
+    """Run the workers against args.database and print the results as JSON."""
+    connection.settings_dict["NAME"] = args.database
+    if settings.DB_PROFILE != "production":
+        # WAL mode is stored in the file, so undo it for the baseline.
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode=DELETE")
+    # Failed requests are counted instead.
+    logging.getLogger("django.request").setLevel(logging.CRITICAL)
+
+    shopping_list = (
+        ShoppingList.objects.annotate(item_count=Count("shopping_items"))
+        .order_by("-item_count")
+        .first()
+    )
+    client = Client()
+    client.force_login(shopping_list.members.first())
+    cookies = (
+        f"{settings.SESSION_COOKIE_NAME}="
+        f"{client.cookies[settings.SESSION_COOKIE_NAME].value}; "
+        f"{settings.CSRF_COOKIE_NAME}={CSRF_TOKEN}"
+    )
+    connection.close()
+
+    opened = []
+    lock = threading.Lock()
+
+    def count_connection(sender, connection, **kwargs):
+        with lock:
+            opened.append(connection.alias)
+
+    connection_created.connect(count_connection)
+    app = get_wsgi_application()
+    deadline = time.monotonic() + args.duration
+    workers = [
+        Worker(app, shopping_list.id, cookies, deadline, args.write_ratio, seed)
+        for seed in range(args.threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    results = {}
+    for operation in sorted({name for worker in workers for name in worker.timings}):
+        timings = [ms for worker in workers for ms in worker.timings[operation]]
+        results[operation] = {
+            "requests": len(timings),
+            "errors": sum(worker.errors[operation] for worker in workers),
+            "p50_ms": round(percentile(timings, 0.5), 3),
+            "p95_ms": round(percentile(timings, 0.95), 3),
+        }
+    print(
+        json.dumps(
+            {
+                "requests_per_second": round(
+                    sum(result["requests"] for result in results.values())
+                    / args.duration,
+                    1,
+                ),
+                "connections": len(opened),
+                "results": results,
+            }
+        )
+    )
+
+
+def compare_profiles(args):
+    database = prepare_database(args.tier, args.seed)
+    connection.close()
+
+    summaries = {}
+    for profile in PROFILES:
+        copy = BENCHMARKS_DIR / ".data" / f"concurrency-{args.tier}.sqlite3"
+        for suffix in ["", "-wal", "-shm"]:
+            copy.with_name(copy.name + suffix).unlink(missing_ok=True)
+        shutil.copyfile(database, copy)
+
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.concurrency",
+                "--database",
+                str(copy),
+                "--threads",
+                str(args.threads),
+                "--duration",
+                str(args.duration),
+                "--write-ratio",
+                str(args.write_ratio),
+            ],
+            # Debug mode would record every query in memory under one
+            # profile only.
+            env={**os.environ, "DJANGO_DB_PROFILE": profile, "DJANGO_DEBUG": "0"},
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+        summaries[profile] = json.loads(output.splitlines()[-1])
+
+    print(
+        f"{args.threads} threads, {args.duration}s, "
+        f"{args.write_ratio:.0%} writes, tier {args.tier}"
+    )
+    for profile, summary in summaries.items():
+        print(
+            f"{profile:<12} {summary['requests_per_second']:>8.1f} req/s "
+            f"{summary['connections']:>6} connections opened"
+        )
+        for operation, result in summary["results"].items():
+            print(
+                f"  {operation:<12} {result['requests']:>7} requests "
+                f"{result['errors']:>5} errors "
+                f"{result['p50_ms']:>9.2f} ms p50 {result['p95_ms']:>9.2f} ms p95"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tier", choices=TIERS, default="small")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for data")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument(
+        "--write-ratio", type=float, default=0.5, help="share of write requests"
+    )
+    parser.add_argument(
+        "--database", help="run a single profile against this database file"
+    )
+    args = parser.parse_args()
+
+    if args.database:
+        run_profile(args)
+    else:
+        compare_profiles(args)
+
+
+if __name__ == "__main__":
+    main()
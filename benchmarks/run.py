@@ -0,0 +1,407 @@
+"""Benchmark every API route against a seeded database.
+
+Usage, from the repository root:
+
+    python -m benchmarks.run --tier small
+    python -m benchmarks.run --compare base.json head.json
+
+Each tier is seeded once into its own SQLite file under benchmarks/.data and
+reused by later runs. Every case is run against it through the test client,
+and its query count, p50/p95 latency and peak traced memory are written to a
+JSON file under benchmarks/results. Write cases are rolled back, so every run
+sees the same data.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+django.setup()
+
+from django.core.files.uploadedfile import SimpleUploadedFile  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection, reset_queries, transaction  # noqa: E402
+from django.db.models import Count  # noqa: E402
+from django.test.utils import (  # noqa: E402
+    CaptureQueriesContext,
+    setup_test_environment,
+)
+from django.urls import URLPattern, reverse  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+from shopping_list import urls  # noqa: E402
+from shopping_list.api.authentication import issue_token  # noqa: E402
+from shopping_list.cache import get_cache  # noqa: E402
+from shopping_list.models import ShoppingItem, ShoppingList, User  # noqa: E402
+
+BENCHMARKS_DIR = Path(__file__).resolve().parent
+
+STAFF_USERNAME = "benchmark-staff"
+STAFF_PASSWORD = "benchmark-password"
+
+TIERS = {
+    "small": {"users": 50, "lists": 500, "items": 20_000, "max_members": 10},
+    "medium": {"users": 200, "lists": 2_000, "items": 200_000, "max_members": 50},
+    "large": {"users": 1_000, "lists": 10_000, "items": 1_000_000, "max_members": 100},
+}
+
+
+@dataclass
+class Case:
+    route: str
+    method: str
+    path: str
+    data: dict = field(default_factory=dict)
+    format: str = None
+    writes: bool = False
+    staff: bool = False
+    token: bool = False
+
+    @property
+    def name(self):
+        query = self.path.partition("?")[2]
+        return (
+            f"{self.method.upper()} {self.route}"
+            + (f" ?{query}" if query else "")
+            + (" (token)" if self.token else "")
+        )
+
+
+def build_cases():
+    """Return the cases run against the busiest list and one of its members."""
+    shopping_list = (
+        ShoppingList.objects.annotate(item_count=Count("shopping_items"))
+        .order_by("-item_count")
+        .first()
+    )
+    user = shopping_list.members.first()
+    item = shopping_list.shopping_items.filter(purchased=False).first()
+    list_kwargs = {"pk": shopping_list.id}
+    item_kwargs = {"pk": shopping_list.id, "item_pk": item.id}
+    item_ids = list(shopping_list.shopping_items.values_list("id", flat=True)[:100])
+    upload = "\n".join(
+        [json.dumps({"type": "shopping_list", "name": "Imported"})]
+        + [
+            json.dumps(
+                {"type": "shopping_item", "name": f"Item {n}", "purchased": False}
+            )
+            for n in range(100)
+        ]
+    )
+
+    def url(name, query="", **kwargs):
+        return reverse(name, kwargs=kwargs or None) + (f"?{query}" if query else "")
+
+    cases = [
+        Case("all-shopping-lists", "get", url("all-shopping-lists")),
+        Case("all-shopping-lists", "get", url("all-shopping-lists"), token=True),
+        Case("all-shopping-lists", "get", url("all-shopping-lists", "cursor=")),
+        Case(
+            "all-shopping-lists",
+            "post",
+            url("all-shopping-lists"),
+            {"name": "Benchmark"},
+            writes=True,
+        ),
+        Case("shopping-list-detail", "get", url("shopping-list-detail", **list_kwargs)),
+        Case(
+            "shopping-list-detail",
+            "patch",
+            url("shopping-list-detail", **list_kwargs),
+            {"name": "Renamed"},
+            writes=True,
+        ),
+        Case(
+            "shopping-list-detail",
+            "delete",
+            url("shopping-list-detail", **list_kwargs),
+            writes=True,
+        ),
+        Case(
+            "list-add-shopping-item",
+            "get",
+            url("list-add-shopping-item", **list_kwargs),
+        ),
+        Case(
+            "list-add-shopping-item",
+            "get",
+            url("list-add-shopping-item", "cursor=", **list_kwargs),
+        ),
+        Case(
+            "list-add-shopping-item",
+            "post",
+            url("list-add-shopping-item", **list_kwargs),
+            {"name": "Benchmark item", "purchased": False},
+            writes=True,
+        ),
+        Case(
+            "bulk-shopping-items",
+            "post",
+            url("bulk-shopping-items", **list_kwargs),
+            {"action": "purchase", "ids": [str(item_id) for item_id in item_ids]},
+            writes=True,
+        ),
+        Case(
+            "shopping-item-events",
+            "get",
+            url("shopping-item-events", "timeout=0", **list_kwargs),
+        ),
+        Case("shopping-item-detail", "get", url("shopping-item-detail", **item_kwargs)),
+        Case(
+            "shopping-item-detail",
+            "patch",
+            url("shopping-item-detail", **item_kwargs),
+            {"purchased": True},
+            writes=True,
+        ),
+        Case(
+            "shopping-item-detail",
+            "delete",
+            url("shopping-item-detail", **item_kwargs),
+            writes=True,
+        ),
+        Case("export-shopping-list", "get", url("export-shopping-list", **list_kwargs)),
+        Case("export-shopping-lists", "get", url("export-shopping-lists")),
+        Case(
+            "import-shopping-lists",
+            "post",
+            url("import-shopping-lists"),
+            {"file": upload},
+            format="multipart",
+            writes=True,
+        ),
+        Case("sync", "get", url("sync", "limit=1000")),
+        Case("metrics", "get", url("metrics"), staff=True),
+        Case(
+            "issue-token",
+            "post",
+            url("issue-token"),
+            {"username": STAFF_USERNAME, "password": STAFF_PASSWORD},
+        ),
+        Case("async-all-shopping-lists", "get", url("async-all-shopping-lists")),
+        Case(
+            "async-shopping-list-detail",
+            "get",
+            url("async-shopping-list-detail", **list_kwargs),
+        ),
+        Case(
+            "async-list-shopping-items",
+            "get",
+            url("async-list-shopping-items", **list_kwargs),
+        ),
+    ]
+    return user, cases
+
+
+def route_names():
+    return {
+        pattern.name for pattern in urls.urlpatterns if isinstance(pattern, URLPattern)
+    }
+
+
+def request(client, case):
+    """Send the request of a case and read its whole response."""
+    data = dict(case.data)
+    if "file" in data:
+        data["file"] = SimpleUploadedFile("import.ndjson", data["file"].encode())
+    # Cached responses would hide the cost of building them.
+    get_cache().clear()
+    with transaction.atomic() if case.writes else nullcontext():
+        if case.method == "get":
+            response = client.get(case.path)
+        else:
+            response = getattr(client, case.method)(
+                case.path, data, format=case.format or "json"
+            )
+        if response.streaming:
+            b"".join(response.streaming_content)
+        if case.writes:
+            transaction.set_rollback(True)
+    if response.status_code >= 400:
+        raise RuntimeError(f"{case.name} returned {response.status_code}")
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure(client, case, repeat):
+    request(client, case)
+
+    # The query log is a bounded deque, so start counting from an empty one.
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        request(client, case)
+
+    tracemalloc.start()
+    request(client, case)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        request(client, case)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {
+        "route": case.route,
+        "method": case.method.upper(),
+        "queries": len(queries),
+        "p50_ms": round(percentile(timings, 0.5), 3),
+        "p95_ms": round(percentile(timings, 0.95), 3),
+        "peak_memory_kb": round(peak_memory / 1024, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            cwd=BENCHMARKS_DIR,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def prepare_database(tier, seed):
+    """Switch to the tier's database file, seeding it on first use."""
+    data_dir = BENCHMARKS_DIR / ".data"
+    data_dir.mkdir(exist_ok=True)
+    connection.settings_dict["TEST"]["NAME"] = str(data_dir / f"{tier}.sqlite3")
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, keepdb=True)
+
+    if not User.objects.exists():
+        started = time.perf_counter()
+        call_command("seed", **TIERS[tier], seed=seed, stdout=sys.stderr)
+        print(f"Seeded {tier} in {time.perf_counter() - started:.1f}s")
+
+    return connection.settings_dict["NAME"]
+
+
+def run(args):
+    prepare_database(args.tier, args.seed)
+    user, cases = build_cases()
+    missing = route_names() - {case.route for case in cases}
+    if missing:
+        sys.exit(f"No benchmark cases for: {', '.join(sorted(missing))}")
+
+    client = APIClient()
+    client.force_login(user)
+    token_client = APIClient()
+    token_client.credentials(HTTP_AUTHORIZATION=f"Bearer {issue_token(user)}")
+    staff, _ = User.objects.get_or_create(username=STAFF_USERNAME, is_staff=True)
+    if not staff.check_password(STAFF_PASSWORD):
+        staff.set_password(STAFF_PASSWORD)
+        staff.save()
+    staff_client = APIClient()
+    staff_client.force_login(staff)
+    results = {}
+    for case in cases:
+        if args.filter and args.filter not in case.name:
+            continue
+        if case.staff:
+            case_client = staff_client
+        elif case.token:
+            case_client = token_client
+        else:
+            case_client = client
+        results[case.name] = measure(case_client, case, args.repeat)
+        print(format_result(case.name, results[case.name]))
+
+    revision = git_revision()
+    output = Path(
+        args.output or BENCHMARKS_DIR / "results" / f"{revision}-{args.tier}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(
+        json.dumps(
+            {
+                "revision": revision,
+                "tier": args.tier,
+                "sizes": TIERS[args.tier],
+                "repeat": args.repeat,
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "results": results,
+            },
+            indent=2,
+        )
+        + "\n"
+    )
+    print(f"Wrote {output}")
+
+
+def format_result(name, result):
+    return (
+        f"{name:<70} {result['queries']:>4} queries "
+        f"{result['p50_ms']:>9.2f} ms p50 {result['p95_ms']:>9.2f} ms p95 "
+        f"{result['peak_memory_kb']:>9.1f} KiB"
+    )
+
+
+def compare(base_path, head_path, threshold):
+    """Print how each case changed and return whether any of them regressed."""
+    base = json.loads(Path(base_path).read_text())["results"]
+    head = json.loads(Path(head_path).read_text())["results"]
+    regressed = False
+    for name in sorted(base.keys() | head.keys()):
+        if name not in base or name not in head:
+            print(f"{name:<70} only in {'head' if name in head else 'base'}")
+            continue
+        old, new = base[name], head[name]
+        ratio = new["p50_ms"] / old["p50_ms"] if old["p50_ms"] else 1
+        slower = ratio > threshold or new["queries"] > old["queries"]
+        regressed = regressed or slower
+        print(
+            f"{name:<70} queries {old['queries']:>4} -> {new['queries']:<4} "
+            f"p50 {old['p50_ms']:>9.2f} -> {new['p50_ms']:<9.2f} ({ratio:.2f}x) "
+            f"peak {old['peak_memory_kb']:>9.1f} -> {new['peak_memory_kb']:<9.1f} KiB"
+            + ("  REGRESSED" if slower else "")
+        )
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tier", choices=TIERS, default="small")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0, help="random seed for data")
+    parser.add_argument("--filter", help="only run cases whose name contains this")
+    parser.add_argument("--output", help="results file, named after HEAD by default")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASE", "HEAD"),
+        help="compare two results files instead of running",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.2,
+        help="p50 ratio above which --compare reports a regression",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
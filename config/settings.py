@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -19,13 +22,32 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.0/howto/deployment/checklist/
 
+# Either "development" or "production".
+PROFILE = os.environ.get("DJANGO_PROFILE", "development")
+
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = "django-insecure-c-7g$9wjxf06mu&4h6^8bj4#0(*6sy(+mlsgv9_-s&itoc-a(+"
+# It signs sessions and API tokens, so the production profile requires it in
+# DJANGO_SECRET_KEY instead of using the key published with the code.
+SECRET_KEY = os.environ.get(
+    "DJANGO_SECRET_KEY",
+    "django-insecure-c-7g$9wjxf06mu&4h6^8bj4#0(*6sy(+mlsgv9_-s&itoc-a(+",
+)
 
-# SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+if PROFILE == "production" and "DJANGO_SECRET_KEY" not in os.environ:
+    raise ImproperlyConfigured("The production profile requires DJANGO_SECRET_KEY.")
 
-ALLOWED_HOSTS = []
+# SECURITY WARNING: don't run with debug turned on in production!
+# DJANGO_DEBUG=1 or 0 overrides the default, which is on in development only.
+DEBUG = os.environ.get("DJANGO_DEBUG", "1" if PROFILE == "development" else "0") == "1"
+
+# Host names served with debug off, e.g. DJANGO_ALLOWED_HOSTS=example.com.
+ALLOWED_HOSTS = [
+    host
+    for host in os.environ.get(
+        "DJANGO_ALLOWED_HOSTS", ".localhost,127.0.0.1,[::1]"
+    ).split(",")
+    if host
+]
 
 
 # Application definition
@@ -42,6 +64,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "shopping_list.middleware.ServerTimingMiddleware",
+    "shopping_list.middleware.MetricsMiddleware",
+    "shopping_list.middleware.NPlusOneMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -49,6 +74,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "shopping_list.middleware.PinWritersToPrimaryMiddleware",
+    "shopping_list.middleware.CoalesceInteractionsMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
@@ -79,9 +106,96 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+    },
+    # A file copy of the primary standing in for a read replica during
+    # development, refreshed by `manage.py sync_replicas`.
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.replica.sqlite3",
+    },
+    # A second shard for trying out sharding locally, see SHOPPING_LIST_SHARDS.
+    "shard1": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.shard1.sqlite3",
+    },
+}
+
+# PostgreSQL instead of SQLite for the default database.
+if os.environ.get("POSTGRES_DB"):
+    DATABASES["default"] = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": os.environ["POSTGRES_DB"],
+        "USER": os.environ.get("POSTGRES_USER", ""),
+        "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+        "HOST": os.environ.get("POSTGRES_HOST", ""),
+        "PORT": os.environ.get("POSTGRES_PORT", ""),
     }
+
+# Either "development" or "production"; follows PROFILE by default.
+DB_PROFILE = os.environ.get("DJANGO_DB_PROFILE", PROFILE)
+
+if DB_PROFILE == "production":
+    # Debug mode keeps every query of a worker in memory.
+    if "DJANGO_DEBUG" not in os.environ:
+        DEBUG = False
+
+    for database in DATABASES.values():
+        if database["ENGINE"] == "django.db.backends.postgresql":
+            # A psycopg pool shared by all threads of a worker, including the
+            # ones async views run queries in. It replaces CONN_MAX_AGE.
+            database["OPTIONS"] = {
+                "pool": {"min_size": 2, "max_size": 20, "timeout": 10}
+            }
+            continue
+
+        # Every worker thread keeps its connection, checked before reuse.
+        database["CONN_MAX_AGE"] = 600
+        database["CONN_HEALTH_CHECKS"] = True
+        database["OPTIONS"] = {
+            # With write-ahead logging readers and the writer do not block
+            # each other, and NORMAL sync is still safe against corruption.
+            "init_command": (
+                "PRAGMA journal_mode=WAL;"
+                "PRAGMA synchronous=NORMAL;"
+                "PRAGMA mmap_size=268435456;"
+                "PRAGMA cache_size=-20000;"
+                "PRAGMA temp_store=MEMORY"
+            ),
+            # The busy timeout in seconds: writers queue for the lock.
+            "timeout": 20,
+            # Take the write lock when a transaction begins. Upgrading a read
+            # transaction fails at once with "database is locked" instead of
+            # waiting for the busy timeout.
+            "transaction_mode": "IMMEDIATE",
+        }
+
+DATABASE_ROUTERS = [
+    "shopping_list.routers.ShardRouter",
+    "shopping_list.routers.ReplicaRouter",
+]
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Shared by every process on the host.
+    "files": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / ".cache",
+    },
 }
 
+# Shared by every process of every host, e.g. redis://localhost:6379/0.
+if os.environ.get("DJANGO_REDIS_URL"):
+    CACHES["redis"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.environ["DJANGO_REDIS_URL"],
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -125,14 +239,139 @@ STATIC_URL = "static/"
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
-    # "DEFAULT_RENDERER_CLASSES": [
-    #     "rest_framework.renderers.JSONRenderer",
-    # ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "shopping_list.api.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    # Session authentication comes first so that unauthenticated requests
+    # keep getting 403 rather than 401 responses.
+    "DEFAULT_AUTHENTICATION_CLASSES": [
+        "rest_framework.authentication.SessionAuthentication",
+        "rest_framework.authentication.BasicAuthentication",
+        "shopping_list.api.authentication.SignedTokenAuthentication",
+    ],
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticated",
     ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 3,
+    # Password checks at /api/token/ per client.
+    "DEFAULT_THROTTLE_RATES": {"token": "10/minute"},
 }
 
+if PROFILE == "production":
+    REST_FRAMEWORK["DEFAULT_RENDERER_CLASSES"] = [
+        "shopping_list.api.renderers.FastJSONRenderer",
+    ]
+
 AUTH_USER_MODEL = "shopping_list.User"
+
+# Shopping lists touched less than this many seconds ago keep their
+# last_interaction when another of their items changes. Since conditional GETs
+# are based on last_interaction, clients may see such changes late.
+SHOPPING_LIST_INTERACTION_THRESHOLD = 0
+
+# Cache alias holding shopping list responses and their versions, and how
+# long responses are kept in seconds. Every worker process must use the same
+# cache, or the others keep serving responses a write has invalidated; a
+# per-process LocMemCache is therefore only used for responses when
+# SHOPPING_LIST_CACHE_SINGLE_PROCESS says there is a single worker, as with
+# runserver.
+SHOPPING_LIST_CACHE = "default"
+SHOPPING_LIST_CACHE_TIMEOUT = 300
+SHOPPING_LIST_CACHE_SINGLE_PROCESS = True
+
+if PROFILE == "production":
+    SHOPPING_LIST_CACHE = "redis" if "redis" in CACHES else "files"
+    SHOPPING_LIST_CACHE_SINGLE_PROCESS = False
+
+# Broker of shopping list change events. InProcessBroker only reaches clients
+# of the same process; FileBroker shares events between processes on a host:
+# {"BACKEND": "shopping_list.events.FileBroker",
+#  "OPTIONS": {"location": BASE_DIR / ".events"}}
+# It keeps one to two "max_bytes" (default 1 MiB) of events per shopping list;
+# clients that fell further behind are told to reload.
+SHOPPING_LIST_EVENTS = {"BACKEND": "shopping_list.events.InProcessBroker"}
+
+# Longest time in seconds an event stream stays open before the client has to
+# reconnect.
+SHOPPING_LIST_EVENTS_STREAM_TIMEOUT = 30
+
+# The sync token of the last page of a delta stays this many seconds behind
+# the present, so that rows of transactions still running when the delta was
+# read are sent by the next one. It should exceed the longest transaction.
+SHOPPING_LIST_SYNC_WINDOW = 5
+
+# Number of lists and items an import writes per bulk_create batch.
+SHOPPING_LIST_IMPORT_BATCH_SIZE = 500
+
+# Database aliases that GET requests for shopping lists and items are read
+# from, e.g. DJANGO_REPLICAS=replica; none means reading from the primary.
+# Users who wrote keep reading from the primary for SHOPPING_LIST_REPLICA_PIN
+# seconds, which should exceed the replication lag. The pins are kept in the
+# SHOPPING_LIST_REPLICA_PIN_CACHE alias, which every worker must share; a
+# LocMemCache is refused unless SHOPPING_LIST_CACHE_SINGLE_PROCESS is set.
+SHOPPING_LIST_REPLICAS = [
+    alias for alias in os.environ.get("DJANGO_REPLICAS", "").split(",") if alias
+]
+SHOPPING_LIST_REPLICA_PIN = 5
+SHOPPING_LIST_REPLICA_PIN_CACHE = "default"
+
+if PROFILE == "production":
+    SHOPPING_LIST_REPLICA_PIN_CACHE = SHOPPING_LIST_CACHE
+
+# Database aliases that shopping lists and their items are spread over by id,
+# e.g. DJANGO_SHARDS=default,shard1. Users live on the default database and
+# are copied to every shard. Changing the list reassigns existing lists to
+# other shards, so it is only safe on empty databases.
+SHOPPING_LIST_SHARDS = [
+    alias for alias in os.environ.get("DJANGO_SHARDS", "default").split(",") if alias
+]
+
+# Lifetime in seconds of the signed tokens issued by /api/token/.
+SHOPPING_LIST_TOKEN_MAX_AGE = 24 * 60 * 60
+
+# Users authenticated by token are kept in memory by every process for up to
+# TTL seconds, at most SIZE of them. Changes to a user made by another process
+# apply within RECHECK seconds through the SHOPPING_LIST_CACHE versions if that
+# cache is shared, and once the entry expires otherwise.
+SHOPPING_LIST_USER_CACHE_TTL = 60
+SHOPPING_LIST_USER_CACHE_SIZE = 1000
+SHOPPING_LIST_USER_CACHE_RECHECK = 1
+
+# Who receives the Server-Timing header with the database and phase timings
+# of a request: every client (True), staff users only ("staff") or no one.
+SHOPPING_LIST_SERVER_TIMING = True
+
+if PROFILE == "production":
+    SHOPPING_LIST_SERVER_TIMING = "staff"
+
+# Also log the Server-Timing figures of every request as a JSON line.
+SHOPPING_LIST_SERVER_TIMING_LOG = False
+
+# Each worker process writes its request metrics to its own file in this
+# directory every interval in seconds, and when it exits. Workers of one
+# deployment must share the host and the directory, and it should be emptied
+# when they are restarted.
+SHOPPING_LIST_METRICS_DIR = BASE_DIR / ".metrics"
+SHOPPING_LIST_METRICS_FLUSH_INTERVAL = 1
+
+# Requests running the same SELECT shape at least THRESHOLD times are
+# reported as N+1 queries: "raise" fails them, "log" logs a warning for a
+# SAMPLE_RATE share of requests, None turns the check off.
+SHOPPING_LIST_NPLUSONE = "log"
+SHOPPING_LIST_NPLUSONE_THRESHOLD = 3
+SHOPPING_LIST_NPLUSONE_SAMPLE_RATE = 1.0
+
+if PROFILE == "production":
+    SHOPPING_LIST_NPLUSONE_SAMPLE_RATE = 0.05
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "shopping_list.timing": {"handlers": ["console"], "level": "INFO"},
+        "shopping_list.nplusone": {"handlers": ["console"], "level": "WARNING"},
+    },
+}
@@ -0,0 +1,149 @@
+"""Async read-only variants of the shopping list endpoints.
+
+They serve the same representations as the GET handlers in
+`shopping_list.api.views` but await the database through Django's async ORM,
+so an ASGI worker can keep many slow or long-polling clients in flight. The
+DRF views remain the default; these are mounted under /api/async/.
+
+Authentication, permissions, throttling and pagination are delegated to the
+DRF view of the same endpoint, so both answer every request alike.
+"""
+
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException, NotFound
+from shopping_list.api.membership import aget_shopping_list
+from shopping_list.api.renderers import FastJSONRenderer
+from shopping_list.api.serializers import (
+    ShoppingItemValuesSerializer,
+    ShoppingListValuesSerializer,
+)
+from shopping_list.api.views import (
+    ListAddShoppingItem,
+    ListAddShoppingList,
+    ShoppingListDetail,
+)
+from shopping_list.models import ShoppingList
+from shopping_list.sharding import on_shard
+
+NOT_FOUND = "No ShoppingList matches the given query."
+
+
+class _Rejected(Exception):
+    """Carries the error response of the DRF view out of an async view."""
+
+    def __init__(self, response):
+        self.response = response
+
+
+def _json_response(data, status=200):
+    return HttpResponse(
+        FastJSONRenderer().render(data), status=status, content_type="application/json"
+    )
+
+
+def _error_response(view, exc):
+    # The status, detail and WWW-Authenticate header the DRF view would send.
+    response = view.handle_exception(exc)
+    error = _json_response(response.data, status=response.status_code)
+    if "WWW-Authenticate" in response:
+        error["WWW-Authenticate"] = response["WWW-Authenticate"]
+
+    return error
+
+
+def _initial(view_class, request, **kwargs):
+    view = view_class()
+    view.setup(request, **kwargs)
+    view.format_kwarg = None
+    view.headers = {}
+    view.request = view.initialize_request(request, **kwargs)
+    try:
+        view.perform_authentication(view.request)
+        view.check_permissions(view.request)
+        view.check_throttles(view.request)
+    except (APIException, Http404) as exc:
+        raise _Rejected(_error_response(view, exc))
+
+    return view
+
+
+async def _authorize(view_class, request, **kwargs):
+    """Return the DRF view for the request once it has passed its checks.
+
+    Raises _Rejected with the response of the view if it does not.
+    """
+    return await sync_to_async(_initial)(view_class, request, **kwargs)
+
+
+async def _paginate(view, rows):
+    """Return the page of rows with the view's paginator, like the view."""
+    try:
+        return await sync_to_async(view.paginate_queryset)(rows)
+    except APIException as exc:
+        raise _Rejected(_error_response(view, exc))
+
+
+def _api_errors(view_func):
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view_func(request, *args, **kwargs)
+        except _Rejected as rejected:
+            return rejected.response
+
+    return wrapper
+
+
+@require_GET
+@_api_errors
+async def shopping_lists(request):
+    view = await _authorize(ListAddShoppingList, request)
+
+    # last_interaction is only selected for keyset pagination cursors.
+    rows = ShoppingListValuesSerializer.get_rows(
+        view.filter_queryset(view.get_queryset()), "last_interaction"
+    )
+    page = await _paginate(view, rows)
+    results = await ShoppingListValuesSerializer.ato_representation(page)
+    return _json_response(view.get_paginated_response(results).data)
+
+
+@require_GET
+@_api_errors
+async def shopping_list_detail(request, pk):
+    view = await _authorize(ShoppingListDetail, request, pk=pk)
+
+    shopping_list = await aget_shopping_list(request, view.request.user, pk)
+    try:
+        if shopping_list is None:
+            raise NotFound(NOT_FOUND)
+        # Answered from the membership loaded with the list.
+        view.check_object_permissions(view.request, shopping_list)
+    except APIException as exc:
+        raise _Rejected(_error_response(view, exc))
+
+    rows = [
+        row
+        async for row in ShoppingListValuesSerializer.get_rows(
+            on_shard(ShoppingList.objects.filter(pk=pk), pk)
+        )
+    ]
+    data = await ShoppingListValuesSerializer.ato_representation(rows)
+    return _json_response(data[0])
+
+
+@require_GET
+@_api_errors
+async def shopping_items(request, pk):
+    view = await _authorize(ListAddShoppingItem, request, pk=pk)
+
+    rows = ShoppingItemValuesSerializer.get_rows(
+        view.filter_queryset(view.get_queryset())
+    )
+    page = await _paginate(view, rows)
+    results = ShoppingItemValuesSerializer.to_representation(page)
+    return _json_response(view.get_paginated_response(results).data)
@@ -0,0 +1,82 @@
+"""Stateless API tokens signed with SECRET_KEY.
+
+A token is the user id and a fingerprint of the user's password hash, with a
+timestamp and an HMAC signature, valid for SHOPPING_LIST_TOKEN_MAX_AGE
+seconds. Checking one needs no database: the signature is verified in memory
+and the user comes from the user cache. Tokens cannot be revoked one by one;
+changing the password or deactivating the user rejects all of theirs, and
+rotating SECRET_KEY rejects everyone's.
+"""
+
+from django.conf import settings
+from django.core import signing
+from django.utils.crypto import constant_time_compare, salted_hmac
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from shopping_list.users import get_user_cache
+
+TOKEN_SALT = "shopping_list.api.token"
+
+
+def get_token_max_age():
+    return getattr(settings, "SHOPPING_LIST_TOKEN_MAX_AGE", 24 * 60 * 60)
+
+
+def _fingerprint(user):
+    # Like PasswordResetTokenGenerator, but only the password hash: it changes
+    # with the password, while logging in must not invalidate the tokens.
+    return salted_hmac(TOKEN_SALT, user.password, algorithm="sha256").hexdigest()[::2]
+
+
+def issue_token(user):
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign(
+        f"{user.pk}:{_fingerprint(user)}"
+    )
+
+
+def get_token_user(token):
+    """Return the active user the token was issued to.
+
+    Raises AuthenticationFailed for tampered, expired or orphaned tokens, and
+    for tokens issued before the user's password changed.
+    """
+    try:
+        value = signing.TimestampSigner(salt=TOKEN_SALT).unsign(
+            token, max_age=get_token_max_age()
+        )
+    except signing.SignatureExpired:
+        raise exceptions.AuthenticationFailed("Token has expired.")
+    except signing.BadSignature:
+        raise exceptions.AuthenticationFailed("Invalid token.")
+
+    user_id, _, fingerprint = value.partition(":")
+    user = get_user_cache().get(user_id)
+    if user is None or not user.is_active:
+        raise exceptions.AuthenticationFailed("User inactive or deleted.")
+    if not constant_time_compare(fingerprint, _fingerprint(user)):
+        raise exceptions.AuthenticationFailed("Invalid token.")
+
+    return user
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """Authenticate with an `Authorization: Bearer <token>` header."""
+
+    keyword = "Bearer"
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed("Invalid token header.")
+
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed("Invalid token header.")
+
+        return get_token_user(token), token
+
+    def authenticate_header(self, request):
+        return self.keyword
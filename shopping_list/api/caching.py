@@ -0,0 +1,54 @@
+import hashlib
+
+from django.conf import settings
+from rest_framework.response import Response
+from shopping_list.cache import get_response_cache, record_lookup
+from shopping_list.routers import reading_from_replicas
+
+
+class CachedResponseMixin:
+    """Serve GET responses from the shopping list cache.
+
+    Views implement `get_cache_key_parts()`, returning values that identify
+    the response (including a version from `shopping_list.cache`), or None
+    when the request must not be served from the cache. Nothing is cached
+    when the configured cache is not shared by all processes.
+    """
+
+    def get_cache_key_parts(self):
+        raise NotImplementedError
+
+    def get_cache_key(self):
+        parts = self.get_cache_key_parts()
+        if parts is None:
+            return None
+
+        url = hashlib.sha1(self.request.build_absolute_uri().encode()).hexdigest()
+        return ":".join(
+            str(part) for part in ("response", self.__class__.__name__, *parts, url)
+        )
+
+    def get(self, request, *args, **kwargs):
+        cache = get_response_cache()
+        key = None if cache is None else self.get_cache_key()
+        if key is None:
+            return super().get(request, *args, **kwargs)
+
+        data = cache.get(key)
+        record_lookup(hit=data is not None)
+        if data is not None:
+            return Response(data, headers={"X-Cache": "HIT"})
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            timeout = getattr(settings, "SHOPPING_LIST_CACHE_TIMEOUT", 300)
+            if reading_from_replicas():
+                # A lagging replica may miss the change that created this
+                # version; keep its answer no longer than writers are pinned.
+                timeout = min(
+                    timeout, getattr(settings, "SHOPPING_LIST_REPLICA_PIN", 5)
+                )
+            cache.set(key, response.data, timeout)
+            response.headers["X-Cache"] = "MISS"
+
+        return response
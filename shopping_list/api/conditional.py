@@ -0,0 +1,51 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """Answer GET requests with 304 Not Modified when nothing has changed.
+
+    Views implement `get_conditional_state()`, returning a tuple of cheap
+    version values whose first element is the last modification time, or None
+    to skip the check (for example, when the request will not be authorized).
+    A first element of None sends no Last-Modified, for resources whose
+    changes a modification time does not capture; they are only compared by
+    ETag.
+    The serializers only run when the state differs from the client's copy.
+    """
+
+    def get_conditional_state(self):
+        raise NotImplementedError
+
+    def get_etag(self, state):
+        key = "|".join(
+            str(value)
+            for value in (
+                self.__class__.__name__,
+                self.request.user.pk,
+                self.request.get_full_path(),
+                *state,
+            )
+        )
+        return quote_etag(hashlib.sha1(key.encode()).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        state = self.get_conditional_state()
+        if state is None:
+            return super().get(request, *args, **kwargs)
+
+        etag = self.get_etag(state)
+        last_modified = int(state[0].timestamp()) if state[0] else None
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response.headers["ETag"] = etag
+            if last_modified is not None:
+                response.headers["Last-Modified"] = http_date(last_modified)
+
+        return response
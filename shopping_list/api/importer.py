@@ -0,0 +1,265 @@
+"""Streaming imports of shopping lists and their items.
+
+Accepts the same NDJSON and CSV layouts the exports produce. Uploads are
+parsed line by line and written in fixed-size batches, and the importer
+reports its progress as it goes, so large files neither sit in memory nor
+leave the client waiting for a single response at the end.
+"""
+
+import asyncio
+import codecs
+import csv
+import json
+import logging
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework import serializers
+from shopping_list.api.serializers import DUPLICATE_ITEM_ERROR, ShoppingItemSerializer
+from shopping_list.cache import invalidate
+from shopping_list.interactions import acoalesce_interactions, coalesce_interactions
+from shopping_list.models import ShoppingList
+from shopping_list.routers import pin_to_primary
+from shopping_list.sharding import atomic_on_shards, bulk_create_on_shards
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+SHOPPING_LIST = "shopping_list"
+SHOPPING_ITEM = "shopping_item"
+
+REQUIRED_CSV_COLUMNS = ["shopping_list_name", "shopping_item_name"]
+
+IMPORT_STOPPED_ERROR = (
+    "The import stopped at this row. Rows reported before it were imported."
+)
+
+
+class ImportShoppingListSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ShoppingList
+        fields = ["name"]
+
+
+def parse_ndjson(upload):
+    """Yield (row, record, errors) with errors set for lines that are not JSON.
+
+    Items without a `shopping_list` key belong to the list declared last.
+    """
+    last_list_key = None
+    for row, line in enumerate(upload, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield row, None, {"non_field_errors": ["Invalid JSON."]}
+            continue
+        if not isinstance(record, dict):
+            yield row, None, {"non_field_errors": ["Expected a JSON object."]}
+            continue
+
+        if record.get("type") == SHOPPING_LIST:
+            last_list_key = record.setdefault("id", f"row-{row}")
+        elif record.get("type") == SHOPPING_ITEM:
+            record.setdefault("shopping_list", last_list_key)
+        yield row, record, None
+
+
+def parse_csv(upload):
+    """Yield (row, record, None) from CSV rows of one list and at most one item."""
+    reader = csv.DictReader(codecs.iterdecode(upload, "utf-8-sig"))
+    missing = set(REQUIRED_CSV_COLUMNS) - set(reader.fieldnames or ())
+    if missing:
+        error = f"Missing columns: {', '.join(sorted(missing))}."
+        yield 1, None, {"non_field_errors": [error]}
+        return
+
+    seen_lists = set()
+    for values in reader:
+        row = reader.line_num
+        list_key = values.get("shopping_list_id") or values["shopping_list_name"]
+        if list_key not in seen_lists:
+            seen_lists.add(list_key)
+            yield row, {
+                "type": SHOPPING_LIST,
+                "id": list_key,
+                "name": values["shopping_list_name"],
+            }, None
+        if values["shopping_item_name"]:
+            yield row, {
+                "type": SHOPPING_ITEM,
+                "shopping_list": list_key,
+                "name": values["shopping_item_name"],
+                "purchased": values.get("purchased") or False,
+            }, None
+
+
+PARSERS = {"ndjson": parse_ndjson, "csv": parse_csv}
+
+
+class ShoppingListImporter:
+    """Create the lists and items of parsed records on behalf of a user.
+
+    Every imported list gets a new id and the user as its only member. Items
+    follow the duplicate-name rules of ShoppingItemSerializer.bulk_create, and
+    each list is touched once when the import finishes.
+    """
+
+    def __init__(self, user, batch_size=BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.lists = {}
+        self.pending_lists = []
+        self.pending_items = []
+        self.rows = 0
+        self.created_lists = 0
+        self.created_items = 0
+        self.errors = 0
+
+    def run(self, records):
+        """Import the records and yield error, progress and summary reports.
+
+        Closing the iterator early, as servers do when the client disconnects,
+        aborts the import; see abort().
+        """
+        reports = self.import_records(records)
+        with coalesce_interactions():
+            try:
+                yield from reports
+            except GeneratorExit:
+                self.abort(reports)
+
+    async def arun(self, records):
+        """run() as an async iterator, importing in the request's worker thread."""
+        reports = self.import_records(records)
+        cancelled = False
+        async with acoalesce_interactions():
+            try:
+                while (report := await sync_to_async(next)(reports, None)) is not None:
+                    yield report
+            except (GeneratorExit, asyncio.CancelledError) as exc:
+                cancelled = isinstance(exc, asyncio.CancelledError)
+                await sync_to_async(self.abort)(reports)
+        if cancelled:
+            raise asyncio.CancelledError()
+
+    def abort(self, reports):
+        """Stop importing once the client is gone.
+
+        Batches committed so far are kept and their lists touched; rows read
+        since the last batch are dropped.
+        """
+        reports.close()
+        logger.warning(
+            "Import aborted at row %s; rows after the last batch were dropped.",
+            self.rows,
+        )
+
+    def import_records(self, records):
+        # Writing happens while the response is sent. A failure rolls back
+        # the batch it happened in and ends the import with an error report,
+        # since the batches before it are committed already.
+        try:
+            for row, record, errors in records:
+                self.rows = row
+                errors = errors or self.add(record)
+                if errors:
+                    self.errors += 1
+                    yield {"type": "error", "row": row, "errors": errors}
+                if len(self.pending_items) + len(self.pending_lists) >= self.batch_size:
+                    yield from self.flush()
+                    yield self.report("progress")
+            yield from self.flush()
+        except Exception:
+            logger.exception("Import stopped at row %s.", self.rows)
+            self.errors += 1
+            yield {
+                "type": "error",
+                "row": self.rows,
+                "errors": {"non_field_errors": [IMPORT_STOPPED_ERROR]},
+            }
+        yield self.report("summary")
+
+    def add(self, record):
+        if record.get("type") == SHOPPING_LIST:
+            serializer = ImportShoppingListSerializer(data=record)
+            if not serializer.is_valid():
+                return serializer.errors
+            if record["id"] in self.lists:
+                return {"id": ["Shopping list appears more than once."]}
+            shopping_list = ShoppingList(**serializer.validated_data)
+            self.lists[record["id"]] = shopping_list
+            self.pending_lists.append(shopping_list)
+        elif record.get("type") == SHOPPING_ITEM:
+            shopping_list = self.lists.get(record.get("shopping_list"))
+            if shopping_list is None:
+                return {"shopping_list": ["Unknown shopping list."]}
+            serializer = ShoppingItemSerializer(data=record)
+            if not serializer.is_valid():
+                return serializer.errors
+            self.pending_items.append(
+                (self.rows, shopping_list, serializer.validated_data)
+            )
+        else:
+            return {"type": [f"Expected {SHOPPING_LIST} or {SHOPPING_ITEM}."]}
+
+    def flush(self):
+        items_by_list = defaultdict(list)
+        for row, shopping_list, item_data in self.pending_items:
+            items_by_list[shopping_list].append((row, item_data))
+
+        with atomic_on_shards():
+            if self.pending_lists:
+                ShoppingList.objects.bulk_create(self.pending_lists)
+                bulk_create_on_shards(
+                    ShoppingList.members.through.objects.all(),
+                    (
+                        ShoppingList.members.through(
+                            shoppinglist_id=shopping_list.id, user_id=self.user.id
+                        )
+                        for shopping_list in self.pending_lists
+                    ),
+                )
+                invalidate(user_ids=[self.user.id])
+
+            duplicates = []
+            created_items = 0
+            for shopping_list, items in items_by_list.items():
+                results = ShoppingItemSerializer.bulk_create(
+                    shopping_list, [item_data for _, item_data in items]
+                )
+                for (row, _), shopping_item in zip(items, results):
+                    if shopping_item is None:
+                        duplicates.append(row)
+                    else:
+                        created_items += 1
+
+        # The writes happen after PinWritersToPrimaryMiddleware returned the
+        # response, so the user is pinned here, for as long as batches commit.
+        if getattr(settings, "SHOPPING_LIST_REPLICAS", []):
+            pin_to_primary(self.user.id)
+
+        # Counted once the batch is committed.
+        self.created_lists += len(self.pending_lists)
+        self.created_items += created_items
+        self.pending_lists = []
+        self.pending_items = []
+        for row in duplicates:
+            self.errors += 1
+            yield {
+                "type": "error",
+                "row": row,
+                "errors": {"name": [DUPLICATE_ITEM_ERROR]},
+            }
+
+    def report(self, type):
+        return {
+            "type": type,
+            "rows": self.rows,
+            "shopping_lists": self.created_lists,
+            "shopping_items": self.created_items,
+            "errors": self.errors,
+        }
@@ -0,0 +1,91 @@
+from django.db.models import Exists, OuterRef
+from django.shortcuts import get_object_or_404
+from shopping_list.models import ShoppingList
+from shopping_list.sharding import on_shard
+
+
+def _request_cache(request, name):
+    # Keep the answers on the underlying HttpRequest so that they are shared
+    # by every permission class, view method and serializer handling the same
+    # request.
+    http_request = getattr(request, "_request", request)
+    if not hasattr(http_request, name):
+        setattr(http_request, name, {})
+
+    return getattr(http_request, name)
+
+
+def _membership_cache(request):
+    return _request_cache(request, "_shopping_list_membership")
+
+
+def _with_membership(queryset, user):
+    return queryset.annotate(
+        is_member=Exists(
+            ShoppingList.members.through.objects.filter(
+                shoppinglist_id=OuterRef("pk"), user_id=user.id
+            )
+        )
+    )
+
+
+def is_shopping_list_member(request, shopping_list_id):
+    """Return whether the requesting user is a member of the shopping list.
+
+    The check is a single EXISTS query on the members through table, backed by
+    its unique (shoppinglist_id, user_id) index, and is answered only once per
+    request.
+    """
+    cache = _membership_cache(request)
+    key = str(shopping_list_id)
+    if key not in cache:
+        cache[key] = on_shard(
+            ShoppingList.members.through.objects.filter(
+                shoppinglist_id=shopping_list_id, user_id=request.user.id
+            ),
+            shopping_list_id,
+        ).exists()
+
+    return cache[key]
+
+
+def get_shopping_list(request, shopping_list_id):
+    """Return the shopping list for the request, or raise Http404.
+
+    The list is loaded together with the requesting user's membership in a
+    single query, and both are reused for the rest of the request.
+    """
+    cache = _request_cache(request, "_shopping_lists")
+    key = str(shopping_list_id)
+    if key not in cache:
+        shopping_list = get_object_or_404(
+            on_shard(
+                _with_membership(ShoppingList.objects.all(), request.user),
+                shopping_list_id,
+            ),
+            pk=shopping_list_id,
+        )
+        cache[key] = shopping_list
+        _membership_cache(request)[key] = shopping_list.is_member
+
+    return cache[key]
+
+
+async def aget_shopping_list(request, user, shopping_list_id):
+    """Async version of get_shopping_list returning None for unknown lists.
+
+    Async views cannot read request.user lazily, so they pass the user in.
+    """
+    cache = _request_cache(request, "_shopping_lists")
+    key = str(shopping_list_id)
+    if key not in cache:
+        shopping_list = await on_shard(
+            _with_membership(ShoppingList.objects.filter(pk=shopping_list_id), user),
+            shopping_list_id,
+        ).afirst()
+        if shopping_list is None:
+            return None
+        cache[key] = shopping_list
+        _membership_cache(request)[key] = shopping_list.is_member
+
+    return cache[key]
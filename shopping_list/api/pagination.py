@@ -1,7 +1,136 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+from types import SimpleNamespace
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 
 class LargerResultsSetPagination(PageNumberPagination):
     page_size = 5
     page_size_query_param = "page_size"
     max_page_size = 10
+
+
+class KeysetPagination(BasePagination):
+    """Forward-only keyset pagination over the view's `keyset_ordering`.
+
+    The ordering must end with a unique field so that every row has a distinct
+    position. The cursor stores the position of the last row of the page, so
+    no COUNT or OFFSET is needed and rows added or removed on earlier pages do
+    not shift later ones. The first page is requested with an empty cursor.
+
+    Pages are only stable for rows whose ordering values do not change while
+    the client pages: a row whose key moves across the cursor between two
+    requests, such as a list whose `last_interaction` is bumped or an item
+    that gets purchased, is skipped or returned twice.
+    """
+
+    cursor_query_param = "cursor"
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = None
+    max_page_size = None
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = view.keyset_ordering
+        self.fields = [
+            queryset.model._meta.get_field(name.lstrip("-")) for name in self.ordering
+        ]
+
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+
+        results = list(queryset[: self.page_size + 1])
+        self.has_next = len(results) > self.page_size
+        self.page = results[: self.page_size]
+
+        return self.page
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+                if page_size > 0:
+                    if self.max_page_size:
+                        return min(page_size, self.max_page_size)
+                    return page_size
+            except (KeyError, ValueError):
+                pass
+
+        return self.page_size
+
+    def get_position_filter(self, position):
+        # (a, b, c) after (x, y, z) is a > x, or a = x and b > y, or
+        # a = x and b = y and c > z, with < for descending fields.
+        conditions = []
+        for index, name in enumerate(self.ordering):
+            lookup = "lt" if name.startswith("-") else "gt"
+            condition = Q(**{f"{self.fields[index].name}__{lookup}": position[index]})
+            for field, value in zip(self.fields[:index], position[:index]):
+                condition &= Q(**{field.name: value})
+            conditions.append(condition)
+
+        return reduce(or_, conditions)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+            if len(values) != len(self.fields):
+                raise ValueError
+            return [field.to_python(value) for field, value in zip(self.fields, values)]
+        except (binascii.Error, TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, obj):
+        if isinstance(obj, dict):
+            # A row from `.values()`.
+            obj = SimpleNamespace(**obj)
+        values = [field.value_to_string(obj) for field in self.fields]
+        return base64.urlsafe_b64encode(json.dumps(values).encode("ascii")).decode(
+            "ascii"
+        )
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "required": ["results"],
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class LargerResultsSetKeysetPagination(KeysetPagination):
+    page_size = LargerResultsSetPagination.page_size
+    page_size_query_param = LargerResultsSetPagination.page_size_query_param
+    max_page_size = LargerResultsSetPagination.max_page_size
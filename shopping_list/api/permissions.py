@@ -1,33 +1,27 @@
 from rest_framework import permissions
-from shopping_list.models import ShoppingList
+from shopping_list.api.membership import get_shopping_list, is_shopping_list_member
 
 
 class ShoppingListMembersOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.user.is_superuser:
             return True
-        if request.user in obj.members.all():
-            return True
 
-        return False
+        return is_shopping_list_member(request, obj.id)
 
 
 class ShoppingItemShoppingListMembersOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.user.is_superuser:
             return True
-        if request.user in obj.shopping_list.members.all():
-            return True
 
-        return False
+        return is_shopping_list_member(request, obj.shopping_list_id)
 
 
 class AllShoppingItemsShoppingListMembersOnly(permissions.BasePermission):
     def has_permission(self, request, view):
+        shopping_list = get_shopping_list(request, view.kwargs.get("pk"))
         if request.user.is_superuser:
             return True
-        current_shopping_list = ShoppingList.objects.get(pk=view.kwargs.get("pk"))
-        if request.user in current_shopping_list.members.all():
-            return True
 
-        return False
+        return shopping_list.is_member
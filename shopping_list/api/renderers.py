@@ -0,0 +1,78 @@
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with orjson when it is installed.
+
+    orjson serializes dicts, lists, UUIDs and datetimes natively; anything
+    else goes through DRF's encoder. Indented output, as requested by the
+    browsable API, falls back to the standard renderer.
+    """
+
+    _encoder = encoders.JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        renderer_context = renderer_context or {}
+        if self.get_indent(accepted_media_type, renderer_context):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # OPT_UTC_Z writes UTC datetimes with "Z", as DRF's encoder does.
+        return orjson.dumps(
+            data,
+            default=self._encoder.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z,
+        )
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets clients ask for text/event-stream.
+
+    Event streams are written by the view itself; this renderer only renders
+    error responses, as a single "error" event.
+    """
+
+    media_type = "text/event-stream"
+    format = "event-stream"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        payload = json.dumps(data, cls=encoders.JSONEncoder)
+        return f"event: error\ndata: {payload}\n\n".encode()
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Selects newline-delimited JSON exports; renders errors as one line."""
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (json.dumps(data, cls=encoders.JSONEncoder) + "\n").encode()
+
+
+class CSVRenderer(BaseRenderer):
+    """Selects CSV exports; renders errors as a one-column table."""
+
+    media_type = "text/csv"
+    format = "csv"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        detail = data.get("detail", "") if isinstance(data, dict) else data
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([["detail"], [detail]])
+        return buffer.getvalue().encode()
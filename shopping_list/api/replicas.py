@@ -0,0 +1,31 @@
+from contextlib import ExitStack
+
+from django.conf import settings
+from shopping_list.routers import is_pinned_to_primary, replica_reads
+
+
+class ReplicaReadMixin:
+    """Serve GET requests from a read replica.
+
+    Users who wrote anything in the last SHOPPING_LIST_REPLICA_PIN seconds
+    keep reading from the primary, so they never miss their own changes.
+    """
+
+    replica_methods = ("GET", "HEAD")
+
+    def initial(self, request, *args, **kwargs):
+        self._replica_reads = ExitStack()
+        if (
+            request.method in self.replica_methods
+            and getattr(settings, "SHOPPING_LIST_REPLICAS", [])
+            and not (
+                request.user.is_authenticated and is_pinned_to_primary(request.user.pk)
+            )
+        ):
+            self._replica_reads.enter_context(replica_reads())
+        super().initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if hasattr(self, "_replica_reads"):
+            self._replica_reads.close()
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -1,5 +1,52 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import chain
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Prefetch, Value, Window
+from django.db.models.functions import Lower, RowNumber
+from django.utils import timezone
 from rest_framework import serializers
+from shopping_list.api.timing import TimedSerializerMixin
+from shopping_list.events import publish_shopping_list_event
+from shopping_list.interactions import record_interaction
 from shopping_list.models import ShoppingItem, ShoppingList, User
+from shopping_list.receivers import bury_in_bulk
+from shopping_list.sharding import group_by_shard, on_shard, shard_for
+from shopping_list.timing import timed
+
+DUPLICATE_ITEM_ERROR = "Item already exists on the list."
+
+UNPURCHASED_ITEMS_PREVIEW_SIZE = 3
+
+# Names folded per query by ShoppingItemSerializer.lower_names, well below the
+# column limits of the databases.
+LOWER_NAMES_BATCH_SIZE = 500
+
+
+def unpurchased_items_preview(shopping_list_ids=None):
+    """Return the first unpurchased items of every shopping list.
+
+    A window function numbers the items of each list, so a single query
+    covers any number of lists.
+    """
+    queryset = ShoppingItem.objects.filter(purchased=False)
+    if shopping_list_ids is not None:
+        queryset = queryset.filter(shopping_list_id__in=shopping_list_ids)
+
+    return queryset.annotate(
+        row_number=Window(expression=RowNumber(), partition_by=[F("shopping_list_id")])
+    ).filter(row_number__lte=UNPURCHASED_ITEMS_PREVIEW_SIZE)
+
+
+@contextmanager
+def unique_item_names(using=None):
+    """Report a violated unique_unpurchased_item_name as a validation error."""
+    try:
+        with transaction.atomic(using=using):
+            yield
+    except IntegrityError:
+        raise serializers.ValidationError(DUPLICATE_ITEM_ERROR)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -8,25 +55,180 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ["id", "username"]
 
 
-class ShoppingItemSerializer(serializers.ModelSerializer):
+class ShoppingItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = ShoppingItem
         fields = ["id", "name", "purchased"]
         read_only_fields = ("id",)
 
     def create(self, validated_data, **kwargs):
-        shopping_list_id = self.context["request"].parser_context["kwargs"]["pk"]
-        if ShoppingList.objects.get(id=shopping_list_id).shopping_items.filter(
-            name=validated_data["name"], purchased=False
+        # The lookup matches the unique_unpurchased_item_name index; the
+        # constraint itself catches items added concurrently.
+        shopping_list = validated_data["shopping_list"]
+        if (
+            on_shard(ShoppingItem.objects.all(), shopping_list.id)
+            .alias(lower_name=Lower("name"))
+            .filter(
+                shopping_list=shopping_list,
+                lower_name=Lower(Value(validated_data["name"])),
+                purchased=False,
+            )
+            .exists()
         ):
-            raise serializers.ValidationError("Item already exists on the list.")
+            raise serializers.ValidationError(DUPLICATE_ITEM_ERROR)
+
+        with unique_item_names(shard_for(shopping_list.id)):
+            return super(ShoppingItemSerializer, self).create(validated_data)
+
+    def update(self, instance, validated_data):
+        with unique_item_names(shard_for(instance.shopping_list_id)):
+            return super(ShoppingItemSerializer, self).update(instance, validated_data)
+
+    @staticmethod
+    def lower_names(shopping_list, names):
+        """Return a dict of the names and their LOWER() in the database.
+
+        The unique_unpurchased_item_name constraint compares LOWER(name),
+        which does not fold case like str.lower(): SQLite only folds ASCII.
+        The names are folded on the list's own row, a batch per query.
+        """
+        names = list(names)
+        lower_names = {}
+        for start in range(0, len(names), LOWER_NAMES_BATCH_SIZE):
+            batch = names[start : start + LOWER_NAMES_BATCH_SIZE]
+            row = (
+                on_shard(
+                    ShoppingList.objects.filter(pk=shopping_list.id), shopping_list.id
+                )
+                .values_list(*(Lower(Value(name)) for name in batch))
+                .get()
+            )
+            lower_names.update(zip(batch, row))
+
+        return lower_names
+
+    @staticmethod
+    def bulk_create(shopping_list, items_data):
+        """Add many validated items to a shopping list in one transaction.
+
+        Returns the created items in input order, with None in place of every
+        item whose name is already unpurchased on the list. Duplicates are
+        looked up with a single query and the list is touched once.
+        """
+        lower_names = ShoppingItemSerializer.lower_names(
+            shopping_list, {item_data["name"] for item_data in items_data}
+        )
+        unpurchased_names = set(
+            on_shard(ShoppingItem.objects.all(), shopping_list.id)
+            .annotate(lower_name=Lower("name"))
+            .filter(
+                shopping_list=shopping_list,
+                lower_name__in=set(lower_names.values()),
+                purchased=False,
+            )
+            .values_list("lower_name", flat=True)
+        )
+
+        results = []
+        new_items = []
+        for item_data in items_data:
+            lower_name = lower_names[item_data["name"]]
+            if lower_name in unpurchased_names:
+                results.append(None)
+                continue
+
+            shopping_item = ShoppingItem(shopping_list=shopping_list, **item_data)
+            if not shopping_item.purchased:
+                unpurchased_names.add(lower_name)
+            results.append(shopping_item)
+            new_items.append(shopping_item)
+
+        with unique_item_names(shard_for(shopping_list.id)):
+            ShoppingItem.objects.bulk_create(new_items)
+        if new_items:
+            record_interaction(shopping_list.id)
+        # bulk_create skips post_save, so publish the events it would have.
+        for shopping_item in new_items:
+            publish_shopping_list_event(
+                shopping_list.id,
+                "item.created",
+                {
+                    "id": str(shopping_item.id),
+                    "name": shopping_item.name,
+                    "purchased": shopping_item.purchased,
+                },
+            )
+
+        return results
+
+
+class ShoppingItemBulkActionSerializer(TimedSerializerMixin, serializers.Serializer):
+    PURCHASE = "purchase"
+    UNPURCHASE = "unpurchase"
+    DELETE = "delete"
+    CLEAR_PURCHASED = "clear_purchased"
+
+    action = serializers.ChoiceField(
+        choices=[PURCHASE, UNPURCHASE, DELETE, CLEAR_PURCHASED]
+    )
+    ids = serializers.ListField(child=serializers.UUIDField(), required=False)
 
-        validated_data["shopping_list_id"] = shopping_list_id
+    def validate(self, attrs):
+        if attrs["action"] != self.CLEAR_PURCHASED and not attrs.get("ids"):
+            raise serializers.ValidationError(
+                {"ids": "This field is required for this action."}
+            )
 
-        return super(ShoppingItemSerializer, self).create(validated_data)
+        return attrs
 
+    def save(self, shopping_list):
+        """Apply the action with a single UPDATE or DELETE statement.
 
-class ShoppingListSerializer(serializers.ModelSerializer):
+        Purchasing and unpurchasing select the ids of the rows they change
+        first, to publish them.
+
+        Returns the number of affected shopping items.
+        """
+        action = self.validated_data["action"]
+        queryset = on_shard(
+            ShoppingItem.objects.filter(shopping_list=shopping_list), shopping_list.id
+        )
+        if action == self.CLEAR_PURCHASED:
+            queryset = queryset.filter(purchased=True)
+        else:
+            queryset = queryset.filter(id__in=self.validated_data["ids"])
+
+        if action in (self.PURCHASE, self.UNPURCHASE):
+            purchased = action == self.PURCHASE
+            shard = shard_for(shopping_list.id)
+            # unique_item_names also runs the block in a transaction, which
+            # keeps the rows locked so that the published ids are exactly
+            # those of the updated rows.
+            with unique_item_names(shard):
+                ids = list(
+                    queryset.filter(purchased=not purchased)
+                    .select_for_update()
+                    .values_list("id", flat=True)
+                )
+                affected = queryset.filter(id__in=ids).update(
+                    purchased=purchased, updated_at=timezone.now()
+                )
+        else:
+            with bury_in_bulk(shard_for(shopping_list.id)):
+                affected, _ = queryset.delete()
+
+        if affected:
+            record_interaction(shopping_list.id)
+            if action in (self.PURCHASE, self.UNPURCHASE):
+                # UPDATE skips post_save, so tell clients to reload the items.
+                publish_shopping_list_event(
+                    shopping_list.id, "items.updated", {"ids": [str(id) for id in ids]}
+                )
+
+        return affected
+
+
+class ShoppingListSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     unpurchased_items = serializers.SerializerMethodField()
     members = UserSerializer(many=True, read_only=True)
 
@@ -34,8 +236,124 @@ class ShoppingListSerializer(serializers.ModelSerializer):
         model = ShoppingList
         fields = ["id", "name", "unpurchased_items", "members"]
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        # One windowed query fetches the first unpurchased items of every list
+        # on the page, and one more fetches all their members.
+        return queryset.prefetch_related(
+            Prefetch(
+                "shopping_items",
+                queryset=unpurchased_items_preview().only(
+                    "id", "name", "shopping_list_id"
+                ),
+                to_attr="unpurchased_items_preview",
+            ),
+            Prefetch("members", queryset=User.objects.only("id", "username")),
+        )
+
     def get_unpurchased_items(self, obj):
+        if hasattr(obj, "unpurchased_items_preview"):
+            shopping_items = obj.unpurchased_items_preview
+        else:
+            shopping_items = obj.shopping_items.filter(purchased=False)[
+                :UNPURCHASED_ITEMS_PREVIEW_SIZE
+            ]
+
+        return [{"name": shopping_item.name} for shopping_item in shopping_items]
+
+
+# Read-only counterparts of the serializers above. They turn rows from
+# `.values()` into the same representation with plain dicts, skipping field
+# introspection and model instantiation on the hot listing endpoints.
+
+
+class ShoppingItemValuesSerializer:
+    fields = ("id", "name", "purchased")
+
+    @classmethod
+    def get_rows(cls, queryset):
+        return queryset.values(*cls.fields)
+
+    @classmethod
+    def to_representation(cls, rows):
+        # Rows are fetched first, so that only "db" counts their query.
+        rows = list(rows)
+        with timed("serializer"):
+            return [{field: row[field] for field in cls.fields} for row in rows]
+
+
+class ShoppingListValuesSerializer:
+    fields = ("id", "name")
+
+    @classmethod
+    def get_rows(cls, queryset, *extra_fields):
+        return queryset.values(*cls.fields, *extra_fields)
+
+    @classmethod
+    def get_related_rows(cls, shopping_list_ids):
+        """Return the unpurchased item and membership querysets of every shard."""
+        unpurchased_items, memberships = [], []
+        for shard, ids in group_by_shard(shopping_list_ids).items():
+            unpurchased_items.append(
+                unpurchased_items_preview(ids)
+                .using(shard)
+                .values("shopping_list_id", "name")
+            )
+            memberships.append(
+                ShoppingList.members.through.objects.using(shard)
+                .filter(shoppinglist_id__in=ids)
+                .order_by("id")
+                .values("shoppinglist_id", "user_id", "user__username")
+            )
+        return unpurchased_items, memberships
+
+    @classmethod
+    def to_representation(cls, rows):
+        # Rows are fetched before combine() starts the serializer phase, so
+        # that only "db" counts their queries.
+        rows = list(rows)
+        unpurchased_items, memberships = [], []
+        shopping_list_ids = [row["id"] for row in rows]
+        if shopping_list_ids:
+            unpurchased_items, memberships = [
+                list(chain.from_iterable(querysets))
+                for querysets in cls.get_related_rows(shopping_list_ids)
+            ]
+
+        return cls.combine(rows, unpurchased_items, memberships)
+
+    @classmethod
+    async def ato_representation(cls, rows):
+        unpurchased_items, memberships = [], []
+        shopping_list_ids = [row["id"] for row in rows]
+        if shopping_list_ids:
+            unpurchased_items, memberships = [
+                [row for queryset in querysets async for row in queryset]
+                for querysets in cls.get_related_rows(shopping_list_ids)
+            ]
+
+        return cls.combine(rows, unpurchased_items, memberships)
+
+    @staticmethod
+    @timed("serializer")
+    def combine(rows, unpurchased_item_rows, membership_rows):
+        unpurchased_items = defaultdict(list)
+        for shopping_item in unpurchased_item_rows:
+            unpurchased_items[shopping_item["shopping_list_id"]].append(
+                {"name": shopping_item["name"]}
+            )
+        members = defaultdict(list)
+        for membership in membership_rows:
+            members[membership["shoppinglist_id"]].append(
+                {"id": membership["user_id"], "username": membership["user__username"]}
+            )
+
         return [
-            {"name": shopping_item.name}
-            for shopping_item in obj.shopping_items.filter(purchased=False)
-        ][:3]
+            {
+                "id": row["id"],
+                "name": row["name"],
+                "unpurchased_items": unpurchased_items[row["id"]],
+                "members": members[row["id"]],
+            }
+            for row in rows
+        ]
@@ -0,0 +1,184 @@
+"""Delta synchronization of everything a user can see.
+
+Changes are read from four sources on every shard: shopping lists (by
+last_interaction), shopping items (by updated_at), tombstones of deleted rows
+(by deleted_at) and the items of lists the user was granted access to (by
+granted_at), which can be older than the client's token. They are merged by
+(timestamp, source rank, id), and the sync token is the position of the last
+change returned, so a client can page through the delta without skipping rows.
+
+Timestamps are taken before their transaction commits, so a row can become
+visible after a later one was already synced. The token of the last page
+therefore stays SHOPPING_LIST_SYNC_WINDOW seconds behind the present, and the
+next delta repeats the changes made since; clients apply them idempotently.
+"""
+
+import base64
+import binascii
+import json
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import OuterRef, Q, Subquery
+from django.utils import timezone
+from shopping_list.models import Grant, ShoppingItem, ShoppingList, Tombstone
+from shopping_list.sharding import scatter
+
+
+class InvalidSyncToken(Exception):
+    pass
+
+
+def encode_token(timestamp, rank=None, id=None):
+    values = [timestamp.isoformat(), rank, None if id is None else str(id)]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_token(token):
+    try:
+        timestamp, rank, id = json.loads(base64.urlsafe_b64decode(token.encode()))
+        if id is not None and not isinstance(rank, int):
+            raise ValueError
+        return datetime.fromisoformat(timestamp), rank, id
+    except (binascii.Error, TypeError, ValueError):
+        raise InvalidSyncToken()
+
+
+def _shopping_lists(user):
+    return ShoppingList.objects.filter(members=user)
+
+
+def _shopping_list_changes(user):
+    return _shopping_lists(user).values("id", "name", "last_interaction")
+
+
+def _shopping_item_changes(user):
+    return ShoppingItem.objects.filter(shopping_list__members=user).values(
+        "id", "shopping_list_id", "name", "purchased", "updated_at"
+    )
+
+
+def _granted_item_changes(user):
+    granted_at = (
+        Grant.objects.filter(user=user, shopping_list_id=OuterRef("shopping_list_id"))
+        .order_by("-granted_at")
+        .values("granted_at")[:1]
+    )
+    return (
+        _shopping_item_changes(user)
+        .annotate(granted_at=Subquery(granted_at))
+        .filter(granted_at__isnull=False)
+    )
+
+
+def _tombstones(user):
+    return Tombstone.objects.filter(
+        Q(
+            kind=Tombstone.SHOPPING_ITEM,
+            shopping_list_id__in=_shopping_lists(user).values("id"),
+        )
+        | Q(kind=Tombstone.SHOPPING_LIST, user=user)
+    ).values("id", "kind", "object_id", "deleted_at")
+
+
+def _represent_shopping_item(row):
+    return {
+        "type": "shopping_item",
+        "id": row["id"],
+        "shopping_list": row["shopping_list_id"],
+        "name": row["name"],
+        "purchased": row["purchased"],
+        "updated_at": row["updated_at"],
+    }
+
+
+# (rank, rows, timestamp field, representation)
+SOURCES = [
+    (
+        0,
+        _shopping_list_changes,
+        "last_interaction",
+        lambda row: {
+            "type": "shopping_list",
+            "id": row["id"],
+            "name": row["name"],
+            "last_interaction": row["last_interaction"],
+        },
+    ),
+    (
+        1,
+        _shopping_item_changes,
+        "updated_at",
+        _represent_shopping_item,
+    ),
+    (
+        2,
+        _tombstones,
+        "deleted_at",
+        lambda row: {
+            "type": f"deleted_{row['kind']}",
+            "id": row["object_id"],
+            "deleted_at": row["deleted_at"],
+        },
+    ),
+    (3, _granted_item_changes, "granted_at", _represent_shopping_item),
+]
+
+
+def _after(position, rank, timestamp_field):
+    timestamp, position_rank, position_id = position
+    if position_id is None:
+        return Q(**{f"{timestamp_field}__gte": timestamp})
+    later = Q(**{f"{timestamp_field}__gt": timestamp})
+    if rank < position_rank:
+        return later
+    if rank > position_rank:
+        return Q(**{f"{timestamp_field}__gte": timestamp})
+
+    return later | Q(**{timestamp_field: timestamp, "id__gt": position_id})
+
+
+def get_changes(user, since=None, limit=100):
+    """Return (changes, sync token, whether more changes are pending).
+
+    Without a token every live shopping list and item is returned; deletions
+    and grants only matter to clients that already hold data.
+    """
+    position = decode_token(since) if since else None
+    candidates = []
+    for rank, rows, timestamp_field, represent in SOURCES:
+        if position is None and rank >= 2:
+            continue
+
+        for queryset in scatter(rows(user)):
+            if position is not None:
+                queryset = queryset.filter(_after(position, rank, timestamp_field))
+            try:
+                for row in queryset.order_by(timestamp_field, "id")[: limit + 1]:
+                    candidates.append(
+                        (row[timestamp_field], rank, row["id"], represent(row))
+                    )
+            except ValidationError:
+                # The token's id does not fit this source.
+                raise InvalidSyncToken()
+
+    candidates.sort(key=lambda candidate: candidate[:3])
+    page = candidates[:limit]
+    has_more = len(candidates) > limit
+    settled = timezone.now() - timedelta(
+        seconds=getattr(settings, "SHOPPING_LIST_SYNC_WINDOW", 5)
+    )
+    if has_more or (page and page[-1][0] < settled):
+        token = encode_token(*page[-1][:3])
+    elif position is not None and position[0] < settled:
+        token = since
+    else:
+        token = encode_token(settled)
+
+    # An item can both change and be granted within the page.
+    changes = {}
+    for *_, change in page:
+        changes.setdefault((change["type"], change["id"]), change)
+
+    return list(changes.values()), token, has_more
@@ -0,0 +1,26 @@
+from shopping_list.timing import timed
+
+
+class ServerTimingMixin:
+    """Time the permission checks of a view for the Server-Timing header."""
+
+    def check_permissions(self, request):
+        with timed("permissions"):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with timed("permissions"):
+            super().check_object_permissions(request, obj)
+
+
+class TimedSerializerMixin:
+    """Time the validation and representation of a serializer."""
+
+    def is_valid(self, *args, **kwargs):
+        with timed("serializer"):
+            return super().is_valid(*args, **kwargs)
+
+    @property
+    def data(self):
+        with timed("serializer"):
+            return super().data
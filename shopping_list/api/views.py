@@ -1,37 +1,265 @@
-from rest_framework import generics
-from shopping_list.api.pagination import LargerResultsSetPagination
+import json
+import math
+import time
+from contextlib import aclosing, closing
+from itertools import chain
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count, Max
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework import generics, status
+from rest_framework.authtoken.serializers import AuthTokenSerializer
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.throttling import ScopedRateThrottle
+from shopping_list.api.authentication import get_token_max_age, issue_token
+from shopping_list.api.caching import CachedResponseMixin
+from shopping_list.api.conditional import ConditionalGetMixin
+from shopping_list.api.export import (
+    WRITERS,
+    astream,
+    export_rows,
+    user_shopping_lists,
+)
+from shopping_list.api.importer import BATCH_SIZE, PARSERS, ShoppingListImporter
+from shopping_list.api.membership import get_shopping_list, is_shopping_list_member
+from shopping_list.api.pagination import (
+    KeysetPagination,
+    LargerResultsSetKeysetPagination,
+    LargerResultsSetPagination,
+)
 from shopping_list.api.permissions import (
     AllShoppingItemsShoppingListMembersOnly,
     ShoppingItemShoppingListMembersOnly,
     ShoppingListMembersOnly,
 )
-from shopping_list.api.serializers import ShoppingItemSerializer, ShoppingListSerializer
+from shopping_list.api.renderers import (
+    CSVRenderer,
+    EventStreamRenderer,
+    FastJSONRenderer,
+    NDJSONRenderer,
+)
+from shopping_list.api.replicas import ReplicaReadMixin
+from shopping_list.api.serializers import (
+    DUPLICATE_ITEM_ERROR,
+    ShoppingItemBulkActionSerializer,
+    ShoppingItemSerializer,
+    ShoppingItemValuesSerializer,
+    ShoppingListSerializer,
+    ShoppingListValuesSerializer,
+)
+from shopping_list.api.sync import InvalidSyncToken, get_changes
+from shopping_list.api.timing import ServerTimingMixin
+from shopping_list.cache import shopping_list_version, user_shopping_lists_version
+from shopping_list.events import EventsLost, get_broker, shopping_list_channel
+from shopping_list.metrics import get_metrics_store, render_metrics
 from shopping_list.models import ShoppingItem, ShoppingList
+from shopping_list.sharding import on_shard, scatter, scatter_gather
+
+
+class KeysetPaginationMixin:
+    """Switch to keyset pagination when the request passes a cursor."""
+
+    keyset_pagination_class = KeysetPagination
+    keyset_ordering = None
 
+    @property
+    def paginator(self):
+        if (
+            not hasattr(self, "_paginator")
+            and self.keyset_pagination_class.cursor_query_param
+            in self.request.query_params
+        ):
+            self._paginator = self.keyset_pagination_class()
 
-class ListAddShoppingList(generics.ListCreateAPIView):
+        return super().paginator
+
+
+class ListAddShoppingList(
+    ServerTimingMixin,
+    ReplicaReadMixin,
+    ConditionalGetMixin,
+    CachedResponseMixin,
+    KeysetPaginationMixin,
+    generics.ListCreateAPIView,
+):
     queryset = ShoppingList.objects.all()
     serializer_class = ShoppingListSerializer
+    keyset_ordering = ("-last_interaction", "-id")
+
+    def get_conditional_state(self):
+        states = [
+            queryset.aggregate(
+                last_interaction=Max("last_interaction"), count=Count("id")
+            )
+            for queryset in scatter(
+                ShoppingList.objects.filter(members=self.request.user)
+            )
+        ]
+        last_interactions = [
+            state["last_interaction"]
+            for state in states
+            if state["last_interaction"] is not None
+        ]
+
+        # No Last-Modified: removing a list or a membership changes the
+        # overview without bumping any last_interaction, which only the ETag
+        # notices through the count.
+        return (
+            None,
+            max(last_interactions, default=None),
+            sum(state["count"] for state in states),
+        )
+
+    def get_cache_key_parts(self):
+        user = self.request.user.pk
+        return user, user_shopping_lists_version(user)
 
     def perform_create(self, serializer):
         return serializer.save(members=[self.request.user])
 
+    def list(self, request, *args, **kwargs):
+        # last_interaction is only selected for keyset pagination cursors.
+        rows = ShoppingListValuesSerializer.get_rows(
+            self.filter_queryset(self.get_queryset()), "last_interaction"
+        )
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(
+                ShoppingListValuesSerializer.to_representation(page)
+            )
+
+        return Response(ShoppingListValuesSerializer.to_representation(rows))
+
     def get_queryset(self):
-        return ShoppingList.objects.filter(members=self.request.user).order_by(
-            "-last_interaction"
+        return scatter_gather(
+            ShoppingList.objects.filter(members=self.request.user), "-last_interaction"
         )
 
 
-class ShoppingListDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = ShoppingList.objects.all()
+class ShoppingListDetail(
+    ServerTimingMixin,
+    ReplicaReadMixin,
+    ConditionalGetMixin,
+    CachedResponseMixin,
+    generics.RetrieveUpdateDestroyAPIView,
+):
+    queryset = ShoppingListSerializer.setup_eager_loading(ShoppingList.objects.all())
     serializer_class = ShoppingListSerializer
     permission_classes = [ShoppingListMembersOnly]
 
+    def get_queryset(self):
+        return on_shard(super().get_queryset(), self.kwargs["pk"])
+
+    def get_conditional_state(self):
+        shopping_list = self.kwargs["pk"]
+        if not (
+            self.request.user.is_superuser
+            or is_shopping_list_member(self.request, shopping_list)
+        ):
+            return None
+
+        last_interaction = (
+            on_shard(ShoppingList.objects.filter(pk=shopping_list), shopping_list)
+            .values_list("last_interaction", flat=True)
+            .first()
+        )
+        if last_interaction is None:
+            return None
+
+        return (last_interaction,)
 
-class ListAddShoppingItem(generics.ListCreateAPIView):
+    def get_cache_key_parts(self):
+        shopping_list = self.kwargs["pk"]
+        if not (
+            self.request.user.is_superuser
+            or is_shopping_list_member(self.request, shopping_list)
+        ):
+            return None
+
+        return (
+            shopping_list,
+            shopping_list_version(shopping_list),
+            self.request.user.pk,
+        )
+
+
+class ListAddShoppingItem(
+    ServerTimingMixin,
+    ReplicaReadMixin,
+    ConditionalGetMixin,
+    KeysetPaginationMixin,
+    generics.ListCreateAPIView,
+):
     serializer_class = ShoppingItemSerializer
     permission_classes = [AllShoppingItemsShoppingListMembersOnly]
     pagination_class = LargerResultsSetPagination
+    keyset_pagination_class = LargerResultsSetKeysetPagination
+    keyset_ordering = ("purchased", "id")
+
+    def get_conditional_state(self):
+        return (get_shopping_list(self.request, self.kwargs["pk"]).last_interaction,)
+
+    def list(self, request, *args, **kwargs):
+        rows = ShoppingItemValuesSerializer.get_rows(
+            self.filter_queryset(self.get_queryset())
+        )
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(
+                ShoppingItemValuesSerializer.to_representation(page)
+            )
+
+        return Response(ShoppingItemValuesSerializer.to_representation(rows))
+
+    def create(self, request, *args, **kwargs):
+        if isinstance(request.data, list):
+            return self.bulk_create(request)
+
+        return super().create(request, *args, **kwargs)
+
+    def bulk_create(self, request):
+        if not request.data:
+            raise ValidationError("Expected a non-empty list of items.")
+
+        results = [None] * len(request.data)
+        valid = []
+        for index, item_data in enumerate(request.data):
+            serializer = self.get_serializer(data=item_data)
+            if serializer.is_valid():
+                valid.append((index, serializer.validated_data))
+            else:
+                results[index] = {"status": "invalid", "errors": serializer.errors}
+
+        shopping_items = ShoppingItemSerializer.bulk_create(
+            get_shopping_list(request, self.kwargs["pk"]),
+            [validated_data for _, validated_data in valid],
+        )
+        for (index, _), shopping_item in zip(valid, shopping_items):
+            if shopping_item is None:
+                results[index] = {
+                    "status": "duplicate",
+                    "errors": [DUPLICATE_ITEM_ERROR],
+                }
+            else:
+                results[index] = {
+                    "status": "created",
+                    "item": self.get_serializer(shopping_item).data,
+                }
+
+        created = any(result["status"] == "created" for result in results)
+        return Response(
+            {"results": results},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST,
+        )
+
+    def perform_create(self, serializer):
+        return serializer.save(
+            shopping_list=get_shopping_list(self.request, self.kwargs["pk"])
+        )
 
     def get_queryset(self):
         shopping_list = self.kwargs["pk"]
@@ -39,11 +267,287 @@ class ListAddShoppingItem(generics.ListCreateAPIView):
             "purchased"
         )
 
-        return queryset
+        return on_shard(queryset, shopping_list)
 
 
-class ShoppingItemDetail(generics.RetrieveUpdateDestroyAPIView):
+class ShoppingItemDetail(ServerTimingMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = ShoppingItem.objects.all()
     serializer_class = ShoppingItemSerializer
     permission_classes = [ShoppingItemShoppingListMembersOnly]
     lookup_url_kwarg = "item_pk"
+
+    def get_queryset(self):
+        return on_shard(super().get_queryset(), self.kwargs["pk"])
+
+
+class BulkShoppingItems(ServerTimingMixin, generics.GenericAPIView):
+    serializer_class = ShoppingItemBulkActionSerializer
+    permission_classes = [AllShoppingItemsShoppingListMembersOnly]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        affected = serializer.save(get_shopping_list(request, self.kwargs["pk"]))
+
+        return Response({"affected": affected})
+
+
+class ShoppingItemEvents(ServerTimingMixin, generics.GenericAPIView):
+    """Stream the item changes of a shopping list as Server-Sent Events.
+
+    A stream lasts up to SHOPPING_LIST_EVENTS_STREAM_TIMEOUT seconds (less
+    with ?timeout=); clients then reconnect with the Last-Event-ID header and
+    receive every event they missed, or a "reset" event when those are gone.
+    Under ASGI the stream is an async iterator, so that waiting for events
+    holds no thread.
+    """
+
+    permission_classes = [AllShoppingItemsShoppingListMembersOnly]
+    renderer_classes = [FastJSONRenderer, EventStreamRenderer]
+    heartbeat_interval = 15
+    retry_milliseconds = 3000
+
+    def get(self, request, *args, **kwargs):
+        broker = get_broker()
+        channel = shopping_list_channel(self.kwargs["pk"])
+        last_event_id = request.headers.get(
+            "Last-Event-ID", request.query_params.get("last_event_id", "")
+        )
+        after_id = (
+            int(last_event_id) if last_event_id.isdigit() else broker.last_id(channel)
+        )
+
+        duration = getattr(settings, "SHOPPING_LIST_EVENTS_STREAM_TIMEOUT", 30)
+        if "timeout" in request.query_params:
+            try:
+                timeout = float(request.query_params["timeout"])
+            except ValueError:
+                timeout = math.nan
+            if not (math.isfinite(timeout) and timeout > 0):
+                raise ValidationError({"timeout": "Expected a positive number."})
+            duration = min(timeout, duration)
+
+        # A sync iterator would be consumed whole before sending under ASGI.
+        stream = (
+            self.astream if isinstance(request._request, ASGIRequest) else self.stream
+        )
+        response = StreamingHttpResponse(
+            stream(broker, channel, after_id, duration),
+            content_type="text/event-stream",
+        )
+        response["Cache-Control"] = "no-cache"
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def stream(self, broker, channel, after_id, duration):
+        yield f"retry: {self.retry_milliseconds}\n\n"
+        deadline = time.monotonic() + duration
+        while True:
+            try:
+                events = broker.read(channel, after_id, self.wait_time(deadline))
+            except EventsLost:
+                after_id = broker.last_id(channel)
+                yield self.format_reset(after_id)
+                continue
+
+            after_id, chunk = self.format_events(events, after_id)
+            yield chunk
+            if time.monotonic() >= deadline:
+                return
+
+    async def astream(self, broker, channel, after_id, duration):
+        yield f"retry: {self.retry_milliseconds}\n\n"
+        deadline = time.monotonic() + duration
+        while True:
+            try:
+                events = await broker.aread(channel, after_id, self.wait_time(deadline))
+            except EventsLost:
+                after_id = broker.last_id(channel)
+                yield self.format_reset(after_id)
+                continue
+
+            after_id, chunk = self.format_events(events, after_id)
+            yield chunk
+            if time.monotonic() >= deadline:
+                return
+
+    def wait_time(self, deadline):
+        return max(0, min(self.heartbeat_interval, deadline - time.monotonic()))
+
+    def format_reset(self, last_id):
+        return f"id: {last_id}\nevent: reset\ndata: {{}}\n\n"
+
+    def format_events(self, events, after_id):
+        """Return the id of the last event and the events as a stream chunk."""
+        if not events:
+            return after_id, ": keep-alive\n\n"
+
+        return events[-1][0], "".join(
+            f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+            for event_id, event_type, data in events
+        )
+
+
+class Sync(ServerTimingMixin, generics.GenericAPIView):
+    """Return what changed in the user's lists since the given sync token."""
+
+    max_limit = 1000
+
+    def get(self, request, *args, **kwargs):
+        try:
+            limit = min(int(request.query_params.get("limit", 100)), self.max_limit)
+        except ValueError:
+            raise ValidationError({"limit": "A valid integer is required."})
+        if limit < 1:
+            raise ValidationError({"limit": "Ensure this value is at least 1."})
+
+        try:
+            changes, sync_token, has_more = get_changes(
+                request.user, request.query_params.get("since"), limit
+            )
+        except InvalidSyncToken:
+            raise ValidationError({"since": "Invalid sync token."})
+
+        return Response(
+            {"changes": changes, "sync_token": sync_token, "has_more": has_more}
+        )
+
+
+class ExportMixin:
+    """Stream shopping lists as NDJSON (the default) or CSV.
+
+    The format follows the Accept header or ?format=ndjson|csv. Under ASGI
+    the lines are sent from an async iterator.
+    """
+
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+
+    def get_export_queryset(self):
+        raise NotImplementedError
+
+    def get_export_filename(self):
+        raise NotImplementedError
+
+    def get_export_rows(self):
+        return export_rows(self.get_export_queryset())
+
+    def get(self, request, *args, **kwargs):
+        renderer = request.accepted_renderer
+        lines = WRITERS[renderer.format](self.get_export_rows())
+        if isinstance(request._request, ASGIRequest):
+            lines = astream(lines)
+        response = StreamingHttpResponse(
+            lines,
+            content_type=f"{renderer.media_type}; charset=utf-8",
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{self.get_export_filename()}.{renderer.format}"'
+        )
+        return response
+
+
+class ExportShoppingList(ServerTimingMixin, ExportMixin, generics.GenericAPIView):
+    permission_classes = [AllShoppingItemsShoppingListMembersOnly]
+
+    def get_export_queryset(self):
+        return on_shard(
+            ShoppingList.objects.filter(pk=self.kwargs["pk"]), self.kwargs["pk"]
+        )
+
+    def get_export_filename(self):
+        return f"shopping-list-{self.kwargs['pk']}"
+
+
+class ExportShoppingLists(ServerTimingMixin, ExportMixin, generics.GenericAPIView):
+    def get_export_queryset(self):
+        return user_shopping_lists(self.request.user)
+
+    def get_export_rows(self):
+        # The lists of one shard after the other.
+        return chain.from_iterable(
+            export_rows(queryset) for queryset in scatter(self.get_export_queryset())
+        )
+
+    def get_export_filename(self):
+        return "shopping-lists"
+
+
+class ImportShoppingLists(ServerTimingMixin, generics.GenericAPIView):
+    """Import an uploaded NDJSON or CSV `file` into new shopping lists.
+
+    The response streams one NDJSON line per rejected row, a progress line
+    after every batch and a final summary. An error that stops the import is
+    reported on the row it happened at, before the summary. A client that
+    disconnects aborts the import after the last committed batch. Under ASGI
+    the reports are sent from an async iterator.
+    """
+
+    parser_classes = [MultiPartParser]
+    renderer_classes = [FastJSONRenderer, NDJSONRenderer]
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get("file")
+        if upload is None:
+            raise ValidationError({"file": "This field is required."})
+        is_csv = (
+            upload.name.lower().endswith(".csv") or upload.content_type == "text/csv"
+        )
+        records = PARSERS["csv" if is_csv else "ndjson"](upload)
+
+        batch_size = getattr(settings, "SHOPPING_LIST_IMPORT_BATCH_SIZE", BATCH_SIZE)
+        importer = ShoppingListImporter(request.user, batch_size)
+        if isinstance(request._request, ASGIRequest):
+            lines = self.astream(importer.arun(records))
+        else:
+            lines = self.stream(importer.run(records))
+        return StreamingHttpResponse(
+            lines, content_type=f"{NDJSONRenderer.media_type}; charset=utf-8"
+        )
+
+    def stream(self, reports):
+        # Closing the response closes the importer, which aborts the import.
+        with closing(reports):
+            for report in reports:
+                yield json.dumps(report) + "\n"
+
+    async def astream(self, reports):
+        async with aclosing(reports):
+            async for report in reports:
+                yield json.dumps(report) + "\n"
+
+
+class IssueToken(ServerTimingMixin, generics.GenericAPIView):
+    """Exchange a username and password for a signed, expiring API token.
+
+    Attempts are throttled per client by the "token" rate, so that passwords
+    cannot be guessed at full speed.
+    """
+
+    authentication_classes = []
+    permission_classes = []
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = "token"
+    serializer_class = AuthTokenSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        return Response(
+            {
+                "token": issue_token(serializer.validated_data["user"]),
+                "expires_in": get_token_max_age(),
+            }
+        )
+
+
+class Metrics(ServerTimingMixin, generics.GenericAPIView):
+    """Per-route request metrics of all worker processes, for Prometheus."""
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(
+            render_metrics(get_metrics_store().collect()),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
@@ -0,0 +1,101 @@
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from shopping_list.models import ShoppingList
+from shopping_list.sharding import group_by_shard
+
+_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+
+def get_cache():
+    return caches[getattr(settings, "SHOPPING_LIST_CACHE", "default")]
+
+
+def get_response_cache():
+    """Return the cache for responses, or None if responses must not be cached.
+
+    A LocMemCache belongs to one process: versions bumped by a write in one
+    worker never reach the others, which would keep serving stale responses.
+    It is only used when SHOPPING_LIST_CACHE_SINGLE_PROCESS says there are no
+    other workers.
+    """
+    cache = get_cache()
+    if isinstance(cache, LocMemCache) and not getattr(
+        settings, "SHOPPING_LIST_CACHE_SINGLE_PROCESS", False
+    ):
+        return None
+
+    return cache
+
+
+def _list_version_key(shopping_list_id):
+    return f"shopping-list-version:{shopping_list_id}"
+
+
+def _user_version_key(user_id):
+    return f"shopping-lists-version:{user_id}"
+
+
+def _get_version(key):
+    cache = get_cache()
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+
+    return version
+
+
+def shopping_list_version(shopping_list_id):
+    """Return a token that changes whenever the shopping list changes."""
+    return _get_version(_list_version_key(shopping_list_id))
+
+
+def user_shopping_lists_version(user_id):
+    """Return a token that changes whenever any list of the user changes."""
+    return _get_version(_user_version_key(user_id))
+
+
+def invalidate(shopping_list_ids=(), user_ids=()):
+    """Give new versions to shopping lists and to the lists of some users.
+
+    Cached responses built from an older version are never read again and
+    expire on their own.
+    """
+    keys = [
+        _list_version_key(shopping_list_id) for shopping_list_id in shopping_list_ids
+    ]
+    keys += [_user_version_key(user_id) for user_id in user_ids]
+    if keys:
+        get_cache().set_many({key: uuid.uuid4().hex for key in keys}, None)
+
+
+def invalidate_shopping_lists(shopping_list_ids):
+    """Invalidate shopping lists along with the list overviews of their members."""
+    shopping_list_ids = set(shopping_list_ids)
+    if not shopping_list_ids:
+        return
+
+    user_ids = set()
+    for shard, ids in group_by_shard(shopping_list_ids).items():
+        user_ids.update(
+            ShoppingList.members.through.objects.using(shard)
+            .filter(shoppinglist_id__in=ids)
+            .values_list("user_id", flat=True)
+        )
+    invalidate(shopping_list_ids, user_ids)
+
+
+def record_lookup(hit):
+    with _stats_lock:
+        _stats["hits" if hit else "misses"] += 1
+
+
+def cache_stats():
+    """Return the response cache hits and misses counted by this process."""
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,244 @@
+"""Publish/subscribe of shopping list change events.
+
+Events are published to a channel per shopping list and read back after a
+last-seen event id, which lets Server-Sent Events clients resume where they
+left off. The broker is chosen with the SHOPPING_LIST_EVENTS setting.
+"""
+
+import asyncio
+import fcntl
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class EventsLost(Exception):
+    """The requested events are no longer available; the client must resync."""
+
+
+class BaseBroker:
+    # Seconds between two checks for new events in aread().
+    poll_interval = 0.5
+
+    def publish(self, channel, event_type, data):
+        """Append an event to the channel and return its id."""
+        raise NotImplementedError
+
+    def last_id(self, channel):
+        """Return the id of the newest event of the channel, or 0."""
+        raise NotImplementedError
+
+    def read(self, channel, after_id, timeout):
+        """Return a list of (id, event_type, data) published after `after_id`.
+
+        Waits up to `timeout` seconds for the first event and raises
+        EventsLost when events after `after_id` have been discarded, or when
+        `after_id` is newer than any event, e.g. from before a restart.
+        """
+        raise NotImplementedError
+
+    async def aread(self, channel, after_id, timeout):
+        """read() for async code, polling instead of holding a thread."""
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self.read(channel, after_id, 0)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            await asyncio.sleep(min(self.poll_interval, remaining))
+
+
+class InProcessBroker(BaseBroker):
+    """Keeps the latest events of every channel in memory.
+
+    Only requests served by the same process see each other's events.
+    """
+
+    poll_interval = 0.1
+
+    def __init__(self, max_events=1000):
+        self.max_events = max_events
+        self.channels = {}
+        self.discarded = {}
+        self.next_id = 1
+        self.condition = threading.Condition()
+
+    def publish(self, channel, event_type, data):
+        with self.condition:
+            event_id = self.next_id
+            self.next_id += 1
+            events = self.channels.setdefault(channel, deque(maxlen=self.max_events))
+            if len(events) == self.max_events:
+                self.discarded[channel] = events[0][0]
+            events.append((event_id, event_type, data))
+            self.condition.notify_all()
+
+        return event_id
+
+    def last_id(self, channel):
+        with self.condition:
+            events = self.channels.get(channel)
+            return events[-1][0] if events else 0
+
+    def _events_after(self, channel, after_id):
+        # Ids above the newest one were handed out by another process.
+        if after_id < self.discarded.get(channel, 0) or after_id >= self.next_id:
+            raise EventsLost()
+
+        return [
+            event for event in self.channels.get(channel, ()) if event[0] > after_id
+        ]
+
+    def read(self, channel, after_id, timeout):
+        with self.condition:
+            self.condition.wait_for(
+                lambda: self._events_after(channel, after_id), timeout=timeout
+            )
+            return self._events_after(channel, after_id)
+
+
+class FileBroker(BaseBroker):
+    """Appends the events of every channel to files in a shared directory.
+
+    Every process on the host sees the same events, which makes this a local
+    stand-in for a networked broker. Event ids are byte offsets in the stream
+    of events of a channel. The stream is split into segment files named
+    after their first offset: once the newest segment holds `max_bytes`, the
+    next event starts a new one and all but the two newest are removed. A
+    channel thus keeps between `max_bytes` and twice as many bytes of events,
+    and clients that fell further behind get a reset.
+    """
+
+    def __init__(self, location, poll_interval=0.5, max_bytes=1024 * 1024):
+        self.location = Path(location)
+        self.poll_interval = poll_interval
+        self.max_bytes = max_bytes
+        self.location.mkdir(parents=True, exist_ok=True)
+
+    def _prefix(self, channel):
+        return channel.replace(":", "-")
+
+    def _path(self, channel, start):
+        return self.location / f"{self._prefix(channel)}.{start}.ndjson"
+
+    def _segments(self, channel):
+        """Return (start, size, path) of every segment, oldest first."""
+        prefix = f"{self._prefix(channel)}."
+        segments = []
+        for path in self.location.glob(f"{prefix}*.ndjson"):
+            start = path.name[len(prefix) : -len(".ndjson")]
+            if start.isdigit():
+                segments.append((int(start), path.stat().st_size, path))
+        return sorted(segments)
+
+    @contextmanager
+    def _locked(self, channel, operation):
+        with open(self.location / f"{self._prefix(channel)}.lock", "ab") as lock:
+            fcntl.flock(lock, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def publish(self, channel, event_type, data):
+        line = json.dumps([event_type, data], separators=(",", ":")) + "\n"
+        with self._locked(channel, fcntl.LOCK_EX):
+            segments = self._segments(channel)
+            start, size, path = segments[-1] if segments else (0, 0, None)
+            if path is None or size >= self.max_bytes:
+                for _, _, old in segments[:-1]:
+                    old.unlink()
+                start += size
+                path = self._path(channel, start)
+            with open(path, "ab") as file:
+                file.write(line.encode())
+                return start + file.tell()
+
+    def last_id(self, channel):
+        with self._locked(channel, fcntl.LOCK_SH):
+            segments = self._segments(channel)
+        if not segments:
+            return 0
+        start, size, _ = segments[-1]
+        return start + size
+
+    def _events_after(self, channel, after_id):
+        with self._locked(channel, fcntl.LOCK_SH):
+            segments = self._segments(channel)
+            if not segments:
+                if after_id > 0:
+                    raise EventsLost()
+                return []
+
+            first, last = segments[0], segments[-1]
+            if not first[0] <= after_id <= last[0] + last[1]:
+                raise EventsLost()
+
+            events = []
+            for start, size, path in segments:
+                if start + size <= after_id:
+                    continue
+                with open(path, "rb") as file:
+                    offset = max(after_id - start, 0)
+                    # Ids that do not end an event, e.g. from another channel
+                    # or broker, cannot be resumed from.
+                    if offset:
+                        file.seek(offset - 1)
+                        if file.read(1) != b"\n":
+                            raise EventsLost()
+                    for line in iter(file.readline, b""):
+                        offset += len(line)
+                        try:
+                            event_type, data = json.loads(line)
+                        except (TypeError, ValueError):
+                            raise EventsLost()
+                        events.append((start + offset, event_type, data))
+            return events
+
+    def read(self, channel, after_id, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self._events_after(channel, after_id)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            time.sleep(min(self.poll_interval, remaining))
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    config = getattr(
+        settings,
+        "SHOPPING_LIST_EVENTS",
+        {"BACKEND": "shopping_list.events.InProcessBroker"},
+    )
+    return import_string(config["BACKEND"])(**config.get("OPTIONS", {}))
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    if setting == "SHOPPING_LIST_EVENTS":
+        get_broker.cache_clear()
+
+
+def shopping_list_channel(shopping_list_id):
+    return f"shopping-list:{shopping_list_id}"
+
+
+def publish_shopping_list_event(shopping_list_id, event_type, data):
+    """Publish an event about a shopping list once the transaction commits."""
+    transaction.on_commit(
+        lambda: get_broker().publish(
+            shopping_list_channel(shopping_list_id), event_type, data
+        )
+    )
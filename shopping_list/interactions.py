@@ -0,0 +1,88 @@
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from shopping_list.cache import invalidate_shopping_lists
+from shopping_list.models import ShoppingList
+from shopping_list.sharding import group_by_shard
+
+_pending_interactions = ContextVar("pending_shopping_list_interactions", default=None)
+
+
+def touch_shopping_lists(shopping_list_ids):
+    """Bump last_interaction of the given shopping lists, one UPDATE per shard.
+
+    Lists touched less than SHOPPING_LIST_INTERACTION_THRESHOLD seconds ago
+    are left alone so that the hottest rows are not rewritten on every write.
+    Cached responses of all the lists are invalidated either way, once the
+    UPDATE commits: a reader refilling the cache before then would otherwise
+    store the old order under the new version.
+    """
+    shopping_list_ids = set(shopping_list_ids)
+    if not shopping_list_ids:
+        return 0
+
+    now = timezone.now()
+    threshold = getattr(settings, "SHOPPING_LIST_INTERACTION_THRESHOLD", 0)
+    touched = 0
+    for shard, ids in group_by_shard(shopping_list_ids).items():
+        queryset = ShoppingList.objects.using(shard).filter(id__in=ids)
+        if threshold:
+            queryset = queryset.filter(
+                last_interaction__lt=now - timedelta(seconds=threshold)
+            )
+        touched += queryset.update(last_interaction=now)
+        transaction.on_commit(partial(invalidate_shopping_lists, ids), using=shard)
+
+    return touched
+
+
+def record_interaction(shopping_list_id):
+    pending = _pending_interactions.get()
+    if pending is None:
+        touch_shopping_lists([shopping_list_id])
+    else:
+        pending.add(shopping_list_id)
+
+
+@contextmanager
+def coalesce_interactions():
+    """Collect interactions recorded inside the block and flush them once.
+
+    Nested blocks join the outermost one. Nothing is flushed when the block
+    raises, and clearing the yielded set discards what was collected.
+    """
+    pending = _pending_interactions.get()
+    if pending is not None:
+        yield pending
+        return
+
+    pending = set()
+    token = _pending_interactions.set(pending)
+    try:
+        yield pending
+    finally:
+        _pending_interactions.reset(token)
+    touch_shopping_lists(pending)
+
+
+@asynccontextmanager
+async def acoalesce_interactions():
+    """coalesce_interactions for async code, flushing in a worker thread."""
+    pending = _pending_interactions.get()
+    if pending is not None:
+        yield pending
+        return
+
+    pending = set()
+    token = _pending_interactions.set(pending)
+    try:
+        yield pending
+    finally:
+        _pending_interactions.reset(token)
+    await sync_to_async(touch_shopping_lists)(pending)
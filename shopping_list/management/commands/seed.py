@@ -0,0 +1,133 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from shopping_list.models import ShoppingItem, ShoppingList, User
+from shopping_list.sharding import (
+    atomic_on_shards,
+    bulk_create_on_shards,
+    copy_users_to_shards,
+)
+
+
+@contextmanager
+def auto_now_disabled(*fields):
+    """Let the given auto_now fields keep the values set on the instances."""
+    for field in fields:
+        field.auto_now = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now = True
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with synthetic users, shopping lists and items. "
+        "Rows are written with bulk_create, bypassing model signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--lists", type=int, default=1_000)
+        parser.add_argument("--items", type=int, default=100_000)
+        parser.add_argument(
+            "--max-members", type=int, default=10, help="members of the largest list"
+        )
+        parser.add_argument(
+            "--skew",
+            type=float,
+            default=1.0,
+            help="Zipf exponent of items per list and members per list, 0 for uniform",
+        )
+        parser.add_argument(
+            "--days", type=int, default=30, help="spread of the interaction times"
+        )
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--seed", type=int, default=0, help="random seed")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        batch_size = options["batch_size"]
+        now = timezone.now()
+        span = timedelta(days=options["days"]).total_seconds()
+
+        def some_time_ago():
+            return now - timedelta(seconds=rng.random() * span)
+
+        with atomic_on_shards(), auto_now_disabled(
+            ShoppingList._meta.get_field("last_interaction"),
+            ShoppingItem._meta.get_field("updated_at"),
+        ):
+            # Hashing is slow and nobody logs in as a synthetic user.
+            password = make_password(None)
+            first = User.objects.count()
+            users = User.objects.bulk_create(
+                (
+                    User(username=f"seed-user-{first + n}", password=password)
+                    for n in range(options["users"])
+                ),
+                batch_size=batch_size,
+            )
+            copy_users_to_shards(users)
+            shopping_lists = ShoppingList.objects.bulk_create(
+                (
+                    ShoppingList(name=f"List {n}", last_interaction=some_time_ago())
+                    for n in range(options["lists"])
+                ),
+                batch_size=batch_size,
+            )
+            self.stdout.write(
+                f"Created {len(users)} users, {len(shopping_lists)} lists"
+            )
+
+            # The n-th list gets a share of the members and items proportional
+            # to 1 / n ** skew, so a few lists are much busier than the rest.
+            weights = [
+                1 / (n + 1) ** options["skew"] for n in range(len(shopping_lists))
+            ]
+            memberships = self.create_memberships(
+                rng, users, shopping_lists, weights, options["max_members"], batch_size
+            )
+            self.stdout.write(f"Created {memberships} memberships")
+
+            cum_weights = list(accumulate(weights))
+            created = 0
+            while shopping_lists and created < options["items"]:
+                size = min(batch_size, options["items"] - created)
+                owners = rng.choices(shopping_lists, cum_weights=cum_weights, k=size)
+                ShoppingItem.objects.bulk_create(
+                    ShoppingItem(
+                        name=f"Item {created + n}",
+                        purchased=rng.random() < 0.5,
+                        shopping_list=shopping_list,
+                        updated_at=some_time_ago(),
+                    )
+                    for n, shopping_list in enumerate(owners)
+                )
+                created += size
+                self.stdout.write(f"Created {created} items")
+
+    def create_memberships(
+        self, rng, users, shopping_lists, weights, max_members, batch_size
+    ):
+        if not users or not shopping_lists:
+            return 0
+
+        Membership = ShoppingList.members.through
+        members_per_weight = min(max_members, len(users)) / weights[0]
+        memberships = (
+            Membership(shoppinglist_id=shopping_list.id, user_id=user.id)
+            for shopping_list, weight in zip(shopping_lists, weights)
+            for user in rng.sample(users, max(1, round(weight * members_per_weight)))
+        )
+        return len(
+            bulk_create_on_shards(
+                Membership.objects.all(), memberships, batch_size=batch_size
+            )
+        )
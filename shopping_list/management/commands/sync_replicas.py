@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database over its replicas, standing in for "
+        "replication during development."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "aliases",
+            nargs="*",
+            help="replicas to refresh, SHOPPING_LIST_REPLICAS by default",
+        )
+
+    def handle(self, *args, **options):
+        aliases = options["aliases"] or getattr(settings, "SHOPPING_LIST_REPLICAS", [])
+        if not aliases:
+            raise CommandError("No replicas given and SHOPPING_LIST_REPLICAS is empty.")
+
+        primary = connections[DEFAULT_DB_ALIAS]
+        for alias in aliases:
+            replica = connections[alias]
+            if primary.vendor != "sqlite" or replica.vendor != "sqlite":
+                raise CommandError("Only SQLite databases can be copied.")
+            primary.ensure_connection()
+            replica.ensure_connection()
+            primary.connection.backup(replica.connection)
+            self.stdout.write(f"Copied {DEFAULT_DB_ALIAS} to {alias}")
@@ -0,0 +1,263 @@
+"""Per-route request metrics shared between worker processes.
+
+Every process counts its own requests in memory and writes them to its own
+JSON file in SHOPPING_LIST_METRICS_DIR, from a background thread every
+SHOPPING_LIST_METRICS_FLUSH_INTERVAL seconds while there is something new and
+once more when the process exits. Files are replaced atomically, so readers
+never see partial writes. The metrics endpoint adds up all files, and folds
+those of processes that no longer run into a single file of retired
+processes, so that counters never go backwards. The workers must therefore
+share a host as well as the directory.
+"""
+
+import atexit
+import fcntl
+import json
+import os
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+RETIRED = "metrics-retired.json"
+
+
+def _new_histogram(buckets):
+    return {"buckets": [0] * (len(buckets) + 1), "sum": 0}
+
+
+def _observe(histogram, buckets, value):
+    histogram["buckets"][bisect_left(buckets, value)] += 1
+    histogram["sum"] += value
+
+
+def _has_exited(path):
+    pid = path.stem.removeprefix("metrics-")
+    if not pid.isdigit() or int(pid) == os.getpid():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass
+    return False
+
+
+def _add_up(paths):
+    totals = {
+        "requests": defaultdict(int),
+        "latency": {},
+        "queries": {},
+        "cache": defaultdict(int),
+    }
+    for path in paths:
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        for *key, value in data["requests"]:
+            totals["requests"][tuple(key)] += value
+        for *key, value in data["cache"]:
+            totals["cache"][tuple(key)] += value
+        for name in ["latency", "queries"]:
+            for *key, histogram in data[name]:
+                total = totals[name].setdefault(
+                    tuple(key),
+                    {"buckets": [0] * len(histogram["buckets"]), "sum": 0},
+                )
+                for index, count in enumerate(histogram["buckets"]):
+                    total["buckets"][index] += count
+                total["sum"] += histogram["sum"]
+    return totals
+
+
+def _write(path, metrics):
+    # Keys are tuples, so every entry is stored as a [*key, value] list.
+    data = {
+        name: [[*key, value] for key, value in values.items()]
+        for name, values in metrics.items()
+    }
+    temporary = path.with_suffix(f".{threading.get_ident()}.tmp")
+    temporary.write_text(json.dumps(data))
+    os.replace(temporary, path)
+
+
+class MetricsStore:
+    def __init__(self, location, flush_interval=1):
+        self.location = Path(location)
+        self.flush_interval = flush_interval
+        self.pid = os.getpid()
+        self.path = self.location / f"metrics-{self.pid}.json"
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.latency = {}
+        self.queries = {}
+        self.cache = defaultdict(int)
+        self.changed = False
+        self.stopped = threading.Event()
+        self.flusher = None
+
+    def observe(self, route, method, status, duration, queries, cache=None):
+        with self.lock:
+            self.requests[route, method, str(status)] += 1
+            key = (route,)
+            if key not in self.latency:
+                self.latency[key] = _new_histogram(LATENCY_BUCKETS)
+                self.queries[key] = _new_histogram(QUERY_BUCKETS)
+            _observe(self.latency[key], LATENCY_BUCKETS, duration)
+            _observe(self.queries[key], QUERY_BUCKETS, queries)
+            if cache:
+                self.cache[route, cache] += 1
+            self.changed = True
+
+            if self.flusher is None:
+                self.flusher = threading.Thread(
+                    target=self.flush_periodically, name="metrics-flush", daemon=True
+                )
+                self.flusher.start()
+                atexit.register(self.close)
+
+    def flush_periodically(self):
+        while not self.stopped.wait(self.flush_interval):
+            if self.changed:
+                self.flush()
+
+    def close(self):
+        """Stop the background flushes and write what is left."""
+        self.stopped.set()
+        atexit.unregister(self.close)
+        # A forked child inherits the exit handler, but not this store's file.
+        if self.changed and os.getpid() == self.pid:
+            self.flush()
+
+    def snapshot(self):
+        with self.lock:
+            self.changed = False
+            return {
+                "requests": dict(self.requests),
+                "latency": dict(self.latency),
+                "queries": dict(self.queries),
+                "cache": dict(self.cache),
+            }
+
+    def flush(self):
+        # One at a time, so that a newer snapshot is never overwritten.
+        with self.flush_lock:
+            self.location.mkdir(parents=True, exist_ok=True)
+            _write(self.path, self.snapshot())
+
+    def retire_exited(self):
+        """Fold the files of processes that no longer run into one file."""
+        if not any(map(_has_exited, self.location.glob("metrics-*.json"))):
+            return
+
+        with open(self.location / "metrics.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            exited = [
+                path
+                for path in self.location.glob("metrics-*.json")
+                if _has_exited(path)
+            ]
+            retired = self.location / RETIRED
+            _write(retired, _add_up([retired, *exited]))
+            for path in exited:
+                path.unlink()
+
+    def collect(self):
+        """Add up the metrics written by every process, this one included."""
+        self.flush()
+        self.retire_exited()
+        return _add_up(self.location.glob("metrics-*.json"))
+
+
+_stores = {}
+
+
+def get_metrics_store():
+    # Keyed by process so that workers forked from a loaded app get their own.
+    pid = os.getpid()
+    if pid not in _stores:
+        _stores.clear()
+        _stores[pid] = MetricsStore(
+            getattr(
+                settings,
+                "SHOPPING_LIST_METRICS_DIR",
+                Path(settings.BASE_DIR) / ".metrics",
+            ),
+            getattr(settings, "SHOPPING_LIST_METRICS_FLUSH_INTERVAL", 1),
+        )
+    return _stores[pid]
+
+
+@receiver(setting_changed)
+def reset_metrics_store(setting, **kwargs):
+    if setting.startswith("SHOPPING_LIST_METRICS_"):
+        for store in _stores.values():
+            store.close()
+        _stores.clear()
+
+
+def _labels(**labels):
+    return ",".join(
+        f'{name}="{value}"' for name, value in labels.items() if value is not None
+    )
+
+
+def _histogram_lines(name, buckets, histograms):
+    for (route,), histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip((*buckets, "+Inf"), histogram["buckets"]):
+            cumulative += count
+            yield f"{name}_bucket{{{_labels(route=route, le=bound)}}} {cumulative}"
+        yield f"{name}_sum{{{_labels(route=route)}}} {histogram['sum']}"
+        yield f"{name}_count{{{_labels(route=route)}}} {cumulative}"
+
+
+def render_metrics(totals):
+    """Format collected metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP shopping_list_requests_total Requests by route, method and status.",
+        "# TYPE shopping_list_requests_total counter",
+    ]
+    for (route, method, status), count in sorted(totals["requests"].items()):
+        labels = _labels(route=route, method=method, status=status)
+        lines.append(f"shopping_list_requests_total{{{labels}}} {count}")
+
+    lines += [
+        "# HELP shopping_list_request_duration_seconds Request latency by route.",
+        "# TYPE shopping_list_request_duration_seconds histogram",
+        *_histogram_lines(
+            "shopping_list_request_duration_seconds", LATENCY_BUCKETS, totals["latency"]
+        ),
+        "# HELP shopping_list_request_queries SQL queries per request by route.",
+        "# TYPE shopping_list_request_queries histogram",
+        *_histogram_lines(
+            "shopping_list_request_queries", QUERY_BUCKETS, totals["queries"]
+        ),
+        "# HELP shopping_list_cache_lookups_total Response cache lookups by route.",
+        "# TYPE shopping_list_cache_lookups_total counter",
+    ]
+    lookups = defaultdict(dict)
+    for (route, result), count in sorted(totals["cache"].items()):
+        lookups[route][result] = count
+        labels = _labels(route=route, result=result)
+        lines.append(f"shopping_list_cache_lookups_total{{{labels}}} {count}")
+
+    lines += [
+        "# HELP shopping_list_cache_hit_ratio Share of response cache hits by route.",
+        "# TYPE shopping_list_cache_hit_ratio gauge",
+    ]
+    for route, results in lookups.items():
+        ratio = results.get("hit", 0) / sum(results.values())
+        lines.append(f"shopping_list_cache_hit_ratio{{{_labels(route=route)}}} {ratio}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,278 @@
+import json
+import logging
+import random
+import time
+from contextlib import nullcontext
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from shopping_list.interactions import acoalesce_interactions, coalesce_interactions
+from shopping_list.metrics import get_metrics_store
+from shopping_list.nplusone import (
+    NPlusOneError,
+    arecord_query_patterns,
+    record_query_patterns,
+)
+from shopping_list.routers import get_pin_cache, pin_to_primary, track_writes
+from shopping_list.timing import atime_request, get_timer, time_request
+
+logger = logging.getLogger("shopping_list.timing")
+nplusone_logger = logging.getLogger("shopping_list.nplusone")
+
+
+class HybridMiddleware:
+    """Middleware running natively both under WSGI and ASGI.
+
+    Subclasses implement `call(request)` and the coroutine `acall(request)`,
+    so that Django never has to adapt the middleware chain to sync under ASGI.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.acall(request)
+        return self.call(request)
+
+
+class CoalesceInteractionsMiddleware(HybridMiddleware):
+    """Touch every shopping list changed by a request once, when it is done.
+
+    Failed requests touch nothing, so that they do not reorder the lists.
+    """
+
+    def call(self, request):
+        with coalesce_interactions() as interactions:
+            response = self.get_response(request)
+            self.discard_if_failed(response, interactions)
+
+        return response
+
+    async def acall(self, request):
+        async with acoalesce_interactions() as interactions:
+            response = await self.get_response(request)
+            self.discard_if_failed(response, interactions)
+
+        return response
+
+    def discard_if_failed(self, response, interactions):
+        if response.status_code >= 400:
+            interactions.clear()
+
+
+class PinWritersToPrimaryMiddleware(HybridMiddleware):
+    """Keep users who just wrote to the database reading from the primary."""
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if getattr(settings, "SHOPPING_LIST_REPLICAS", []):
+            # Refuse to start with a pin cache the workers do not share.
+            get_pin_cache()
+
+    def call(self, request):
+        if not getattr(settings, "SHOPPING_LIST_REPLICAS", []):
+            return self.get_response(request)
+
+        with track_writes() as writes:
+            response = self.get_response(request)
+        if writes:
+            self.pin_writer(request)
+
+        return response
+
+    async def acall(self, request):
+        if not getattr(settings, "SHOPPING_LIST_REPLICAS", []):
+            return await self.get_response(request)
+
+        with track_writes() as writes:
+            response = await self.get_response(request)
+        if writes:
+            # Reading request.user may load the session.
+            await sync_to_async(self.pin_writer)(request)
+
+        return response
+
+    def pin_writer(self, request):
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            pin_to_primary(user.pk)
+
+
+class ServerTimingMiddleware(HybridMiddleware):
+    """Report where the time of each request went in a Server-Timing header.
+
+    Counts and times the SQL queries of the request; views and serializers
+    add their permission, serializer and render phases through
+    `shopping_list.timing.timed`. SHOPPING_LIST_SERVER_TIMING sends the header
+    to every client when True, only to staff users when "staff", or to no one.
+    With SHOPPING_LIST_SERVER_TIMING_LOG set, the same figures are logged as a
+    JSON line to the "shopping_list.timing" logger. Streaming responses only
+    cover the work done before streaming.
+    """
+
+    phases = ("permissions", "serializer", "render")
+
+    def call(self, request):
+        with time_request() as timer:
+            request.timer = timer
+            response = self.get_response(request)
+
+        return self.add_timing(request, response, timer, self.show_timing(request))
+
+    async def acall(self, request):
+        async with atime_request() as timer:
+            request.timer = timer
+            response = await self.get_response(request)
+
+        # Reading request.user may load the session.
+        show = await sync_to_async(self.show_timing)(request)
+        return self.add_timing(request, response, timer, show)
+
+    def show_timing(self, request):
+        audience = getattr(settings, "SHOPPING_LIST_SERVER_TIMING", True)
+        if audience == "staff":
+            user = getattr(request, "user", None)
+            return user is not None and user.is_staff
+        return bool(audience)
+
+    def add_timing(self, request, response, timer, show):
+        durations = {"db": timer.durations.get("db", 0)}
+        durations.update(
+            (phase, timer.durations.get(phase, 0)) for phase in self.phases
+        )
+        durations["total"] = timer.total
+        if show:
+            response["Server-Timing"] = ", ".join(
+                f"{name};dur={duration * 1000:.2f}"
+                + (f';desc="{timer.queries} queries"' if name == "db" else "")
+                for name, duration in durations.items()
+            )
+
+        if getattr(settings, "SHOPPING_LIST_SERVER_TIMING_LOG", False):
+            match = request.resolver_match
+            logger.info(
+                json.dumps(
+                    {
+                        "route": match.url_name if match else None,
+                        "method": request.method,
+                        "path": request.path,
+                        "status": response.status_code,
+                        "queries": timer.queries,
+                        **{
+                            f"{name}_ms": round(duration * 1000, 2)
+                            for name, duration in durations.items()
+                        },
+                    }
+                )
+            )
+
+        return response
+
+    def process_template_response(self, request, response):
+        # Called right before the response is rendered.
+        started = time.perf_counter()
+        response.add_post_render_callback(
+            lambda response: request.timer.add("render", time.perf_counter() - started)
+        )
+        return response
+
+
+class MetricsMiddleware(HybridMiddleware):
+    """Record the latency, queries and cache use of requests to named routes."""
+
+    def call(self, request):
+        timer = get_timer()
+        with nullcontext(timer) if timer else time_request() as timer:
+            started = time.perf_counter()
+            queries = timer.queries
+            response = self.get_response(request)
+
+        return self.observe(request, response, timer, started, queries)
+
+    async def acall(self, request):
+        timer = get_timer()
+        async with nullcontext(timer) if timer else atime_request() as timer:
+            started = time.perf_counter()
+            queries = timer.queries
+            response = await self.get_response(request)
+
+        return self.observe(request, response, timer, started, queries)
+
+    def observe(self, request, response, timer, started, queries):
+        match = request.resolver_match
+        if match is not None and match.url_name:
+            get_metrics_store().observe(
+                match.url_name,
+                request.method,
+                response.status_code,
+                time.perf_counter() - started,
+                timer.queries - queries,
+                response.headers.get("X-Cache", "").lower() or None,
+            )
+
+        return response
+
+
+class NPlusOneMiddleware(HybridMiddleware):
+    """Flag requests that repeat a query shape, see `shopping_list.nplusone`.
+
+    SHOPPING_LIST_NPLUSONE is "raise" to fail such requests with NPlusOneError,
+    as the test suite does, "log" to log a warning for a sample of
+    SHOPPING_LIST_NPLUSONE_SAMPLE_RATE of all requests, or None. Views whose
+    repeated queries are expected set `allow_repeated_queries = True`.
+    """
+
+    def get_mode(self):
+        """Return the mode to check the request in, or None to skip it."""
+        mode = getattr(settings, "SHOPPING_LIST_NPLUSONE", None)
+        sample_rate = getattr(settings, "SHOPPING_LIST_NPLUSONE_SAMPLE_RATE", 1)
+        if mode == "log" and random.random() >= sample_rate:
+            return None
+        return mode
+
+    def call(self, request):
+        mode = self.get_mode()
+        if mode is None:
+            return self.get_response(request)
+
+        with record_query_patterns() as recorder:
+            response = self.get_response(request)
+
+        return self.check(request, response, recorder, mode)
+
+    async def acall(self, request):
+        mode = self.get_mode()
+        if mode is None:
+            return await self.get_response(request)
+
+        async with arecord_query_patterns() as recorder:
+            response = await self.get_response(request)
+
+        return self.check(request, response, recorder, mode)
+
+    def check(self, request, response, recorder, mode):
+        if getattr(request, "allow_repeated_queries", False):
+            return response
+
+        threshold = getattr(settings, "SHOPPING_LIST_NPLUSONE_THRESHOLD", 3)
+        for shape, count in recorder.repeated(threshold):
+            match = request.resolver_match
+            message = (
+                f"{request.method} {match.url_name if match else request.path} "
+                f"ran {count} queries shaped like: {shape}"
+            )
+            if mode == "raise":
+                raise NPlusOneError(message)
+            nplusone_logger.warning(message)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, "view_class", view_func)
+        request.allow_repeated_queries = getattr(view, "allow_repeated_queries", False)
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:18
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+def mark_duplicate_unpurchased_items_purchased(apps, schema_editor):
+    # Items that raced past the old Python-side check would violate the new
+    # constraint; keep one of each and check the others off.
+    ShoppingItem = apps.get_model("shopping_list", "ShoppingItem")
+    seen = set()
+    duplicates = []
+    for item in ShoppingItem.objects.filter(purchased=False).order_by("id"):
+        key = (item.shopping_list_id, item.name.lower())
+        if key in seen:
+            duplicates.append(item.id)
+        seen.add(key)
+    ShoppingItem.objects.filter(id__in=duplicates).update(purchased=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("shopping_list", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="shoppingitem",
+            index=models.Index(
+                fields=["shopping_list", "purchased"],
+                name="shoppingitem_list_purchased",
+            ),
+        ),
+        migrations.RunPython(
+            mark_duplicate_unpurchased_items_purchased, migrations.RunPython.noop
+        ),
+        migrations.AddConstraint(
+            model_name="shoppingitem",
+            constraint=models.UniqueConstraint(
+                models.F("shopping_list"),
+                django.db.models.functions.text.Lower("name"),
+                condition=models.Q(("purchased", False)),
+                name="unique_unpurchased_item_name",
+            ),
+        ),
+    ]
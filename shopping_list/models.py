@@ -3,6 +3,9 @@ import uuid
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
+from shopping_list.sharding import ShardQuerySet
 
 
 class ShoppingList(models.Model):
@@ -11,6 +14,8 @@ class ShoppingList(models.Model):
     members = models.ManyToManyField(settings.AUTH_USER_MODEL)
     last_interaction = models.DateTimeField(auto_now=True)
 
+    objects = ShardQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -22,10 +27,76 @@ class ShoppingItem(models.Model):
     shopping_list = models.ForeignKey(
         ShoppingList, on_delete=models.CASCADE, related_name="shopping_items"
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ShardQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["shopping_list", "purchased"],
+                name="shoppingitem_list_purchased",
+            ),
+            models.Index(
+                fields=["shopping_list", "updated_at"],
+                name="shoppingitem_list_updated_at",
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                "shopping_list",
+                Lower("name"),
+                condition=models.Q(purchased=False),
+                name="unique_unpurchased_item_name",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.name}"
 
 
+class Tombstone(models.Model):
+    """Records a deletion so that syncing clients can drop their copy."""
+
+    SHOPPING_LIST = "shopping_list"
+    SHOPPING_ITEM = "shopping_item"
+    KIND_CHOICES = [
+        (SHOPPING_LIST, "Shopping list"),
+        (SHOPPING_ITEM, "Shopping item"),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.UUIDField()
+    # Not foreign keys: the shopping list may be deleted as well.
+    shopping_list_id = models.UUIDField()
+    # For shopping lists, the member that lost access to it.
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE
+    )
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = ShardQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
+
+
+class Grant(models.Model):
+    """Records that a user gained access to a shopping list.
+
+    Syncing clients of the user then receive all the items of the list, which
+    may be older than their sync token.
+    """
+
+    shopping_list_id = models.UUIDField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    granted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    objects = ShardQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.user_id} {self.shopping_list_id}"
+
+
 class User(AbstractUser):
     pass
@@ -0,0 +1,62 @@
+"""Detection of N+1 query patterns in requests.
+
+The SELECT statements of a request are reduced to their shape, with literals
+and the length of IN lists erased. A shape that is repeated at least
+SHOPPING_LIST_NPLUSONE_THRESHOLD times on one database is almost always a
+related object fetched once per row instead of prefetched. Shapes are counted
+per database, since queries scattered over the shards run once on each.
+"""
+
+import re
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+
+from shopping_list.timing import awrap_queries, wrap_queries
+
+_IN_LIST = re.compile(r"\bIN \((?:%s, )*%s\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class NPlusOneError(Exception):
+    """A request repeated the same query shape too often."""
+
+
+def query_shape(sql):
+    sql = _IN_LIST.sub("IN (...)", sql)
+    sql = _LITERAL.sub("?", sql)
+    return _WHITESPACE.sub(" ", sql).strip()
+
+
+class QueryPatternRecorder:
+    def __init__(self):
+        self.shapes = Counter()
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() == "SELECT":
+            self.shapes[context["connection"].alias, query_shape(sql)] += 1
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        """Return (shape, count) of the shapes run at least threshold times."""
+        return [
+            (shape, count)
+            for (_, shape), count in self.shapes.most_common()
+            if count >= threshold
+        ]
+
+
+@contextmanager
+def record_query_patterns():
+    """Record the shapes of the SELECT queries run on every database."""
+    recorder = QueryPatternRecorder()
+    with wrap_queries(recorder.execute_wrapper):
+        yield recorder
+
+
+@asynccontextmanager
+async def arecord_query_patterns():
+    """record_query_patterns for async code."""
+    recorder = QueryPatternRecorder()
+    async with awrap_queries(recorder.execute_wrapper):
+        yield recorder
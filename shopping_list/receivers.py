@@ -1,11 +1,208 @@
-from django.db.models.signals import post_save
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
 
-from shopping_list.models import ShoppingItem, ShoppingList
+from shopping_list.cache import invalidate, invalidate_shopping_lists
+from shopping_list.events import publish_shopping_list_event
+from shopping_list.interactions import record_interaction
+from shopping_list.models import Grant, ShoppingItem, ShoppingList, Tombstone, User
+from shopping_list.sharding import (
+    copy_users_to_shards,
+    delete_users_from_shards,
+    scatter,
+)
+from shopping_list.users import get_user_cache
+
+_pending_tombstones = ContextVar("pending_tombstones", default=None)
+
+
+def bury_shopping_lists(memberships):
+    """Record that members lost access to shopping lists.
+
+    `memberships` holds (shopping_list_id, user_id) pairs.
+    """
+    Tombstone.objects.bulk_create(
+        Tombstone(
+            kind=Tombstone.SHOPPING_LIST,
+            object_id=shopping_list_id,
+            shopping_list_id=shopping_list_id,
+            user_id=user_id,
+        )
+        for shopping_list_id, user_id in memberships
+    )
+
+
+def grant_shopping_lists(memberships):
+    """Record that members gained access to shopping lists.
+
+    `memberships` holds (shopping_list_id, user_id) pairs.
+    """
+    Grant.objects.bulk_create(
+        Grant(shopping_list_id=shopping_list_id, user_id=user_id)
+        for shopping_list_id, user_id in memberships
+    )
+
+
+@contextmanager
+def bury_in_bulk(using=None):
+    """Write the tombstones of the items deleted in the block at once.
+
+    The deletions and the tombstones share a transaction on `using`.
+    """
+    if _pending_tombstones.get() is not None:
+        yield
+        return
+
+    tombstones = []
+    token = _pending_tombstones.set(tombstones)
+    try:
+        with transaction.atomic(using=using):
+            yield
+            Tombstone.objects.bulk_create(tombstones)
+    finally:
+        _pending_tombstones.reset(token)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, using, **kwargs):
+    user_id = instance.pk
+    get_user_cache().invalidate(user_id)
+    # Again once committed, as another process may have reloaded the old row.
+    transaction.on_commit(lambda: get_user_cache().invalidate(user_id), using=using)
+
+
+def invalidate_member_shopping_lists(user_id):
+    """Invalidate the cached responses of every list the user is a member of."""
+    shopping_list_ids = set()
+    for memberships in scatter(
+        ShoppingList.members.through.objects.filter(user_id=user_id)
+    ):
+        shopping_list_ids.update(memberships.values_list("shoppinglist_id", flat=True))
+    invalidate_shopping_lists(shopping_list_ids)
+
+
+@receiver(post_save, sender=User)
+def forget_cached_members(sender, instance, created, update_fields, using, **kwargs):
+    # Lists are cached with the usernames of their members. Saves of other
+    # fields only, such as last_login when logging in, leave them alone.
+    if created or (update_fields is not None and "username" not in update_fields):
+        return
+
+    transaction.on_commit(
+        partial(invalidate_member_shopping_lists, instance.pk), using=using
+    )
+
+
+@receiver(post_save, sender=User)
+def copy_user_to_shards(sender, instance, **kwargs):
+    copy_users_to_shards([instance])
+
+
+@receiver(post_delete, sender=User)
+def delete_user_from_shards(sender, instance, **kwargs):
+    delete_users_from_shards([instance])
 
 
 @receiver(post_save, sender=ShoppingItem)
+@receiver(post_delete, sender=ShoppingItem)
 def interaction_with_shopping_list(sender, instance, **kwargs):
-    ShoppingList.objects.get(id=instance.shopping_list.id).save(
-        update_fields=["last_interaction"]
+    record_interaction(instance.shopping_list_id)
+
+
+@receiver(post_save, sender=ShoppingItem)
+def publish_shopping_item_saved(sender, instance, created, **kwargs):
+    publish_shopping_list_event(
+        instance.shopping_list_id,
+        "item.created" if created else "item.updated",
+        {
+            "id": str(instance.id),
+            "name": instance.name,
+            "purchased": instance.purchased,
+        },
+    )
+
+
+@receiver(post_delete, sender=ShoppingItem)
+def publish_shopping_item_deleted(sender, instance, **kwargs):
+    publish_shopping_list_event(
+        instance.shopping_list_id, "item.deleted", {"id": str(instance.id)}
+    )
+
+
+@receiver(post_delete, sender=ShoppingItem)
+def bury_shopping_item(sender, instance, origin=None, **kwargs):
+    # Clients drop the items of a deleted list together with the list.
+    deleted_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if deleted_model is ShoppingList:
+        return
+
+    tombstone = Tombstone(
+        kind=Tombstone.SHOPPING_ITEM,
+        object_id=instance.id,
+        shopping_list_id=instance.shopping_list_id,
     )
+    pending = _pending_tombstones.get()
+    if pending is None:
+        tombstone.save(force_insert=True)
+    else:
+        pending.append(tombstone)
+
+
+@receiver(post_save, sender=ShoppingList)
+def shopping_list_changed(sender, instance, **kwargs):
+    invalidate_shopping_lists([instance.id])
+
+
+@receiver(pre_delete, sender=ShoppingList)
+def shopping_list_deleted(sender, instance, **kwargs):
+    # Members are gone once the list is deleted, so reach them beforehand.
+    invalidate_shopping_lists([instance.id])
+    bury_shopping_lists(
+        (instance.id, user_id)
+        for user_id in instance.members.values_list("id", flat=True)
+    )
+
+
+@receiver(m2m_changed, sender=ShoppingList.members.through)
+def shopping_list_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear":
+        # Cleared members or lists are only known before they are removed.
+        if reverse:
+            shopping_list_ids = list(
+                instance.shoppinglist_set.values_list("id", flat=True)
+            )
+            invalidate_shopping_lists(shopping_list_ids)
+            bury_shopping_lists(
+                (shopping_list_id, instance.id)
+                for shopping_list_id in shopping_list_ids
+            )
+        else:
+            invalidate_shopping_lists([instance.id])
+            bury_shopping_lists(
+                (instance.id, user_id)
+                for user_id in instance.members.values_list("id", flat=True)
+            )
+    if action == "post_add":
+        grant_shopping_lists(
+            (pk, instance.id) if reverse else (instance.id, pk) for pk in pk_set
+        )
+    if action == "post_remove":
+        bury_shopping_lists(
+            (pk, instance.id) if reverse else (instance.id, pk) for pk in pk_set
+        )
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+
+    if not reverse:
+        record_interaction(instance.id)
+        invalidate(user_ids=pk_set or ())
+    else:
+        invalidate(user_ids=[instance.id])
+        for shopping_list_id in pk_set or ():
+            record_interaction(shopping_list_id)
@@ -0,0 +1,140 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+from shopping_list.sharding import get_shards, is_sharded, shard_of
+
+_replica_reads = ContextVar("replica_reads", default=False)
+_writes = ContextVar("primary_writes", default=None)
+
+
+def _pin_key(user_id):
+    return f"primary-pin:{user_id}"
+
+
+def get_pin_cache():
+    """Return the SHOPPING_LIST_REPLICA_PIN_CACHE that pins are kept in.
+
+    Every worker must see the pins set by the others, or a user whose write
+    went through one worker reads a stale replica through the next. A
+    per-process LocMemCache is only accepted when
+    SHOPPING_LIST_CACHE_SINGLE_PROCESS says there are no other workers.
+    """
+    alias = getattr(settings, "SHOPPING_LIST_REPLICA_PIN_CACHE", "default")
+    cache = caches[alias]
+    if isinstance(cache, LocMemCache) and not getattr(
+        settings, "SHOPPING_LIST_CACHE_SINGLE_PROCESS", False
+    ):
+        raise ImproperlyConfigured(
+            "SHOPPING_LIST_REPLICA_PIN_CACHE must name a cache shared by all "
+            f"worker processes, but {alias!r} is a LocMemCache."
+        )
+
+    return cache
+
+
+def pin_to_primary(user_id):
+    """Read everything of the user from the primary for a while.
+
+    Replicas may not have caught up with what the user just wrote yet.
+    """
+    get_pin_cache().set(
+        _pin_key(user_id), True, getattr(settings, "SHOPPING_LIST_REPLICA_PIN", 5)
+    )
+
+
+def is_pinned_to_primary(user_id):
+    return get_pin_cache().get(_pin_key(user_id), False)
+
+
+def reading_from_replicas():
+    return bool(
+        _replica_reads.get() and getattr(settings, "SHOPPING_LIST_REPLICAS", [])
+    )
+
+
+@contextmanager
+def replica_reads():
+    """Send the reads of the block to a replica, if there are any."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def track_writes():
+    """Yield a list that gets an entry for every write in the block."""
+    writes = []
+    token = _writes.set(writes)
+    try:
+        yield writes
+    finally:
+        _writes.reset(token)
+
+
+def _record_write(model):
+    writes = _writes.get()
+    if writes is not None:
+        writes.append(model)
+
+
+class ShardRouter:
+    """Send queries about a shopping list to its shard in SHOPPING_LIST_SHARDS.
+
+    Queries hinted with a list, item, membership or tombstone, such as saves
+    and related managers, follow it; everything else is left to the next
+    router, so code looking rows up by id picks the shard with `on_shard`.
+    """
+
+    def _db_for_hints(self, hints):
+        instance = hints.get("instance")
+        if instance is None or not is_sharded():
+            return None
+        return shard_of(instance)
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_hints(hints)
+
+    def db_for_write(self, model, **hints):
+        shard = self._db_for_hints(hints)
+        if shard is not None:
+            _record_write(model)
+        return shard
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users are copied to every shard.
+        shards = get_shards()
+        if is_sharded() and obj1._state.db in shards and obj2._state.db in shards:
+            return True
+        return None
+
+
+class ReplicaRouter:
+    """Write to the primary, and read from SHOPPING_LIST_REPLICAS when allowed.
+
+    Only code running inside `replica_reads()` reads from a replica; all
+    other reads stay on the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, "SHOPPING_LIST_REPLICAS", [])
+        if replicas and _replica_reads.get():
+            return random.choice(replicas)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _record_write(model)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, "SHOPPING_LIST_REPLICAS", [])}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
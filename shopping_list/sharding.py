@@ -0,0 +1,286 @@
+"""Horizontal partitioning of shopping lists over SHOPPING_LIST_SHARDS.
+
+Every shopping list lives on the shard picked by its id, together with its
+items, memberships, tombstones and grants, so anything about one list is read and
+written on a single database. User rows are copied to every shard so that
+memberships can refer to them. Queries over all lists of a user run on every
+shard and their rows are merged in order.
+
+With a single shard nothing is routed explicitly and the database routers
+decide as before.
+"""
+
+import copy
+import heapq
+import uuid
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from itertools import islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, models, transaction
+
+# The field holding the shopping list id of every sharded model.
+SHARD_KEYS = {
+    "shopping_list.shoppinglist": "id",
+    "shopping_list.shoppinglist_members": "shoppinglist_id",
+    "shopping_list.shoppingitem": "shopping_list_id",
+    "shopping_list.tombstone": "shopping_list_id",
+    "shopping_list.grant": "shopping_list_id",
+}
+
+
+def get_shards():
+    return getattr(settings, "SHOPPING_LIST_SHARDS", None) or [DEFAULT_DB_ALIAS]
+
+
+def is_sharded():
+    return len(get_shards()) > 1
+
+
+def shard_for(shopping_list_id):
+    """Return the database alias of the shard owning the shopping list."""
+    shards = get_shards()
+    if len(shards) == 1:
+        return shards[0]
+    if not isinstance(shopping_list_id, uuid.UUID):
+        shopping_list_id = uuid.UUID(str(shopping_list_id))
+
+    return shards[shopping_list_id.int % len(shards)]
+
+
+def shard_of(instance):
+    """Return the shard of a sharded model instance, or None."""
+    field = SHARD_KEYS.get(instance._meta.label_lower)
+    if field is None or getattr(instance, field) is None:
+        return None
+
+    return shard_for(getattr(instance, field))
+
+
+def on_shard(queryset, shopping_list_id):
+    """Run a query about a single shopping list on its shard."""
+    if not is_sharded():
+        return queryset
+
+    return queryset.using(shard_for(shopping_list_id))
+
+
+def group_by_shard(shopping_list_ids):
+    """Return {shard: shopping list ids}, with a None shard if not sharded.
+
+    `queryset.using(None)` leaves the choice to the routers.
+    """
+    if not is_sharded():
+        return {None: list(shopping_list_ids)}
+
+    groups = defaultdict(list)
+    for shopping_list_id in shopping_list_ids:
+        groups[shard_for(shopping_list_id)].append(shopping_list_id)
+
+    return groups
+
+
+def scatter(queryset):
+    """Return the queryset once for every shard."""
+    if not is_sharded():
+        return [queryset]
+
+    return [queryset.using(shard) for shard in get_shards()]
+
+
+def scatter_gather(queryset, *ordering):
+    """Run the queryset on every shard, merging the rows by `ordering`."""
+    if not is_sharded():
+        return queryset.order_by(*ordering)
+
+    return ScatterGather(scatter(queryset)).order_by(*ordering)
+
+
+def bulk_create_on_shards(queryset, objs, **kwargs):
+    """bulk_create the objects on the shards of their shopping lists."""
+    if not is_sharded():
+        return queryset.bulk_create(objs, **kwargs)
+
+    objs = list(objs)
+    groups = defaultdict(list)
+    for obj in objs:
+        groups[shard_of(obj)].append(obj)
+    for shard, group in groups.items():
+        queryset.using(shard).bulk_create(group, **kwargs)
+
+    return objs
+
+
+@contextmanager
+def atomic_on_shards():
+    """Run the block in a transaction on every shard.
+
+    The transactions commit one after the other, so a failure while
+    committing can still leave some shards written.
+    """
+    with ExitStack() as stack:
+        for shard in get_shards():
+            stack.enter_context(transaction.atomic(using=shard))
+        yield
+
+
+def _other_shards(users):
+    # Users are saved on the default database; rows elsewhere are copies.
+    users = [user for user in users if user._state.db == DEFAULT_DB_ALIAS]
+    if not is_sharded() or not users:
+        return None, []
+
+    return users, [shard for shard in get_shards() if shard != DEFAULT_DB_ALIAS]
+
+
+def copy_users_to_shards(users):
+    """Insert or update the rows of the users on every other shard."""
+    users, shards = _other_shards(users)
+    if not shards:
+        return
+
+    model = type(users[0])
+    update_fields = [
+        field.name for field in model._meta.concrete_fields if not field.primary_key
+    ]
+    for shard in shards:
+        model.objects.using(shard).bulk_create(
+            [copy.copy(user) for user in users],
+            update_conflicts=True,
+            unique_fields=[model._meta.pk.name],
+            update_fields=update_fields,
+        )
+
+
+def delete_users_from_shards(users):
+    users, shards = _other_shards(users)
+    for shard in shards:
+        type(users[0]).objects.using(shard).filter(
+            pk__in=[user.pk for user in users]
+        ).delete()
+
+
+class ShardQuerySet(models.QuerySet):
+    """QuerySet of a sharded model that creates rows on their shard."""
+
+    def create(self, **kwargs):
+        if self._db is not None or not is_sharded():
+            return super().create(**kwargs)
+
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True, using=shard_of(obj))
+        return obj
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if self._db is not None or not is_sharded() or args:
+            return super().bulk_create(objs, *args, **kwargs)
+
+        return bulk_create_on_shards(self, objs, **kwargs)
+
+
+class ScatterGather:
+    """The same query run on every shard, with the rows merged in order.
+
+    It supports what the list endpoints and their paginators use: filter,
+    order_by, values, count and slicing. A slice [start:stop] reads at most
+    `stop` rows from every shard. The ordering must be all ascending or all
+    descending.
+    """
+
+    def __init__(self, querysets, ordering=(), low=0, high=None):
+        self.querysets = querysets
+        self.ordering = tuple(ordering)
+        self.model = querysets[0].model
+        self.low = low
+        self.high = high
+        self._result_cache = None
+
+    def _clone(self, querysets=None, ordering=None):
+        return ScatterGather(
+            self.querysets if querysets is None else querysets,
+            self.ordering if ordering is None else ordering,
+            self.low,
+            self.high,
+        )
+
+    def filter(self, *args, **kwargs):
+        return self._clone([qs.filter(*args, **kwargs) for qs in self.querysets])
+
+    def order_by(self, *ordering):
+        descending = {name.startswith("-") for name in ordering}
+        if len(descending) > 1:
+            raise ValueError("Cannot merge rows with mixed ordering directions.")
+
+        return self._clone([qs.order_by(*ordering) for qs in self.querysets], ordering)
+
+    def values(self, *fields):
+        # The ordering fields are needed to merge the rows.
+        if fields:
+            fields += tuple(
+                name.lstrip("-")
+                for name in self.ordering
+                if name.lstrip("-") not in fields
+            )
+
+        return self._clone([qs.values(*fields) for qs in self.querysets])
+
+    def count(self):
+        return sum(qs.count() for qs in self.querysets)
+
+    async def acount(self):
+        return sum([await qs.acount() for qs in self.querysets])
+
+    def _sort_key(self, row):
+        if isinstance(row, dict):
+            return tuple(row[name.lstrip("-")] for name in self.ordering)
+        return tuple(getattr(row, name.lstrip("-")) for name in self.ordering)
+
+    def _merge(self, shard_rows):
+        reverse = bool(self.ordering) and self.ordering[0].startswith("-")
+        rows = heapq.merge(*shard_rows, key=self._sort_key, reverse=reverse)
+        return list(islice(rows, self.low, self.high))
+
+    def _shard_querysets(self):
+        if self.high is None:
+            return self.querysets
+        return [qs[: self.high] for qs in self.querysets]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            rows = list(self[index : index + 1])
+            if not rows:
+                raise IndexError(index)
+            return rows[0]
+        if (index.start or 0) < 0 or (index.stop or 0) < 0 or index.step:
+            raise ValueError("Only non-negative slices without step are supported.")
+
+        clone = self._clone()
+        clone.low = self.low + (index.start or 0)
+        if index.stop is not None:
+            stop = self.low + index.stop
+            clone.high = stop if self.high is None else min(stop, self.high)
+        return clone
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            self._result_cache = self._merge(self._shard_querysets())
+
+    def __iter__(self):
+        self._fetch_all()
+        return iter(self._result_cache)
+
+    def __aiter__(self):
+        async def rows():
+            if self._result_cache is None:
+                self._result_cache = self._merge(
+                    [[row async for row in qs] for qs in self._shard_querysets()]
+                )
+            for row in self._result_cache:
+                yield row
+
+        return rows()
+
+    def __len__(self):
+        self._fetch_all()
+        return len(self._result_cache)
@@ -1,6 +1,81 @@
+from contextlib import contextmanager
+
 import pytest
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
+from shopping_list.cache import get_cache
 from shopping_list.models import ShoppingItem, ShoppingList, User
+from shopping_list.users import get_user_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    get_cache().clear()
+    get_user_cache().clear()
+
+
+@pytest.fixture(autouse=True)
+def raise_on_nplusone(settings):
+    settings.SHOPPING_LIST_NPLUSONE = "raise"
+
+
+@contextmanager
+def request_query_budget(max_queries):
+    """Fail when a request handled inside the block runs more than max_queries."""
+    over_budget = []
+    started = []
+
+    def on_started(environ, **kwargs):
+        started.append((environ["PATH_INFO"], len(connection.queries_log)))
+
+    def on_finished(**kwargs):
+        path, start = started.pop()
+        count = len(connection.queries_log) - start
+        if count > max_queries:
+            over_budget.append(f"{path} ran {count} queries")
+
+    with CaptureQueriesContext(connection) as queries:
+        request_started.connect(on_started)
+        request_finished.connect(on_finished)
+        try:
+            yield
+        finally:
+            request_started.disconnect(on_started)
+            request_finished.disconnect(on_finished)
+
+    if over_budget:
+        pytest.fail(
+            f"Query budget of {max_queries} exceeded: {'; '.join(over_budget)}\n"
+            + "\n".join(query["sql"] for query in queries),
+            pytrace=False,
+        )
+
+
+@pytest.fixture
+def query_budget():
+    """Budget the queries of each request: `with query_budget(5): client.get(...)`."""
+    return request_query_budget
+
+
+@pytest.fixture(autouse=True)
+def query_budget_marker(request):
+    """Apply `@pytest.mark.query_budget(n)` to every request of the test."""
+    marker = request.node.get_closest_marker("query_budget")
+    if marker is None:
+        yield
+        return
+
+    request.getfixturevalue("db")
+    with request_query_budget(*marker.args, **marker.kwargs):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def metrics_dir(settings, tmp_path):
+    settings.SHOPPING_LIST_METRICS_DIR = tmp_path / "metrics"
+    return settings.SHOPPING_LIST_METRICS_DIR
 
 
 @pytest.fixture(scope="session")
@@ -1,11 +1,60 @@
+import json
+import logging
+import subprocess
+import time
+import uuid
 from datetime import datetime, timedelta
+from decimal import Decimal
+from io import StringIO
 from unittest import mock
 
 import pytest
+from asgiref.sync import async_to_sync
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count
+from django.http import HttpResponse
+from django.test import AsyncClient
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
 from django.utils.timezone import make_aware
 from rest_framework import status
-from shopping_list.models import ShoppingItem, ShoppingList, User
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.test import APIClient
+from shopping_list.api.authentication import issue_token
+from shopping_list.api.importer import ShoppingListImporter, parse_ndjson
+from shopping_list.api.renderers import FastJSONRenderer
+from shopping_list.api.serializers import (
+    ShoppingItemValuesSerializer,
+    ShoppingListSerializer,
+    ShoppingListValuesSerializer,
+)
+from shopping_list.api.views import ListAddShoppingList
+from shopping_list.cache import cache_stats, get_cache, shopping_list_version
+from shopping_list.events import (
+    EventsLost,
+    FileBroker,
+    InProcessBroker,
+    get_broker,
+    shopping_list_channel,
+)
+from shopping_list.interactions import coalesce_interactions, touch_shopping_lists
+from shopping_list.metrics import MetricsStore
+from shopping_list.middleware import (
+    CoalesceInteractionsMiddleware,
+    PinWritersToPrimaryMiddleware,
+)
+from shopping_list.models import ShoppingItem, ShoppingList, Tombstone, User
+from shopping_list.nplusone import NPlusOneError, QueryPatternRecorder, query_shape
+from shopping_list.routers import is_pinned_to_primary, pin_to_primary
+from shopping_list.timing import get_timer, time_request
+from shopping_list.users import UserCache, get_user_cache
 
 
 @pytest.mark.django_db
@@ -741,3 +790,2423 @@ def test_shopping_item_delete_restricted_if_not_member_of_shopping_list(
     response = client.delete(url)
 
     assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_shopping_lists_query_count_does_not_depend_on_number_of_lists(
+    create_user, create_authenticated_client, django_assert_num_queries
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    url = reverse("all-shopping-lists")
+
+    def create_shopping_list_with_items(name):
+        shopping_list = ShoppingList.objects.create(name=name)
+        shopping_list.members.add(user)
+        for item_name in ["Eggs", "Milk", "Bread", "Butter"]:
+            ShoppingItem.objects.create(
+                shopping_list=shopping_list, name=item_name, purchased=False
+            )
+
+    create_shopping_list_with_items("Groceries")
+    # session, user, version, count, shopping lists, unpurchased items, members
+    with django_assert_num_queries(7):
+        client.get(url)
+
+    create_shopping_list_with_items("Hardware")
+    create_shopping_list_with_items("Pharmacy")
+    with django_assert_num_queries(7):
+        response = client.get(url)
+
+    assert len(response.data["results"]) == 3
+    for shopping_list in response.data["results"]:
+        assert len(shopping_list["unpurchased_items"]) == 3
+        assert shopping_list["members"] == [{"id": user.id, "username": "DummyUser"}]
+
+
+@pytest.mark.django_db
+def test_shopping_list_detail_query_count_does_not_depend_on_number_of_members(
+    create_user, create_authenticated_client, django_assert_num_queries
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = ShoppingList.objects.create(name="Groceries")
+    shopping_list.members.add(user)
+    for index in range(5):
+        shopping_list.members.add(
+            User.objects.create_user(f"Member{index}", f"member{index}@list.com", "pw")
+        )
+    url = reverse("shopping-list-detail", args=[shopping_list.id])
+
+    # session, user, membership, version, shopping list, unpurchased items,
+    # members
+    with django_assert_num_queries(7):
+        response = client.get(url)
+
+    assert len(response.data["members"]) == 6
+
+
+@pytest.mark.django_db
+def test_shopping_item_membership_checked_with_single_query(
+    create_user,
+    create_authenticated_client,
+    create_shopping_item,
+    django_assert_num_queries,
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_item = create_shopping_item(name="Chocolate", user=user)
+    for index in range(5):
+        shopping_item.shopping_list.members.add(
+            User.objects.create_user(f"Member{index}", f"member{index}@list.com", "pw")
+        )
+
+    url = reverse(
+        "shopping-item-detail",
+        kwargs={"pk": shopping_item.shopping_list.id, "item_pk": shopping_item.id},
+    )
+
+    # session, user, shopping item, membership
+    with django_assert_num_queries(4):
+        response = client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_shopping_items_of_missing_shopping_list_not_found(
+    create_user, create_authenticated_client
+):
+    client = create_authenticated_client(create_user())
+    url = reverse(
+        "list-add-shopping-item", kwargs={"pk": "5c0a5a3e-0e86-4e43-8f5c-6c9b6e4c7a10"}
+    )
+
+    response = client.get(url)
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_shopping_list_looked_up_once_when_adding_shopping_item(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+
+    url = reverse("list-add-shopping-item", args=[shopping_list.id])
+
+    data = {"name": "Milk", "purchased": False}
+
+    with CaptureQueriesContext(connection) as context:
+        response = client.post(url, data, format="json")
+
+    assert response.status_code == status.HTTP_201_CREATED
+    queries = [query["sql"] for query in context.captured_queries]
+    insert_index = next(
+        index
+        for index, sql in enumerate(queries)
+        if sql.startswith('INSERT INTO "shopping_list_shoppingitem"')
+    )
+    shopping_list_lookups = [
+        sql
+        for sql in queries[:insert_index]
+        if sql.startswith("SELECT") and 'FROM "shopping_list_shoppinglist"' in sql
+    ]
+    assert len(shopping_list_lookups) == 1
+
+
+@pytest.mark.django_db
+def test_shopping_item_save_touches_shopping_list_with_single_update(
+    create_user,
+    create_shopping_list,
+    django_assert_num_queries,
+    django_capture_on_commit_callbacks,
+):
+    shopping_list = create_shopping_list(create_user())
+
+    # insert, last_interaction update, and on commit the members to
+    # invalidate cached responses of
+    with django_assert_num_queries(3):
+        with django_capture_on_commit_callbacks(execute=True):
+            ShoppingItem.objects.create(
+                shopping_list=shopping_list, name="Milk", purchased=False
+            )
+
+
+@pytest.mark.django_db
+def test_shopping_list_interactions_are_coalesced(create_user, create_shopping_list):
+    shopping_list = create_shopping_list(create_user())
+    last_interaction = shopping_list.last_interaction
+
+    with CaptureQueriesContext(connection) as context:
+        with coalesce_interactions():
+            for name in ["Eggs", "Milk", "Bread"]:
+                ShoppingItem.objects.create(
+                    shopping_list=shopping_list, name=name, purchased=False
+                )
+
+    updates = [
+        query
+        for query in context.captured_queries
+        if query["sql"].startswith('UPDATE "shopping_list_shoppinglist"')
+    ]
+    assert len(updates) == 1
+    shopping_list.refresh_from_db()
+    assert shopping_list.last_interaction > last_interaction
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("status_code, touched", [(200, True), (500, False)])
+def test_failed_requests_do_not_touch_shopping_lists(
+    create_user, create_shopping_list, rf, status_code, touched
+):
+    shopping_list = create_shopping_list(create_user())
+    shopping_list.refresh_from_db()
+    last_interaction = shopping_list.last_interaction
+
+    def view(request):
+        ShoppingItem.objects.create(
+            shopping_list=shopping_list, name="Milk", purchased=False
+        )
+        return HttpResponse(status=status_code)
+
+    CoalesceInteractionsMiddleware(view)(rf.post("/"))
+    with pytest.raises(ValueError):
+        with coalesce_interactions():
+            ShoppingItem.objects.create(
+                shopping_list=shopping_list, name="Eggs", purchased=False
+            )
+            raise ValueError
+
+    shopping_list.refresh_from_db()
+    assert (shopping_list.last_interaction > last_interaction) == touched
+
+
+@pytest.mark.django_db
+def test_recently_touched_shopping_list_is_not_rewritten(
+    create_user, create_shopping_list, settings
+):
+    settings.SHOPPING_LIST_INTERACTION_THRESHOLD = 60
+    shopping_list = create_shopping_list(create_user())
+    last_interaction = shopping_list.last_interaction
+
+    ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Milk", purchased=False
+    )
+
+    shopping_list.refresh_from_db()
+    assert shopping_list.last_interaction == last_interaction
+
+
+@pytest.mark.django_db
+def test_shopping_items_are_created_in_bulk(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Milk", purchased=False
+    )
+
+    url = reverse("list-add-shopping-item", args=[shopping_list.id])
+
+    data = [
+        {"name": "Eggs", "purchased": False},
+        {"name": "Milk", "purchased": False},
+        {"name": "Flour"},
+        {"name": "Eggs", "purchased": False},
+        {"name": "Sugar", "purchased": True},
+    ]
+
+    response = client.post(url, data, format="json")
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert [result["status"] for result in response.data["results"]] == [
+        "created",
+        "duplicate",
+        "invalid",
+        "duplicate",
+        "created",
+    ]
+    assert response.data["results"][0]["item"]["name"] == "Eggs"
+    assert sorted(shopping_list.shopping_items.values_list("name", flat=True)) == [
+        "Eggs",
+        "Milk",
+        "Sugar",
+    ]
+
+
+@pytest.mark.django_db
+def test_bulk_shopping_item_creation_query_count_does_not_depend_on_size(
+    create_user, create_authenticated_client
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+
+    def count_queries(number_of_items):
+        shopping_list = ShoppingList.objects.create(name="Recipe")
+        shopping_list.members.add(user)
+        url = reverse("list-add-shopping-item", args=[shopping_list.id])
+        data = [
+            {"name": f"Ingredient {index}", "purchased": False}
+            for index in range(number_of_items)
+        ]
+
+        with CaptureQueriesContext(connection) as context:
+            response = client.post(url, data, format="json")
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert shopping_list.shopping_items.count() == number_of_items
+        return len(context.captured_queries)
+
+    assert count_queries(40) == count_queries(1)
+
+
+@pytest.mark.django_db
+def test_bulk_shopping_item_creation_with_only_duplicates_returns_bad_request(
+    create_user, create_authenticated_client, create_shopping_item
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_item = create_shopping_item("Milk", user)
+
+    url = reverse("list-add-shopping-item", args=[shopping_item.shopping_list.id])
+
+    response = client.post(url, [{"name": "Milk", "purchased": False}], format="json")
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data["results"][0]["status"] == "duplicate"
+
+
+@pytest.mark.django_db
+def test_shopping_items_are_marked_purchased_in_bulk(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    eggs = ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Eggs", purchased=False
+    )
+    milk = ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Milk", purchased=False
+    )
+    ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Bread", purchased=False
+    )
+
+    url = reverse("bulk-shopping-items", args=[shopping_list.id])
+
+    data = {"action": "purchase", "ids": [str(eggs.id), str(milk.id)]}
+
+    response = client.post(url, data, format="json")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["affected"] == 2
+    assert sorted(
+        shopping_list.shopping_items.filter(purchased=True).values_list(
+            "name", flat=True
+        )
+    ) == ["Eggs", "Milk"]
+
+
+@pytest.mark.django_db
+def test_purchased_shopping_items_are_cleared_in_bulk(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Eggs", purchased=True
+    )
+    ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Milk", purchased=True
+    )
+    ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Bread", purchased=False
+    )
+
+    url = reverse("bulk-shopping-items", args=[shopping_list.id])
+
+    response = client.post(url, {"action": "clear_purchased"}, format="json")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["affected"] == 2
+    assert list(shopping_list.shopping_items.values_list("name", flat=True)) == [
+        "Bread"
+    ]
+
+
+@pytest.mark.django_db
+def test_bulk_delete_only_affects_items_of_the_shopping_list(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    eggs = ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Eggs", purchased=False
+    )
+    another_shopping_list = create_shopping_list(user)
+    milk = ShoppingItem.objects.create(
+        shopping_list=another_shopping_list, name="Milk", purchased=False
+    )
+
+    url = reverse("bulk-shopping-items", args=[shopping_list.id])
+
+    data = {"action": "delete", "ids": [str(eggs.id), str(milk.id)]}
+
+    response = client.post(url, data, format="json")
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["affected"] == 1
+    assert list(ShoppingItem.objects.values_list("name", flat=True)) == ["Milk"]
+
+
+@pytest.mark.django_db
+def test_bulk_action_without_ids_returns_bad_request(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+
+    url = reverse("bulk-shopping-items", args=[shopping_list.id])
+
+    response = client.post(url, {"action": "purchase"}, format="json")
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_not_member_of_list_can_not_run_bulk_actions(
+    create_user, create_authenticated_client, create_shopping_item
+):
+    shopping_list_creator = User.objects.create_user(
+        "Creator", "creator@list.com", "something"
+    )
+    shopping_item = create_shopping_item("Milk", shopping_list_creator)
+    client = create_authenticated_client(create_user())
+
+    url = reverse("bulk-shopping-items", args=[shopping_item.shopping_list.id])
+
+    data = {"action": "delete", "ids": [str(shopping_item.id)]}
+
+    response = client.post(url, data, format="json")
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    assert ShoppingItem.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_shopping_lists_are_paginated_with_cursor_without_count(
+    create_user, create_authenticated_client
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+
+    with mock.patch("django.utils.timezone.now") as mock_now:
+        mock_now.return_value = make_aware(datetime.now())
+        for index in range(7):
+            ShoppingList.objects.create(name=f"List {index}").members.add(user)
+
+    names = []
+    url = reverse("all-shopping-lists") + "?cursor="
+    while url:
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        assert not any(
+            "COUNT(*)" in query["sql"] or "OFFSET" in query["sql"]
+            for query in context.captured_queries
+        )
+        assert len(response.data["results"]) <= 3
+        names.extend(
+            shopping_list["name"] for shopping_list in response.data["results"]
+        )
+        url = response.data["next"]
+
+    assert sorted(names) == [f"List {index}" for index in range(7)]
+
+
+@pytest.mark.django_db
+def test_shopping_items_cursor_pages_do_not_shift_when_items_are_added(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    for index in range(4):
+        ShoppingItem.objects.create(
+            shopping_list=shopping_list, name=f"Item {index}", purchased=False
+        )
+
+    url = reverse("list-add-shopping-item", args=[shopping_list.id])
+    first_page = client.get(url, {"cursor": "", "page_size": 2})
+
+    for index in range(4, 8):
+        ShoppingItem.objects.create(
+            shopping_list=shopping_list, name=f"Item {index}", purchased=True
+        )
+
+    first_names = [item["name"] for item in first_page.data["results"]]
+    names = []
+    url = first_page.data["next"]
+    while url:
+        response = client.get(url)
+        names.extend(item["name"] for item in response.data["results"])
+        url = response.data["next"]
+
+    assert len(first_names) == 2
+    assert sorted(names) == sorted(
+        {f"Item {index}" for index in range(8)} - set(first_names)
+    )
+
+
+@pytest.mark.django_db
+def test_invalid_cursor_returns_not_found(create_user, create_authenticated_client):
+    client = create_authenticated_client(create_user())
+    url = reverse("all-shopping-lists")
+
+    response = client.get(url, {"cursor": "not-a-cursor"})
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_duplicate_item_check_ignores_case(
+    create_user, create_authenticated_client, create_shopping_item
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_item = create_shopping_item("Milk", user)
+
+    url = reverse("list-add-shopping-item", args=[shopping_item.shopping_list.id])
+
+    response = client.post(url, {"name": "milk", "purchased": False}, format="json")
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data == ["Item already exists on the list."]
+
+
+@pytest.mark.django_db
+def test_bulk_duplicate_check_folds_case_like_the_database(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    single, bulk = create_shopping_list(user), create_shopping_list(user)
+    for shopping_list in [single, bulk]:
+        ShoppingItem.objects.create(
+            shopping_list=shopping_list, name="Äpfel", purchased=False
+        )
+    names = ["ÄPFEL", "äpfel"]
+
+    single_statuses = []
+    for name in names:
+        response = client.post(
+            reverse("list-add-shopping-item", args=[single.id]),
+            {"name": name, "purchased": False},
+            format="json",
+        )
+        single_statuses.append(
+            "created"
+            if response.status_code == status.HTTP_201_CREATED
+            else "duplicate"
+        )
+    response = client.post(
+        reverse("list-add-shopping-item", args=[bulk.id]),
+        [{"name": name, "purchased": False} for name in names],
+        format="json",
+    )
+
+    assert [result["status"] for result in response.data["results"]] == (
+        single_statuses
+    )
+    if connection.vendor == "sqlite":
+        # SQLite's LOWER() only folds ASCII letters.
+        assert single_statuses == ["duplicate", "created"]
+
+
+@pytest.mark.django_db
+def test_unpurchased_item_names_are_unique_in_database(
+    create_user, create_shopping_item
+):
+    shopping_item = create_shopping_item("Milk", create_user())
+    ShoppingItem.objects.create(
+        shopping_list=shopping_item.shopping_list, name="MILK", purchased=True
+    )
+
+    with pytest.raises(IntegrityError), transaction.atomic():
+        ShoppingItem.objects.create(
+            shopping_list=shopping_item.shopping_list, name="MILK", purchased=False
+        )
+
+
+@pytest.mark.django_db
+def test_unpurchase_shopping_item_already_on_list_returns_bad_request(
+    create_user, create_authenticated_client, create_shopping_item
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_item = create_shopping_item("Milk", user)
+    purchased_item = ShoppingItem.objects.create(
+        shopping_list=shopping_item.shopping_list, name="Milk", purchased=True
+    )
+
+    url = reverse(
+        "shopping-item-detail",
+        kwargs={"pk": shopping_item.shopping_list.id, "item_pk": purchased_item.id},
+    )
+
+    response = client.patch(url, {"purchased": False}, format="json")
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.data == ["Item already exists on the list."]
+    purchased_item.refresh_from_db()
+    assert purchased_item.purchased is True
+
+
+@pytest.mark.django_db
+def test_unchanged_shopping_list_returns_not_modified(
+    create_user,
+    create_authenticated_client,
+    create_shopping_item,
+    django_assert_num_queries,
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_item = create_shopping_item("Milk", user)
+
+    url = reverse("shopping-list-detail", args=[shopping_item.shopping_list.id])
+    response = client.get(url)
+    etag = response.headers["ETag"]
+
+    # session, user, membership, last interaction
+    with django_assert_num_queries(4):
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers["ETag"] == etag
+
+
+@pytest.mark.django_db
+def test_deleting_shopping_item_changes_shopping_list_etag(
+    create_user,
+    create_authenticated_client,
+    create_shopping_item,
+    django_capture_on_commit_callbacks,
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_item = create_shopping_item("Milk", user)
+
+    url = reverse("shopping-list-detail", args=[shopping_item.shopping_list.id])
+    etag = client.get(url).headers["ETag"]
+
+    with django_capture_on_commit_callbacks(execute=True):
+        shopping_item.delete()
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["unpurchased_items"] == []
+
+
+@pytest.mark.django_db
+def test_shopping_items_not_modified_until_item_added(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+
+    url = reverse("list-add-shopping-item", args=[shopping_list.id])
+    etag = client.get(url).headers["ETag"]
+
+    assert client.get(url, HTTP_IF_NONE_MATCH=etag).status_code == 304
+
+    client.post(url, {"name": "Milk", "purchased": False}, format="json")
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.data["results"]) == 1
+
+
+@pytest.mark.django_db
+def test_shopping_list_not_modified_since_last_interaction(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+
+    url = reverse("shopping-list-detail", args=[shopping_list.id])
+    last_modified = client.get(url).headers["Last-Modified"]
+
+    response = client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+@pytest.mark.django_db
+def test_shopping_lists_are_not_answered_by_modification_time(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    create_shopping_list(user)
+    newest = create_shopping_list(user)
+    url = reverse("all-shopping-lists")
+    response = client.get(url)
+    etag = response.headers["ETag"]
+
+    newest.members.remove(user)
+    not_modified_since = client.get(
+        url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60)
+    )
+    none_match = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    assert "Last-Modified" not in response
+    assert not_modified_since.status_code == status.HTTP_200_OK
+    assert not_modified_since.data["count"] == 1
+    assert none_match.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_not_member_does_not_get_not_modified(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    shopping_list_creator = User.objects.create_user(
+        "Creator", "creator@list.com", "something"
+    )
+    shopping_list = create_shopping_list(shopping_list_creator)
+    url = reverse("shopping-list-detail", args=[shopping_list.id])
+    etag = create_authenticated_client(shopping_list_creator).get(url).headers["ETag"]
+
+    client = create_authenticated_client(create_user())
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_shopping_list_detail_is_served_from_cache(
+    create_user,
+    create_authenticated_client,
+    create_shopping_item,
+    django_assert_num_queries,
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_item = create_shopping_item("Milk", user)
+
+    url = reverse("shopping-list-detail", args=[shopping_item.shopping_list.id])
+    assert client.get(url).headers["X-Cache"] == "MISS"
+
+    # session, user, membership, version
+    with django_assert_num_queries(4):
+        response = client.get(url)
+
+    assert response.headers["X-Cache"] == "HIT"
+    assert response.data["unpurchased_items"] == [{"name": "Milk"}]
+    assert cache_stats()["hits"] >= 1
+
+
+@pytest.mark.django_db
+def test_cached_shopping_list_detail_is_invalidated_by_item_changes(
+    create_user,
+    create_authenticated_client,
+    create_shopping_item,
+    django_capture_on_commit_callbacks,
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_item = create_shopping_item("Milk", user)
+    shopping_list = shopping_item.shopping_list
+    url = reverse("shopping-list-detail", args=[shopping_list.id])
+    client.get(url)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        ShoppingItem.objects.create(
+            shopping_list=shopping_list, name="Eggs", purchased=False
+        )
+    response = client.get(url)
+    assert response.headers["X-Cache"] == "MISS"
+    assert len(response.data["unpurchased_items"]) == 2
+
+    with django_capture_on_commit_callbacks(execute=True):
+        shopping_item.delete()
+    response = client.get(url)
+    assert response.data["unpurchased_items"] == [{"name": "Eggs"}]
+
+
+@pytest.mark.django_db
+def test_touched_shopping_lists_are_invalidated_once_committed(
+    create_user, create_shopping_list, django_capture_on_commit_callbacks
+):
+    shopping_list = create_shopping_list(create_user())
+    version = shopping_list_version(shopping_list.id)
+
+    with django_capture_on_commit_callbacks() as callbacks:
+        touch_shopping_lists([shopping_list.id])
+
+    assert shopping_list_version(shopping_list.id) == version
+    for callback in callbacks:
+        callback()
+    assert shopping_list_version(shopping_list.id) != version
+
+
+@pytest.mark.django_db
+def test_cached_shopping_lists_are_invalidated_by_username_changes(
+    create_user,
+    create_authenticated_client,
+    create_shopping_list,
+    django_capture_on_commit_callbacks,
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    url = reverse("shopping-list-detail", args=[shopping_list.id])
+    client.get(url)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        user.last_login = timezone.now()
+        user.save(update_fields=["last_login"])
+    assert client.get(url).headers["X-Cache"] == "HIT"
+
+    with django_capture_on_commit_callbacks(execute=True):
+        user.username = "Renamed"
+        user.save()
+    response = client.get(url)
+
+    assert response.headers["X-Cache"] == "MISS"
+    assert response.data["members"][0]["username"] == "Renamed"
+
+
+@pytest.mark.django_db
+def test_cached_shopping_lists_are_invalidated_by_membership_changes(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    another_user = User.objects.create_user(
+        "SomeoneElse", "someone@else.com", "something"
+    )
+    shopping_list = create_shopping_list(another_user)
+    url = reverse("all-shopping-lists")
+    assert client.get(url).data["results"] == []
+
+    shopping_list.members.add(user)
+    response = client.get(url)
+    assert len(response.data["results"]) == 1
+    assert len(response.data["results"][0]["members"]) == 2
+
+    shopping_list.members.remove(user)
+    assert client.get(url).data["results"] == []
+
+
+@pytest.mark.django_db
+def test_cached_shopping_lists_are_invalidated_when_list_is_deleted_or_renamed(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    url = reverse("all-shopping-lists")
+    client.get(url)
+
+    shopping_list.name = "Food"
+    shopping_list.save()
+    assert client.get(url).data["results"][0]["name"] == "Food"
+
+    shopping_list.delete()
+    assert client.get(url).data["results"] == []
+
+
+@pytest.mark.django_db
+def test_removed_member_is_not_served_cached_shopping_list(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    shopping_list.members.add(
+        User.objects.create_user("SomeoneElse", "someone@else.com", "something")
+    )
+    url = reverse("shopping-list-detail", args=[shopping_list.id])
+    client.get(url)
+
+    shopping_list.members.remove(user)
+
+    assert client.get(url).status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_shopping_list_responses_can_be_cached_in_files(
+    create_user, create_authenticated_client, create_shopping_list, settings, tmp_path
+):
+    settings.CACHES = {
+        **settings.CACHES,
+        "files": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": tmp_path,
+        },
+    }
+    settings.SHOPPING_LIST_CACHE = "files"
+    user = create_user()
+    client = create_authenticated_client(user)
+    create_shopping_list(user)
+    url = reverse("all-shopping-lists")
+
+    assert client.get(url).headers["X-Cache"] == "MISS"
+    response = client.get(url)
+
+    assert response.headers["X-Cache"] == "HIT"
+    assert response.data["results"][0]["name"] == "Groceries"
+
+
+@pytest.mark.django_db
+def test_shopping_list_responses_are_not_cached_per_process_with_several_workers(
+    create_user, create_authenticated_client, create_shopping_list, settings
+):
+    settings.SHOPPING_LIST_CACHE_SINGLE_PROCESS = False
+    user = create_user()
+    client = create_authenticated_client(user)
+    create_shopping_list(user)
+    url = reverse("all-shopping-lists")
+
+    client.get(url)
+    response = client.get(url)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert "X-Cache" not in response.headers
+
+
+@pytest.mark.django_db
+def test_shopping_list_rows_are_represented_like_shopping_list_serializer(
+    create_user, create_shopping_list
+):
+    user = create_user()
+    shopping_list = create_shopping_list(user)
+    shopping_list.members.add(
+        User.objects.create_user("SomeoneElse", "someone@else.com", "something")
+    )
+    for name in ["Eggs", "Milk", "Bread", "Butter"]:
+        ShoppingItem.objects.create(
+            shopping_list=shopping_list, name=name, purchased=False
+        )
+    ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Chocolate", purchased=True
+    )
+
+    rows = ShoppingListValuesSerializer.get_rows(ShoppingList.objects.all())
+    representation = ShoppingListValuesSerializer.to_representation(rows)[0]
+    expected = ShoppingListSerializer(shopping_list).data
+
+    assert representation["id"] == shopping_list.id
+    assert representation["name"] == expected["name"]
+    assert len(representation["unpurchased_items"]) == 3
+    assert sorted(representation["members"], key=lambda member: member["id"]) == (
+        sorted(expected["members"], key=lambda member: member["id"])
+    )
+
+
+@pytest.mark.django_db
+def test_shopping_items_are_rendered_as_json(
+    create_user, create_authenticated_client, create_shopping_item
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_item = create_shopping_item("Milk", user)
+
+    url = reverse("list-add-shopping-item", args=[shopping_item.shopping_list.id])
+    response = client.get(url, HTTP_ACCEPT="application/json")
+
+    assert response["Content-Type"] == "application/json"
+    assert response.json()["results"] == [
+        {"id": str(shopping_item.id), "name": "Milk", "purchased": False}
+    ]
+
+
+def test_fast_json_renderer_encodes_uuids_and_datetimes():
+    renderer = FastJSONRenderer()
+    data = {
+        "id": uuid.UUID("5c0a5a3e-0e86-4e43-8f5c-6c9b6e4c7a10"),
+        "when": make_aware(datetime(2022, 9, 19, 19, 42)),
+        "precisely": make_aware(datetime(2022, 9, 19, 19, 42, 0, 123456)),
+        "price": Decimal("1.50"),
+    }
+
+    rendered = json.loads(renderer.render(data))
+
+    assert rendered["id"] == "5c0a5a3e-0e86-4e43-8f5c-6c9b6e4c7a10"
+    assert rendered["when"] == "2022-09-19T19:42:00Z"
+    assert rendered == json.loads(JSONRenderer().render(data))
+    assert rendered["price"] == 1.5
+
+
+@pytest.mark.django_db
+def test_async_shopping_lists_match_sync_shopping_lists(
+    create_user, create_authenticated_client, create_shopping_item
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    create_shopping_item("Milk", user)
+    create_shopping_item("Eggs", user)
+
+    response = client.get(reverse("async-all-shopping-lists"))
+
+    assert response.status_code == status.HTTP_200_OK
+    assert (
+        response.json()
+        == client.get(
+            reverse("all-shopping-lists"), HTTP_ACCEPT="application/json"
+        ).json()
+    )
+
+
+@pytest.mark.django_db
+def test_async_shopping_list_detail_and_items(
+    create_user, create_authenticated_client, create_shopping_item
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_item = create_shopping_item("Milk", user)
+    shopping_list = shopping_item.shopping_list
+
+    detail = client.get(reverse("async-shopping-list-detail", args=[shopping_list.id]))
+    items = client.get(reverse("async-list-shopping-items", args=[shopping_list.id]))
+
+    assert detail.json()["unpurchased_items"] == [{"name": "Milk"}]
+    assert detail.json()["members"] == [{"id": user.id, "username": "DummyUser"}]
+    assert items.json() == {
+        "count": 1,
+        "next": None,
+        "previous": None,
+        "results": [{"id": str(shopping_item.id), "name": "Milk", "purchased": False}],
+    }
+
+
+@pytest.mark.django_db
+def test_async_shopping_list_detail_restricted_if_not_member(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    shopping_list_creator = User.objects.create_user(
+        "Creator", "creator@list.com", "something"
+    )
+    shopping_list = create_shopping_list(shopping_list_creator)
+    client = create_authenticated_client(create_user())
+
+    response = client.get(
+        reverse("async-shopping-list-detail", args=[shopping_list.id])
+    )
+    missing = client.get(
+        reverse(
+            "async-list-shopping-items", args=["5c0a5a3e-0e86-4e43-8f5c-6c9b6e4c7a10"]
+        )
+    )
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    assert missing.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.django_db
+def test_async_shopping_lists_require_authentication(client):
+    response = client.get(reverse("async-all-shopping-lists"))
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+@pytest.mark.django_db
+def test_async_views_run_through_async_middleware(
+    create_user, create_shopping_item, caplog, settings
+):
+    # Django only logs the middleware it adapts in debug mode.
+    settings.DEBUG = True
+    user = create_user()
+    shopping_item = create_shopping_item("Milk", user)
+    client = AsyncClient()
+    async_to_sync(client.aforce_login)(user)
+    url = reverse("async-list-shopping-items", args=[shopping_item.shopping_list.id])
+
+    with caplog.at_level(logging.DEBUG, logger="django.request"):
+        response = async_to_sync(client.get)(url)
+
+    assert not [record for record in caplog.records if "adapted" in record.getMessage()]
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["results"] == [
+        {"id": str(shopping_item.id), "name": "Milk", "purchased": False}
+    ]
+    assert server_timing(response)["db"]["desc"] != '"0 queries"'
+
+
+def read_events(response):
+    events = []
+    for block in b"".join(response.streaming_content).decode().split("\n\n"):
+        fields = dict(
+            line.split(": ", 1) for line in block.splitlines() if ": " in line
+        )
+        if "event" in fields:
+            events.append(fields)
+    return events
+
+
+@pytest.mark.django_db
+def test_shopping_item_changes_are_streamed_as_events(
+    create_user,
+    create_authenticated_client,
+    create_shopping_list,
+    django_capture_on_commit_callbacks,
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    url = reverse("shopping-item-events", args=[shopping_list.id])
+
+    with django_capture_on_commit_callbacks(execute=True):
+        shopping_item = ShoppingItem.objects.create(
+            shopping_list=shopping_list, name="Milk", purchased=False
+        )
+        shopping_item_id = str(shopping_item.id)
+        shopping_item.purchased = True
+        shopping_item.save()
+        shopping_item.delete()
+
+    response = client.get(url, {"timeout": 0.01}, HTTP_LAST_EVENT_ID="0")
+    assert response["Content-Type"] == "text/event-stream"
+    events = read_events(response)
+
+    assert [event["event"] for event in events] == [
+        "item.created",
+        "item.updated",
+        "item.deleted",
+    ]
+    assert json.loads(events[1]["data"]) == {
+        "id": shopping_item_id,
+        "name": "Milk",
+        "purchased": True,
+    }
+
+    response = client.get(url, {"timeout": 0.01}, HTTP_LAST_EVENT_ID=events[0]["id"])
+    assert [event["event"] for event in read_events(response)] == [
+        "item.updated",
+        "item.deleted",
+    ]
+
+
+@pytest.mark.django_db
+def test_shopping_item_events_are_streamed_asynchronously_under_asgi(
+    create_user, create_shopping_list, django_capture_on_commit_callbacks
+):
+    user = create_user()
+    shopping_list = create_shopping_list(user)
+    with django_capture_on_commit_callbacks(execute=True):
+        ShoppingItem.objects.create(
+            shopping_list=shopping_list, name="Milk", purchased=False
+        )
+    client = AsyncClient()
+    async_to_sync(client.aforce_login)(user)
+    url = reverse("shopping-item-events", args=[shopping_list.id])
+
+    async def read_stream():
+        response = await client.get(
+            url, {"timeout": 0.01}, headers={"Last-Event-ID": "0"}
+        )
+        return response.is_async, [chunk async for chunk in response.streaming_content]
+
+    is_async, chunks = async_to_sync(read_stream)()
+
+    assert is_async
+    assert b"event: item.created" in b"".join(chunks)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("timeout", ["nan", "inf", "-1", "0", "soon"])
+def test_shopping_item_event_streams_reject_invalid_timeouts(
+    create_user, create_authenticated_client, create_shopping_list, timeout
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    url = reverse("shopping-item-events", args=[shopping_list.id])
+
+    response = client.get(url, {"timeout": timeout}, HTTP_ACCEPT="application/json")
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert "timeout" in response.json()
+
+
+@pytest.mark.django_db
+def test_bulk_purchase_publishes_the_ids_of_updated_items(
+    create_user,
+    create_authenticated_client,
+    create_shopping_list,
+    django_capture_on_commit_callbacks,
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    eggs = ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Eggs", purchased=True
+    )
+    milk = ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Milk", purchased=False
+    )
+    channel = shopping_list_channel(shopping_list.id)
+    after_id = get_broker().last_id(channel)
+
+    with django_capture_on_commit_callbacks(execute=True):
+        client.post(
+            reverse("bulk-shopping-items", args=[shopping_list.id]),
+            {"action": "purchase", "ids": [str(eggs.id), str(milk.id)]},
+            format="json",
+        )
+
+    assert get_broker().read(channel, after_id, 0)[-1][1:] == (
+        "items.updated",
+        {"ids": [str(milk.id)]},
+    )
+
+
+@pytest.mark.django_db
+def test_not_member_can_not_stream_shopping_item_events(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    shopping_list_creator = User.objects.create_user(
+        "Creator", "creator@list.com", "something"
+    )
+    shopping_list = create_shopping_list(shopping_list_creator)
+    client = create_authenticated_client(create_user())
+
+    url = reverse("shopping-item-events", args=[shopping_list.id])
+    response = client.get(url, HTTP_ACCEPT="text/event-stream")
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    assert response.content.startswith(b"event: error")
+
+
+@pytest.mark.parametrize(
+    "make_broker",
+    [
+        lambda tmp_path: InProcessBroker(max_events=2),
+        lambda tmp_path: FileBroker(tmp_path, poll_interval=0.01),
+    ],
+)
+def test_event_brokers_resume_after_last_event_id(make_broker, tmp_path):
+    broker = make_broker(tmp_path)
+    first_id = broker.publish("shopping-list:1", "item.created", {"name": "Milk"})
+    broker.publish("shopping-list:2", "item.created", {"name": "Books"})
+    second_id = broker.publish("shopping-list:1", "item.deleted", {"name": "Milk"})
+
+    assert broker.last_id("shopping-list:1") == second_id
+    assert [event[1] for event in broker.read("shopping-list:1", 0, 0)] == [
+        "item.created",
+        "item.deleted",
+    ]
+    assert broker.read("shopping-list:1", first_id, 0) == [
+        (second_id, "item.deleted", {"name": "Milk"})
+    ]
+    assert broker.read("shopping-list:1", second_id, 0.01) == []
+
+
+@pytest.mark.parametrize(
+    "make_broker",
+    [
+        lambda tmp_path: InProcessBroker(),
+        lambda tmp_path: FileBroker(tmp_path, poll_interval=0.01),
+    ],
+)
+def test_event_brokers_report_ids_newer_than_any_event_as_lost(make_broker, tmp_path):
+    broker = make_broker(tmp_path)
+    last_id = broker.publish("shopping-list:1", "item.created", {})
+
+    with pytest.raises(EventsLost):
+        broker.read("shopping-list:1", last_id + 500, 0)
+    with pytest.raises(EventsLost):
+        broker.read("shopping-list:2", last_id + 500, 0)
+
+
+def test_in_process_broker_reports_lost_events():
+    broker = InProcessBroker(max_events=1)
+    first_id = broker.publish("shopping-list:1", "item.created", {})
+    broker.publish("shopping-list:1", "item.updated", {})
+    broker.publish("shopping-list:1", "item.deleted", {})
+
+    with pytest.raises(EventsLost):
+        broker.read("shopping-list:1", first_id, 0)
+
+
+def test_file_broker_reports_ids_between_events_as_lost(tmp_path):
+    broker = FileBroker(tmp_path)
+    broker.publish("shopping-list:1", "item.created", {"name": "Milk"})
+
+    with pytest.raises(EventsLost):
+        broker.read("shopping-list:1", 5, 0)
+
+
+def test_file_broker_keeps_two_segments_of_events(tmp_path):
+    broker = FileBroker(tmp_path, max_bytes=1)
+    first_id = broker.publish("shopping-list:1", "item.created", {})
+    second_id = broker.publish("shopping-list:1", "item.updated", {})
+    third_id = broker.publish("shopping-list:1", "item.deleted", {})
+
+    assert len(list(tmp_path.glob("*.ndjson"))) == 2
+    assert broker.read("shopping-list:1", first_id, 0) == [
+        (second_id, "item.updated", {}),
+        (third_id, "item.deleted", {}),
+    ]
+    with pytest.raises(EventsLost):
+        broker.read("shopping-list:1", 0, 0)
+
+
+def sync(client, since=None, limit=None):
+    params = {}
+    if since:
+        params["since"] = since
+    if limit:
+        params["limit"] = limit
+    return client.get(reverse("sync"), params, HTTP_ACCEPT="application/json").json()
+
+
+@pytest.mark.django_db
+def test_sync_returns_only_changes_since_token(
+    create_user, create_authenticated_client, create_shopping_list, settings
+):
+    settings.SHOPPING_LIST_SYNC_WINDOW = 0
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    milk = ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Milk", purchased=False
+    )
+    eggs = ShoppingItem.objects.create(
+        shopping_list=shopping_list, name="Eggs", purchased=False
+    )
+
+    response = sync(client)
+    assert {(change["type"], change["id"]) for change in response["changes"]} == {
+        ("shopping_list", str(shopping_list.id)),
+        ("shopping_item", str(milk.id)),
+        ("shopping_item", str(eggs.id)),
+    }
+    assert sync(client, response["sync_token"])["changes"] == []
+
+    milk.purchased = True
+    milk.save()
+    eggs_id = str(eggs.id)
+    eggs.delete()
+
+    changes = sync(client, response["sync_token"])["changes"]
+    assert [(change["type"], change["id"]) for change in changes] == [
+        ("shopping_item", str(milk.id)),
+        ("shopping_list", str(shopping_list.id)),
+        ("deleted_shopping_item", eggs_id),
+    ]
+    assert changes[0]["purchased"] is True
+
+
+@pytest.mark.django_db
+def test_sync_pages_through_changes(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    with mock.patch("django.utils.timezone.now") as mock_now:
+        mock_now.return_value = make_aware(datetime.now())
+        for index in range(5):
+            ShoppingItem.objects.create(
+                shopping_list=shopping_list, name=f"Item {index}", purchased=False
+            )
+
+    seen = []
+    response = {"sync_token": None, "has_more": True}
+    while response["has_more"]:
+        response = sync(client, response["sync_token"], limit=2)
+        assert len(response["changes"]) <= 2
+        seen.extend(change["id"] for change in response["changes"])
+
+    assert len(seen) == len(set(seen)) == 6
+
+
+@pytest.mark.django_db
+def test_sync_reports_lists_the_user_lost(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    deleted_list = create_shopping_list(user)
+    left_list = create_shopping_list(user)
+    token = sync(client)["sync_token"]
+
+    deleted_list_id = str(deleted_list.id)
+    deleted_list.delete()
+    left_list.members.remove(user)
+
+    changes = sync(client, token)["changes"]
+
+    assert sorted((change["type"], change["id"]) for change in changes) == sorted(
+        [
+            ("deleted_shopping_list", deleted_list_id),
+            ("deleted_shopping_list", str(left_list.id)),
+        ]
+    )
+
+
+@pytest.mark.django_db
+def test_sync_returns_all_items_of_lists_shared_with_the_user(
+    create_user, create_authenticated_client, create_shopping_item, settings
+):
+    settings.SHOPPING_LIST_SYNC_WINDOW = 0
+    someone_else = User.objects.create_user(
+        "SomeoneElse", "someone@else.com", "something"
+    )
+    milk = create_shopping_item("Milk", someone_else)
+    shopping_list = milk.shopping_list
+    user = create_user()
+    client = create_authenticated_client(user)
+    token = sync(client)["sync_token"]
+
+    shopping_list.members.add(user)
+
+    changes = sync(client, token)["changes"]
+    assert sorted((change["type"], change["id"]) for change in changes) == sorted(
+        [
+            ("shopping_list", str(shopping_list.id)),
+            ("shopping_item", str(milk.id)),
+        ]
+    )
+
+
+@pytest.mark.django_db
+def test_sync_repeats_recent_changes_that_may_still_commit(
+    create_user, create_authenticated_client, create_shopping_list, settings
+):
+    settings.SHOPPING_LIST_SYNC_WINDOW = 60
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    token = sync(client)["sync_token"]
+
+    # Timestamped before the previous sync, but committed after it.
+    before_sync = timezone.now() - timedelta(seconds=30)
+    with mock.patch("django.utils.timezone.now") as mock_now:
+        mock_now.return_value = before_sync
+        late = ShoppingItem.objects.create(
+            shopping_list=shopping_list, name="Late", purchased=False
+        )
+
+    changes = sync(client, token)["changes"]
+    assert ("shopping_item", str(late.id)) in {
+        (change["type"], change["id"]) for change in changes
+    }
+
+
+def tombstone_inserts(queries):
+    return [
+        query
+        for query in queries
+        if query["sql"].startswith('INSERT INTO "shopping_list_tombstone"')
+    ]
+
+
+@pytest.mark.django_db
+def test_bulk_deleted_items_are_buried_with_one_insert(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    ShoppingItem.objects.bulk_create(
+        ShoppingItem(shopping_list=shopping_list, name=f"Item {index}", purchased=True)
+        for index in range(20)
+    )
+    url = reverse("bulk-shopping-items", args=[shopping_list.id])
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.post(url, {"action": "clear_purchased"}, format="json")
+
+    assert response.data["affected"] == 20
+    assert len(tombstone_inserts(queries)) == 1
+    assert Tombstone.objects.filter(kind=Tombstone.SHOPPING_ITEM).count() == 20
+
+
+@pytest.mark.django_db
+def test_deleted_shopping_lists_do_not_bury_their_items(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    ShoppingItem.objects.bulk_create(
+        ShoppingItem(shopping_list=shopping_list, name=f"Item {index}", purchased=False)
+        for index in range(50)
+    )
+
+    with CaptureQueriesContext(connection) as queries:
+        client.delete(reverse("shopping-list-detail", args=[shopping_list.id]))
+
+    assert len(tombstone_inserts(queries)) == 1
+    assert list(Tombstone.objects.values_list("kind", "user")) == [
+        (Tombstone.SHOPPING_LIST, user.id)
+    ]
+
+
+@pytest.mark.django_db
+def test_sync_does_not_leak_other_users_changes(
+    create_user, create_authenticated_client, create_shopping_item
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    token = sync(client)["sync_token"]
+
+    someone_else = User.objects.create_user(
+        "SomeoneElse", "someone@else.com", "something"
+    )
+    create_shopping_item("Milk", someone_else).delete()
+
+    assert sync(client, token)["changes"] == []
+
+
+@pytest.mark.django_db
+def test_sync_with_invalid_token_returns_bad_request(
+    create_user, create_authenticated_client
+):
+    client = create_authenticated_client(create_user())
+
+    response = client.get(reverse("sync"), {"since": "garbage"})
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def read_stream(response):
+    return b"".join(response.streaming_content).decode()
+
+
+@pytest.mark.django_db
+def test_export_shopping_list_streams_ndjson(
+    create_user, create_authenticated_client, create_shopping_item
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    item = create_shopping_item("Milk", user)
+    ShoppingList.objects.create(name="Hidden").members.add(
+        User.objects.create_user("SomeoneElse", "someone@else.com", "something")
+    )
+
+    url = reverse("export-shopping-list", args=[item.shopping_list.id])
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+        lines = [json.loads(line) for line in read_stream(response).splitlines()]
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response["Content-Type"].startswith("application/x-ndjson")
+    assert "attachment" in response["Content-Disposition"]
+    assert [line["type"] for line in lines] == ["shopping_list", "shopping_item"]
+    assert lines[1]["name"] == "Milk"
+    assert lines[1]["shopping_list"] == str(item.shopping_list.id)
+    assert len([q for q in queries if "shopping_item" in q["sql"]]) == 1
+
+
+@pytest.mark.django_db
+def test_export_all_shopping_lists_as_csv(
+    create_user, create_authenticated_client, create_shopping_item
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    item = create_shopping_item("Milk", user)
+    empty_list = ShoppingList.objects.create(name="Empty")
+    empty_list.members.add(user)
+    other = User.objects.create_user("SomeoneElse", "someone@else.com", "something")
+    create_shopping_item("Bread", other)
+
+    response = client.get(reverse("export-shopping-lists"), {"format": "csv"})
+    rows = read_stream(response).splitlines()
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response["Content-Type"].startswith("text/csv")
+    assert rows[0].startswith("shopping_list_id,")
+    assert len(rows) == 3
+    assert f"{item.shopping_list.id},My shopping list,{item.id},Milk,False" in rows
+    assert f"{empty_list.id},Empty,,," in rows
+
+
+@pytest.mark.django_db
+def test_export_is_streamed_asynchronously_under_asgi(
+    create_user, create_shopping_item
+):
+    user = create_user()
+    create_shopping_item("Milk", user)
+    create_shopping_item("Bread", user)
+    client = AsyncClient()
+    async_to_sync(client.aforce_login)(user)
+
+    async def read_stream():
+        response = await client.get(reverse("export-shopping-lists"))
+        return response.is_async, [chunk async for chunk in response.streaming_content]
+
+    is_async, chunks = async_to_sync(read_stream)()
+
+    assert is_async
+    lines = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+    assert len(lines) == 4
+    assert {line["name"] for line in lines if line["type"] == "shopping_item"} == {
+        "Milk",
+        "Bread",
+    }
+
+
+@pytest.mark.django_db
+def test_export_shopping_list_not_member_is_forbidden(
+    create_user, create_authenticated_client, create_shopping_item
+):
+    client = create_authenticated_client(create_user())
+    other = User.objects.create_user("SomeoneElse", "someone@else.com", "something")
+    item = create_shopping_item("Milk", other)
+
+    response = client.get(reverse("export-shopping-list", args=[item.shopping_list.id]))
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+
+def import_file(client, name, content):
+    upload = SimpleUploadedFile(name, content.encode())
+    response = client.post(
+        reverse("import-shopping-lists"), {"file": upload}, format="multipart"
+    )
+    return response, [json.loads(line) for line in read_stream(response).splitlines()]
+
+
+@pytest.mark.django_db
+def test_import_ndjson_creates_lists_and_reports_errors(
+    create_user, create_authenticated_client
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    content = "\n".join(
+        [
+            '{"type": "shopping_list", "id": "a", "name": "Groceries"}',
+            '{"type": "shopping_item", "name": "Milk", "purchased": false}',
+            '{"type": "shopping_item", "name": "milk", "purchased": false}',
+            '{"type": "shopping_item", "name": "Eggs", "purchased": true}',
+            "not json",
+            '{"type": "shopping_item", "shopping_list": "b", "name": "Bread"}',
+            '{"type": "shopping_list", "name": "Hardware"}',
+            '{"type": "shopping_item", "name": "Nails", "purchased": false}',
+        ]
+    )
+
+    response, reports = import_file(client, "lists.ndjson", content)
+
+    assert response.status_code == status.HTTP_200_OK
+    errors = {report["row"] for report in reports if report["type"] == "error"}
+    assert errors == {3, 5, 6}
+    assert reports[-1] == {
+        "type": "summary",
+        "rows": 8,
+        "shopping_lists": 2,
+        "shopping_items": 3,
+        "errors": 3,
+    }
+    groceries = ShoppingList.objects.get(name="Groceries", members=user)
+    assert sorted(groceries.shopping_items.values_list("name", flat=True)) == [
+        "Eggs",
+        "Milk",
+    ]
+
+
+@pytest.mark.django_db
+def test_import_csv_round_trips_export_in_batches(
+    create_user, create_authenticated_client, create_shopping_item, settings
+):
+    settings.SHOPPING_LIST_IMPORT_BATCH_SIZE = 2
+    user = create_user()
+    client = create_authenticated_client(user)
+    item = create_shopping_item("Milk", user)
+    for name in ["Bread", "Eggs", "Butter"]:
+        ShoppingItem.objects.create(
+            name=name, purchased=False, shopping_list=item.shopping_list
+        )
+    exported = read_stream(
+        client.get(reverse("export-shopping-lists"), {"format": "csv"})
+    )
+
+    with CaptureQueriesContext(connection) as queries:
+        response, reports = import_file(client, "lists.csv", exported)
+
+    assert [report["type"] for report in reports].count("progress") == 2
+    assert reports[-1]["shopping_items"] == 4
+    assert ShoppingList.objects.filter(members=user).count() == 2
+    touches = [
+        q for q in queries if q["sql"].startswith('UPDATE "shopping_list_shoppinglist"')
+    ]
+    assert len(touches) == 1
+
+
+@pytest.mark.django_db
+def test_import_failure_ends_with_an_error_and_summary(
+    create_user, create_authenticated_client, settings
+):
+    settings.SHOPPING_LIST_IMPORT_BATCH_SIZE = 2
+    user = create_user()
+    client = create_authenticated_client(user)
+    content = "\n".join(
+        f'{{"type": "shopping_list", "name": "List {index}"}}' for index in range(4)
+    )
+    bulk_create = ShoppingList.objects.bulk_create
+
+    def fail_second_batch(shopping_lists):
+        if ShoppingList.objects.filter(members=user).exists():
+            raise IntegrityError("boom")
+        return bulk_create(shopping_lists)
+
+    with mock.patch.object(
+        ShoppingList.objects, "bulk_create", side_effect=fail_second_batch
+    ):
+        response, reports = import_file(client, "lists.ndjson", content)
+
+    assert [report["type"] for report in reports] == ["progress", "error", "summary"]
+    assert reports[1]["row"] == 4
+    assert reports[-1]["shopping_lists"] == 2
+    assert reports[-1]["errors"] == 1
+    assert ShoppingList.objects.filter(members=user).count() == 2
+
+
+@pytest.mark.django_db
+def test_import_is_streamed_asynchronously_under_asgi(create_user):
+    user = create_user()
+    client = AsyncClient()
+    async_to_sync(client.aforce_login)(user)
+    content = "\n".join(
+        [
+            '{"type": "shopping_list", "name": "Groceries"}',
+            '{"type": "shopping_item", "name": "Milk", "purchased": false}',
+        ]
+    )
+
+    async def read_stream():
+        upload = SimpleUploadedFile("lists.ndjson", content.encode())
+        response = await client.post(reverse("import-shopping-lists"), {"file": upload})
+        return response.is_async, [chunk async for chunk in response.streaming_content]
+
+    is_async, chunks = async_to_sync(read_stream)()
+
+    assert is_async
+    reports = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+    assert reports[-1]["shopping_items"] == 1
+    groceries = ShoppingList.objects.get(name="Groceries", members=user)
+    assert groceries.shopping_items.get().name == "Milk"
+
+
+@pytest.mark.django_db
+def test_import_is_aborted_when_the_client_disconnects(
+    create_user, create_authenticated_client, settings, caplog
+):
+    settings.SHOPPING_LIST_IMPORT_BATCH_SIZE = 2
+    user = create_user()
+    client = create_authenticated_client(user)
+    content = "\n".join(
+        ['{"type": "shopping_list", "name": "Groceries"}']
+        + [
+            f'{{"type": "shopping_item", "name": "Item {index}", "purchased": false}}'
+            for index in range(4)
+        ]
+    )
+    upload = SimpleUploadedFile("lists.ndjson", content.encode())
+    response = client.post(
+        reverse("import-shopping-lists"), {"file": upload}, format="multipart"
+    )
+
+    progress = json.loads(next(iter(response.streaming_content)))
+    with CaptureQueriesContext(connection) as queries:
+        with caplog.at_level(logging.WARNING, logger="shopping_list.api.importer"):
+            response.close()
+
+    assert progress["shopping_items"] == 1
+    groceries = ShoppingList.objects.get(members=user)
+    assert list(groceries.shopping_items.values_list("name", flat=True)) == ["Item 0"]
+    assert [q for q in queries if q["sql"].startswith("INSERT")] == []
+    assert [q for q in queries if q["sql"].startswith("UPDATE")]
+    assert "Import aborted at row 2" in caplog.text
+
+
+@pytest.mark.django_db
+def test_import_is_aborted_when_the_async_client_disconnects(create_user, caplog):
+    user = create_user()
+    importer = ShoppingListImporter(user, batch_size=2)
+    records = parse_ndjson(
+        f'{{"type": "shopping_list", "name": "List {index}"}}'.encode()
+        for index in range(5)
+    )
+
+    async def import_first_batch():
+        reports = importer.arun(records)
+        progress = await anext(reports)
+        await reports.aclose()
+        return progress
+
+    with caplog.at_level(logging.WARNING, logger="shopping_list.api.importer"):
+        progress = async_to_sync(import_first_batch)()
+
+    assert progress["shopping_lists"] == 2
+    assert ShoppingList.objects.filter(members=user).count() == 2
+    assert "Import aborted at row 2" in caplog.text
+
+
+@pytest.mark.django_db(transaction=True, databases=["default", "replica"])
+def test_importers_are_pinned_to_primary_as_batches_commit(
+    create_user, create_authenticated_client, replica
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    upload = SimpleUploadedFile(
+        "lists.ndjson", b'{"type": "shopping_list", "name": "Groceries"}'
+    )
+
+    response = client.post(
+        reverse("import-shopping-lists"), {"file": upload}, format="multipart"
+    )
+
+    assert not is_pinned_to_primary(user.pk)
+
+    read_stream(response)
+
+    assert is_pinned_to_primary(user.pk)
+
+
+@pytest.mark.django_db
+def test_import_without_file_is_bad_request(create_user, create_authenticated_client):
+    client = create_authenticated_client(create_user())
+
+    response = client.post(reverse("import-shopping-lists"), {}, format="multipart")
+
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+def test_seed_command_creates_skewed_data_without_signals():
+    with mock.patch("shopping_list.receivers.record_interaction") as record_interaction:
+        call_command(
+            "seed",
+            users=20,
+            lists=10,
+            items=500,
+            max_members=5,
+            batch_size=100,
+            stdout=StringIO(),
+        )
+
+    record_interaction.assert_not_called()
+    assert User.objects.count() == 20
+    assert ShoppingItem.objects.count() == 500
+    busiest, *rest = ShoppingList.objects.annotate(
+        item_count=Count("shopping_items"), member_count=Count("members", distinct=True)
+    ).order_by("-item_count", "-member_count")
+    assert busiest.member_count == 5
+    assert busiest.item_count > max(shopping_list.item_count for shopping_list in rest)
+    assert ShoppingList.objects.filter(
+        last_interaction__lt=timezone.now() - timedelta(minutes=1)
+    ).exists()
+
+
+def server_timing(response):
+    metrics = {}
+    for metric in response["Server-Timing"].split(", "):
+        name, *params = metric.split(";")
+        metrics[name] = dict(param.split("=", 1) for param in params)
+    return metrics
+
+
+@pytest.mark.django_db
+def test_server_timing_header_reports_phases(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(reverse("shopping-list-detail", args=[shopping_list.id]))
+
+    metrics = server_timing(response)
+    assert set(metrics) == {"db", "permissions", "serializer", "render", "total"}
+    assert metrics["db"]["desc"] == f'"{len(queries)} queries"'
+    for name in ["permissions", "serializer", "render"]:
+        assert 0 < float(metrics[name]["dur"]) <= float(metrics["total"]["dur"])
+
+
+@pytest.mark.django_db
+def test_values_serializers_fetch_rows_outside_the_serializer_phase(
+    create_user, create_shopping_item
+):
+    item = create_shopping_item("Milk", create_user())
+    serializer_queries = []
+
+    def record(execute, sql, params, many, context):
+        if "serializer" in get_timer()._active:
+            serializer_queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with time_request() as timer, connection.execute_wrapper(record):
+        shopping_lists = ShoppingListValuesSerializer.to_representation(
+            ShoppingListValuesSerializer.get_rows(ShoppingList.objects.all())
+        )
+        shopping_items = ShoppingItemValuesSerializer.to_representation(
+            ShoppingItemValuesSerializer.get_rows(ShoppingItem.objects.all())
+        )
+
+    assert shopping_lists[0]["unpurchased_items"] == [{"name": "Milk"}]
+    assert shopping_items[0]["id"] == item.id
+    assert serializer_queries == []
+    assert timer.queries == 4
+    assert "serializer" in timer.durations
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "audience, is_staff, sent",
+    [("staff", False, False), ("staff", True, True), (False, True, False)],
+)
+def test_server_timing_header_is_only_sent_to_its_audience(
+    create_user, create_authenticated_client, settings, audience, is_staff, sent
+):
+    settings.SHOPPING_LIST_SERVER_TIMING = audience
+    user = create_user()
+    user.is_staff = is_staff
+    user.save()
+    client = create_authenticated_client(user)
+
+    response = client.get(reverse("all-shopping-lists"))
+
+    assert response.status_code == status.HTTP_200_OK
+    assert ("Server-Timing" in response) == sent
+
+
+@pytest.mark.django_db
+def test_server_timing_log_line(
+    create_user, create_authenticated_client, settings, caplog
+):
+    settings.SHOPPING_LIST_SERVER_TIMING_LOG = True
+    client = create_authenticated_client(create_user())
+
+    with caplog.at_level("INFO", logger="shopping_list.timing"):
+        client.get(reverse("all-shopping-lists"))
+
+    line = json.loads(caplog.records[-1].getMessage())
+    assert line["route"] == "all-shopping-lists"
+    assert line["status"] == 200
+    assert line["queries"] > 0
+    assert line["total_ms"] >= line["serializer_ms"]
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint_reports_route_histograms_and_cache_ratio(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    for _ in range(2):
+        client.get(reverse("shopping-list-detail", args=[shopping_list.id]))
+    admin = User.objects.create_superuser("Admin", "admin@example.com", "something")
+
+    response = create_authenticated_client(admin).get(reverse("metrics"))
+    text = response.content.decode()
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response["Content-Type"].startswith("text/plain")
+    assert (
+        'shopping_list_requests_total{route="shopping-list-detail",method="GET",'
+        'status="200"} 2' in text
+    )
+    assert (
+        'shopping_list_request_duration_seconds_count{route="shopping-list-detail"} 2'
+        in text
+    )
+    assert (
+        'shopping_list_request_queries_bucket{route="shopping-list-detail",le="+Inf"} 2'
+        in text
+    )
+    assert 'shopping_list_cache_hit_ratio{route="shopping-list-detail"} 0.5' in text
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint_adds_up_worker_processes(
+    create_user, create_authenticated_client, metrics_dir
+):
+    other_worker = MetricsStore(metrics_dir)
+    other_worker.path = metrics_dir / "metrics-0.json"
+    other_worker.observe("sync", "GET", 200, 0.02, 3)
+    other_worker.observe("sync", "GET", 200, 0.2, 3)
+    other_worker.flush()
+    admin = User.objects.create_superuser("Admin", "admin@example.com", "something")
+    client = create_authenticated_client(admin)
+    client.get(reverse("sync"))
+
+    text = client.get(reverse("metrics")).content.decode()
+
+    assert (
+        'shopping_list_requests_total{route="sync",method="GET",status="200"} 3' in text
+    )
+    assert (
+        'shopping_list_request_duration_seconds_bucket{route="sync",le="0.1"}' in text
+    )
+    assert 'shopping_list_request_queries_count{route="sync"} 3' in text
+
+
+def test_metrics_of_idle_workers_are_flushed_in_the_background(metrics_dir):
+    store = MetricsStore(metrics_dir, flush_interval=0.01)
+    store.observe("sync", "GET", 200, 0.02, 3)
+
+    deadline = time.monotonic() + 5
+    while not store.path.exists() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    store.close()
+
+    assert json.loads(store.path.read_text())["requests"] == [["sync", "GET", "200", 1]]
+
+
+def test_metrics_of_exited_workers_are_retired_into_one_file(metrics_dir):
+    exited = subprocess.Popen(["true"])
+    exited.wait()
+    for pid in [exited.pid, 0]:
+        worker = MetricsStore(metrics_dir)
+        worker.path = metrics_dir / f"metrics-{pid}.json"
+        worker.observe("sync", "GET", 200, 0.02, 3)
+        worker.close()
+    store = MetricsStore(metrics_dir)
+
+    totals = store.collect()
+    totals_again = store.collect()
+
+    assert not (metrics_dir / f"metrics-{exited.pid}.json").exists()
+    assert (metrics_dir / "metrics-retired.json").exists()
+    assert totals["requests"] == totals_again["requests"] == {("sync", "GET", "200"): 2}
+
+
+@pytest.mark.django_db
+def test_metrics_endpoint_is_admin_only(create_user, create_authenticated_client):
+    client = create_authenticated_client(create_user())
+
+    assert client.get(reverse("metrics")).status_code == status.HTTP_403_FORBIDDEN
+
+
+def test_query_shape_erases_literals_and_in_lists():
+    assert query_shape(
+        "SELECT * FROM t WHERE a = %s AND b IN (%s, %s, %s) LIMIT 21"
+    ) == query_shape("SELECT  *  FROM t\nWHERE a = %s AND b IN (%s) LIMIT 1")
+
+
+def eager_loading_disabled():
+    return mock.patch.object(
+        ListAddShoppingList,
+        "list",
+        lambda self, request: Response(
+            ShoppingListSerializer(self.get_queryset(), many=True).data
+        ),
+    )
+
+
+def test_queries_scattered_over_shards_are_not_repeated():
+    recorder = QueryPatternRecorder()
+    for alias in ["default", "shard1", "shard2"]:
+        recorder.execute_wrapper(
+            lambda *args: None,
+            "SELECT * FROM t WHERE id IN (%s)",
+            [1],
+            False,
+            {"connection": mock.Mock(alias=alias)},
+        )
+
+    assert recorder.repeated(3) == []
+
+
+@pytest.mark.django_db
+def test_repeated_queries_raise_in_tests(create_user, create_authenticated_client):
+    user = create_user()
+    client = create_authenticated_client(user)
+    for name in ["Groceries", "Hardware", "Pharmacy"]:
+        ShoppingList.objects.create(name=name).members.add(user)
+
+    with eager_loading_disabled(), pytest.raises(NPlusOneError) as error:
+        client.get(reverse("all-shopping-lists"))
+
+    assert "all-shopping-lists ran 3 queries" in str(error.value)
+
+
+@pytest.mark.django_db
+def test_repeated_queries_are_logged_in_log_mode(
+    create_user, create_authenticated_client, settings, caplog
+):
+    settings.SHOPPING_LIST_NPLUSONE = "log"
+    user = create_user()
+    client = create_authenticated_client(user)
+    for name in ["Groceries", "Hardware", "Pharmacy"]:
+        ShoppingList.objects.create(name=name).members.add(user)
+
+    with eager_loading_disabled():
+        response = client.get(reverse("all-shopping-lists"))
+
+    assert response.status_code == status.HTTP_200_OK
+    assert any(record.name == "shopping_list.nplusone" for record in caplog.records)
+
+
+@pytest.mark.django_db
+def test_views_can_allow_repeated_queries(create_user, create_authenticated_client):
+    user = create_user()
+    client = create_authenticated_client(user)
+    for name in ["Groceries", "Hardware", "Pharmacy"]:
+        ShoppingList.objects.create(name=name).members.add(user)
+
+    with eager_loading_disabled(), mock.patch.object(
+        ListAddShoppingList, "allow_repeated_queries", True, create=True
+    ):
+        response = client.get(reverse("all-shopping-lists"))
+
+    assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_query_budget_fails_requests_over_budget(
+    create_user, create_authenticated_client, query_budget
+):
+    client = create_authenticated_client(create_user())
+
+    with query_budget(7):
+        client.get(reverse("all-shopping-lists"))
+    with pytest.raises(pytest.fail.Exception, match="Query budget of 1 exceeded"):
+        with query_budget(1):
+            client.get(reverse("all-shopping-lists"))
+
+
+@pytest.mark.django_db
+@pytest.mark.query_budget(7)
+def test_query_budget_marker_applies_to_every_request(
+    create_user, create_authenticated_client, create_shopping_list
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+
+    client.get(reverse("all-shopping-lists"))
+    client.get(reverse("shopping-list-detail", args=[shopping_list.id]))
+    client.get(reverse("list-add-shopping-item", args=[shopping_list.id]))
+
+
+@pytest.fixture
+def replica(settings):
+    settings.SHOPPING_LIST_REPLICAS = ["replica"]
+
+
+@pytest.mark.django_db(transaction=True, databases=["default", "replica"])
+def test_shopping_lists_are_read_from_replica(
+    create_user, create_authenticated_client, create_shopping_list, replica
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    create_shopping_list(user)
+    url = reverse("all-shopping-lists")
+
+    assert client.get(url).data["count"] == 0
+
+    call_command("sync_replicas", stdout=StringIO())
+    get_cache().clear()
+
+    assert client.get(url).data["count"] == 1
+
+
+@pytest.mark.django_db(transaction=True, databases=["default", "replica"])
+def test_writers_read_their_writes_from_primary(
+    create_user, create_authenticated_client, create_shopping_list, replica
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    shopping_list = create_shopping_list(user)
+    call_command("sync_replicas", stdout=StringIO())
+    url = reverse("list-add-shopping-item", args=[shopping_list.id])
+
+    client.post(url, {"name": "Milk", "purchased": False}, format="json")
+    response = client.get(url)
+
+    assert [item["name"] for item in response.data["results"]] == ["Milk"]
+
+    get_cache().clear()
+    response = client.get(url)
+
+    assert response.data["results"] == []
+
+
+def test_primary_pins_need_a_cache_shared_by_all_workers(replica, settings):
+    settings.SHOPPING_LIST_CACHE_SINGLE_PROCESS = False
+
+    with pytest.raises(ImproperlyConfigured):
+        PinWritersToPrimaryMiddleware(lambda request: None)
+    with pytest.raises(ImproperlyConfigured):
+        pin_to_primary(1)
+
+
+def test_primary_pins_are_seen_by_other_workers(replica, settings, tmp_path):
+    settings.SHOPPING_LIST_CACHE_SINGLE_PROCESS = False
+    settings.CACHES = {
+        **settings.CACHES,
+        "pins": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": tmp_path / "pins",
+        },
+    }
+    settings.SHOPPING_LIST_REPLICA_PIN_CACHE = "pins"
+
+    pin_to_primary(1)
+    # A new cache instance, as in another worker process.
+    del caches["pins"]
+
+    assert is_pinned_to_primary(1)
+    assert not is_pinned_to_primary(2)
+
+
+@pytest.fixture
+def sharded(settings):
+    settings.SHOPPING_LIST_SHARDS = ["default", "shard1"]
+
+
+@pytest.mark.django_db(transaction=True, databases=["default", "shard1"])
+def test_shopping_list_rows_live_on_their_shard(
+    create_user, create_authenticated_client, sharded
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    # Ids are assigned to shards by their value modulo the number of shards.
+    shopping_list = ShoppingList.objects.create(id=uuid.UUID(int=1), name="Groceries")
+    shopping_list.members.add(user)
+
+    response = client.post(
+        reverse("list-add-shopping-item", args=[shopping_list.id]),
+        {"name": "Milk", "purchased": False},
+        format="json",
+    )
+    item_url = reverse(
+        "shopping-item-detail", args=[shopping_list.id, response.data["id"]]
+    )
+    client.patch(item_url, {"purchased": True}, format="json")
+    detail = client.get(reverse("shopping-list-detail", args=[shopping_list.id]))
+
+    assert User.objects.using("shard1").filter(pk=user.pk).exists()
+    assert not ShoppingList.objects.using("default").exists()
+    assert ShoppingItem.objects.using("shard1").get().purchased is True
+    assert detail.data["members"] == [{"id": user.id, "username": user.username}]
+
+    client.delete(item_url)
+    client.delete(reverse("shopping-list-detail", args=[shopping_list.id]))
+
+    assert not ShoppingList.objects.using("shard1").exists()
+
+
+@pytest.mark.django_db(transaction=True, databases=["default", "shard1"])
+def test_all_shopping_lists_are_merged_from_every_shard(
+    create_user, create_authenticated_client, sharded
+):
+    user = create_user()
+    client = create_authenticated_client(user)
+    now = timezone.now()
+    for index in range(6):
+        shopping_list = ShoppingList.objects.create(
+            id=uuid.UUID(int=index), name=f"List {index}"
+        )
+        shopping_list.members.add(user)
+        ShoppingItem.objects.create(
+            shopping_list=shopping_list, name="Milk", purchased=False
+        )
+        ShoppingList.objects.using(shopping_list._state.db).filter(
+            pk=shopping_list.pk
+        ).update(last_interaction=now - timedelta(minutes=index))
+    url = reverse("all-shopping-lists")
+
+    first_page = client.get(url)
+    second_page = client.get(url, {"page": 2})
+
+    assert first_page.data["count"] == 6
+    assert [row["name"] for row in first_page.data["results"]] == [
+        "List 0",
+        "List 1",
+        "List 2",
+    ]
+    assert [row["name"] for row in second_page.data["results"]] == [
+        "List 3",
+        "List 4",
+        "List 5",
+    ]
+    assert all(
+        row["unpurchased_items"] == [{"name": "Milk"}]
+        for row in first_page.data["results"]
+    )
+
+    names = []
+    next_url = url + "?cursor="
+    while next_url:
+        response = client.get(next_url)
+        names.extend(row["name"] for row in response.data["results"])
+        next_url = response.data["next"]
+
+    assert names == [f"List {index}" for index in range(6)]
+
+    response = client.get(reverse("async-all-shopping-lists"), {"page": 2})
+
+    assert response.json()["results"] == second_page.json()["results"]
+
+    changes = client.get(reverse("sync")).data["changes"]
+
+    assert len([change for change in changes if change["type"] == "shopping_list"]) == 6
+
+
+@pytest.mark.django_db(transaction=True, databases=["default", "shard1"])
+def test_deleted_users_are_removed_from_every_shard(create_user, sharded):
+    user = create_user()
+    ShoppingList.objects.create(id=uuid.UUID(int=1), name="Groceries").members.add(user)
+
+    user.delete()
+
+    assert not User.objects.using("shard1").exists()
+    assert not ShoppingList.members.through.objects.using("shard1").exists()
+
+
+@pytest.mark.django_db
+def test_token_is_issued_for_valid_credentials(create_user):
+    create_user()
+    client = APIClient()
+    url = reverse("issue-token")
+
+    response = client.post(url, {"username": "DummyUser", "password": "sosecure"})
+    wrong_password = client.post(url, {"username": "DummyUser", "password": "wrong"})
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.data["expires_in"] == 24 * 60 * 60
+    assert wrong_password.status_code == status.HTTP_400_BAD_REQUEST
+
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['token']}")
+
+    assert client.get(reverse("all-shopping-lists")).status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_token_authentication_runs_no_queries_for_cached_users(
+    create_user, create_shopping_list
+):
+    user = create_user()
+    create_shopping_list(user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {issue_token(user)}")
+    url = reverse("all-shopping-lists")
+    client.get(url)
+    get_cache().clear()
+
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(url)
+
+    assert response.data["count"] == 1
+    assert not any(
+        'FROM "shopping_list_user"' in query["sql"] or "django_session" in query["sql"]
+        for query in context.captured_queries
+    )
+
+
+@pytest.mark.django_db
+def test_expired_and_tampered_tokens_are_rejected(create_user, settings):
+    user = create_user()
+    token = issue_token(user)
+    client = APIClient()
+    url = reverse("all-shopping-lists")
+
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token[:-1]}x")
+    tampered = client.get(url)
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {token}")
+    with mock.patch("django.core.signing.time.time", return_value=time.time() + 61):
+        settings.SHOPPING_LIST_TOKEN_MAX_AGE = 60
+        expired = client.get(url)
+
+    assert tampered.status_code == status.HTTP_403_FORBIDDEN
+    assert tampered.data["detail"] == "Invalid token."
+    assert expired.status_code == status.HTTP_403_FORBIDDEN
+    assert expired.data["detail"] == "Token has expired."
+
+
+@pytest.mark.django_db
+def test_saved_users_are_reloaded_by_token_authentication(create_user):
+    user = create_user()
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {issue_token(user)}")
+    url = reverse("async-all-shopping-lists")
+
+    assert client.get(url).status_code == status.HTTP_200_OK
+
+    user.is_active = False
+    user.save()
+    response = client.get(url)
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    assert response.json()["detail"] == "User inactive or deleted."
+
+
+@pytest.mark.django_db
+def test_tokens_are_rejected_after_a_password_change(create_user):
+    user = create_user()
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {issue_token(user)}")
+    url = reverse("all-shopping-lists")
+
+    assert client.get(url).status_code == status.HTTP_200_OK
+
+    user.set_password("evenmoresecure")
+    user.save()
+    response = client.get(url)
+    client.credentials(HTTP_AUTHORIZATION=f"Bearer {issue_token(user)}")
+
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+    assert response.data["detail"] == "Invalid token."
+    assert client.get(url).status_code == status.HTTP_200_OK
+
+
+@pytest.mark.django_db
+def test_user_changes_reach_the_user_caches_of_other_processes(create_user):
+    user = create_user()
+    other_process = UserCache()
+    other_process.get(user.pk)
+
+    User.objects.filter(pk=user.pk).update(is_active=False)
+    # What saving the user does in the process that changed it.
+    get_user_cache().invalidate(user.pk)
+
+    assert not other_process.get(user.pk).is_active
+
+
+@pytest.mark.django_db
+def test_user_caches_recheck_user_versions_at_an_interval(create_user):
+    user = create_user()
+    other_process = UserCache(recheck=5)
+    other_process.get(user.pk)
+
+    User.objects.filter(pk=user.pk).update(is_active=False)
+    get_user_cache().invalidate(user.pk)
+
+    with mock.patch("shopping_list.users.get_cache") as get_cache:
+        assert other_process.get(user.pk).is_active
+    assert not get_cache.called
+    later = time.monotonic() + 5
+    with mock.patch("shopping_list.users.time.monotonic", return_value=later):
+        assert not other_process.get(user.pk).is_active
+
+
+@pytest.mark.django_db
+def test_token_requests_are_throttled(create_user):
+    create_user()
+    client = APIClient()
+    url = reverse("issue-token")
+    credentials = {"username": "DummyUser", "password": "wrong"}
+
+    responses = [client.post(url, credentials).status_code for _ in range(11)]
+
+    assert responses == [status.HTTP_400_BAD_REQUEST] * 10 + [
+        status.HTTP_429_TOO_MANY_REQUESTS
+    ]
@@ -0,0 +1,106 @@
+import time
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+_current_timer = ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    """Durations in seconds of the phases of one request, and its queries."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.queries = 0
+        self._active = set()
+
+    def add(self, phase, duration):
+        self.durations[phase] = self.durations.get(phase, 0) + duration
+
+    @property
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.add("db", time.perf_counter() - start)
+
+
+def get_timer():
+    return _current_timer.get()
+
+
+@contextmanager
+def wrap_queries(wrapper):
+    """Install an execute wrapper on the connections to every database."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
+
+
+@asynccontextmanager
+async def awrap_queries(wrapper):
+    """wrap_queries for async code.
+
+    Connections belong to a thread, and the queries of an async request run in
+    the thread sync_to_async keeps for it, so the wrapper is installed there.
+    """
+    stack = ExitStack()
+    await sync_to_async(stack.enter_context)(wrap_queries(wrapper))
+    try:
+        yield
+    finally:
+        await sync_to_async(stack.close)()
+
+
+@contextmanager
+def _current(timer):
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+
+
+@contextmanager
+def time_request():
+    """Time the block as a request, counting the queries of every database."""
+    with _current(RequestTimer()) as timer, wrap_queries(timer.execute_wrapper):
+        yield timer
+
+
+@asynccontextmanager
+async def atime_request():
+    """time_request for async code."""
+    with _current(RequestTimer()) as timer:
+        async with awrap_queries(timer.execute_wrapper):
+            yield timer
+
+
+@contextmanager
+def timed(phase):
+    """Add the duration of the block to a phase of the current request.
+
+    Nested blocks of the same phase are only counted once. Can be used as a
+    decorator, and does nothing outside of a timed request.
+    """
+    timer = _current_timer.get()
+    if timer is None or phase in timer._active:
+        yield
+        return
+
+    timer._active.add(phase)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer._active.discard(phase)
+        timer.add(phase, time.perf_counter() - start)
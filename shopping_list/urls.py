@@ -1,10 +1,19 @@
 from django.urls import include, path
 
+from shopping_list.api import async_views
 from shopping_list.api.views import (
+    BulkShoppingItems,
+    ExportShoppingList,
+    ExportShoppingLists,
+    ImportShoppingLists,
+    IssueToken,
     ListAddShoppingItem,
     ListAddShoppingList,
+    Metrics,
     ShoppingItemDetail,
+    ShoppingItemEvents,
     ShoppingListDetail,
+    Sync,
 )
 
 urlpatterns = [
@@ -22,9 +31,44 @@ urlpatterns = [
         ListAddShoppingItem.as_view(),
         name="list-add-shopping-item",
     ),
+    path(
+        "api/shopping-lists/<uuid:pk>/shopping-items/bulk/",
+        BulkShoppingItems.as_view(),
+        name="bulk-shopping-items",
+    ),
+    path(
+        "api/shopping-lists/<uuid:pk>/shopping-items/events/",
+        ShoppingItemEvents.as_view(),
+        name="shopping-item-events",
+    ),
     path(
         "api/shopping-lists/<uuid:pk>/shopping-items/<uuid:item_pk>/",
         ShoppingItemDetail.as_view(),
         name="shopping-item-detail",
     ),
+    path(
+        "api/shopping-lists/<uuid:pk>/export/",
+        ExportShoppingList.as_view(),
+        name="export-shopping-list",
+    ),
+    path("api/export/", ExportShoppingLists.as_view(), name="export-shopping-lists"),
+    path("api/import/", ImportShoppingLists.as_view(), name="import-shopping-lists"),
+    path("api/sync/", Sync.as_view(), name="sync"),
+    path("api/token/", IssueToken.as_view(), name="issue-token"),
+    path("metrics/", Metrics.as_view(), name="metrics"),
+    path(
+        "api/async/shopping-lists/",
+        async_views.shopping_lists,
+        name="async-all-shopping-lists",
+    ),
+    path(
+        "api/async/shopping-lists/<uuid:pk>/",
+        async_views.shopping_list_detail,
+        name="async-shopping-list-detail",
+    ),
+    path(
+        "api/async/shopping-lists/<uuid:pk>/shopping-items/",
+        async_views.shopping_items,
+        name="async-list-shopping-items",
+    ),
 ]
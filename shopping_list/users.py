@@ -0,0 +1,106 @@
+"""In-process cache of users, so that authenticating a request runs no query.
+
+Entries expire after SHOPPING_LIST_USER_CACHE_TTL seconds and the least
+recently used ones are evicted beyond SHOPPING_LIST_USER_CACHE_SIZE. Saving or
+deleting a user drops its entry in this process and gives the user a new
+version in the shopping list cache, which every process compares with its
+entry at most once every SHOPPING_LIST_USER_CACHE_RECHECK seconds; if that
+cache is not shared, other processes notice the change once their entry
+expires.
+"""
+
+import copy
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from shopping_list.cache import get_cache
+
+
+def _version_key(user_id):
+    return f"user-version:{user_id}"
+
+
+class UserCache:
+    def __init__(self, ttl=60, max_size=1000, recheck=0):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.recheck = recheck
+        self.lock = threading.Lock()
+        # Entries are (expires, version, user, checked_until).
+        self.entries = OrderedDict()
+        # Bumped by every invalidation, so that a user loaded concurrently
+        # with one is not cached.
+        self.generation = 0
+
+    def get(self, user_id):
+        """Return a copy of the user, or None if there is no such user."""
+        key = str(user_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and min(entry[0], entry[3]) > time.monotonic():
+                self.entries.move_to_end(key)
+                return copy.copy(entry[2])
+
+        # None until the user first changes, or once the version is evicted,
+        # in which case the entry is trusted until it expires.
+        version = get_cache().get(_version_key(key))
+        with self.lock:
+            entry = self.entries.get(key)
+            now = time.monotonic()
+            if entry is not None and entry[0] > now and version in (None, entry[1]):
+                self.entries[key] = (*entry[:3], now + self.recheck)
+                self.entries.move_to_end(key)
+                return copy.copy(entry[2])
+            generation = self.generation
+
+        user = get_user_model()._default_manager.filter(pk=user_id).first()
+        if user is None:
+            return None
+
+        with self.lock:
+            if generation == self.generation:
+                now = time.monotonic()
+                self.entries[key] = (now + self.ttl, version, user, now + self.recheck)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return copy.copy(user)
+
+    def invalidate(self, user_id):
+        """Drop the user here and make every other process reload it."""
+        get_cache().set(_version_key(user_id), uuid.uuid4().hex, None)
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+_user_cache = None
+
+
+def get_user_cache():
+    global _user_cache
+    if _user_cache is None:
+        _user_cache = UserCache(
+            getattr(settings, "SHOPPING_LIST_USER_CACHE_TTL", 60),
+            getattr(settings, "SHOPPING_LIST_USER_CACHE_SIZE", 1000),
+            getattr(settings, "SHOPPING_LIST_USER_CACHE_RECHECK", 1),
+        )
+    return _user_cache
+
+
+@receiver(setting_changed)
+def reset_user_cache(setting, **kwargs):
+    global _user_cache
+    if setting.startswith("SHOPPING_LIST_USER_CACHE_"):
+        _user_cache = None